@@ -0,0 +1,147 @@
+"""
+Module: Activity_query
+
+Activity query module answers ad-hoc questions about audited activities saved in the activity store (see Util_activity_store),
+for example "who truncated BILLDB.BB_LOG_MERGE in April" or "all activity from host 10.24.4.6", without parsing AUD files again.
+
+Activity store is written by Activity_report_generator.py when activity_store = 1 ([ACTIVITY_REPORT] section of config.properties),
+in {local_dir_reports}/activity_store/{YYYYMM}/{db}.sqlite. Filters use the store indexes on user, host, schema/table, activity and time.
+
+Parameters are sent as name=value:
+    month       Month partition (YYYYMM)
+    db          Database partition
+    user, host, schema, table, activity, query_hash, file
+                Equality filters
+    from, to    Time range, from is included and to is excluded (2024-04-01 or 2024-04-17 03:00:00)
+    group_by    Counts activities by user, host, schema, tablename, activity, query_hash, file, day, month, hour or db
+    limit       Maximum number of activities showed
+
+Result is showed in console, tab separated like activity report:
+    Fecha y Hora	Usuario de BD	Hostname	Linea	Actividad	Schema	Table	Query	Archivo	DB
+
+Imports:
+    - os
+    - logging
+    - datetime
+    - time
+    - traceback
+    - Util_files.read_config
+    - Util_activity_store.queryActivityStore
+    - Util_activity_store.joinActivityRow
+    - Util_activity_store.FILTER_COLUMNS
+    - sys
+
+Functions:
+    1. getQueryParameters(args)
+    2. activity_query(args)
+    3. main()
+
+Usage Examples:
+    1. Who truncated BILLDB.BB_LOG_MERGE in April:
+    python.exe Activity_query.py "schema=BILLDB" "table=BB_LOG_MERGE" "activity=Truncate" "month=202404"
+
+    2. All activity from host 10.24.4.6 in a time range:
+    python.exe Activity_query.py "host=10.24.4.6" "from=2024-04-01" "to=2024-05-01"
+
+    3. Drops by user across three months, counted by day:
+    python.exe Activity_query.py "user=GONZALESV" "activity=Drop" "from=2024-02-01" "to=2024-05-01" "group_by=day"
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240512
+"""
+
+import os
+import logging
+import datetime
+import time
+import traceback
+from Util_files import read_config
+from Util_activity_store import queryActivityStore, joinActivityRow, FILTER_COLUMNS
+import sys
+
+# Parameter names that are not the same as store columns
+QUERY_PARAMETERS = {'table': 'tablename', 'from': 'time_from', 'to': 'time_to'}
+# Parameters that are not store filters
+QUERY_OPTIONS = ['month', 'db', 'group_by', 'limit']
+
+def getQueryParameters(args):
+    """
+    Converts name=value arguments to store filters
+
+    Examples:
+        >>> getQueryParameters(['table=BB_LOG_MERGE', 'activity=truncate', 'month=202404'])
+        {'tablename': 'BB_LOG_MERGE', 'activity': 'Truncate', 'month': '202404'}
+        >>> getQueryParameters(['tabla=BB_LOG_MERGE'])
+        Traceback (most recent call last):
+        ...
+        ValueError: Unknown parameter: tabla
+    """
+    parameters = {}
+    for arg in args:
+        name, separator, value = arg.partition('=')
+        if separator == '':
+            raise ValueError(f'Parameter must be sent as name=value: {arg}')
+        name = name.strip().lower()
+        value = value.strip()
+        column = QUERY_PARAMETERS.get(name, name)
+        if column not in FILTER_COLUMNS and column not in QUERY_OPTIONS and column not in QUERY_PARAMETERS.values():
+            # A misspelled filter would return all activities
+            raise ValueError(f'Unknown parameter: {name}')
+        if name == 'activity':
+            # Activities are saved as Insert, Update, Delete, Truncate and Drop
+            value = value.capitalize()
+        parameters[column] = value
+    return parameters
+
+def activity_query(args):
+    #
+    config = read_config(f'{os.path.dirname(os.path.abspath(__file__))}\\config.properties')
+    #
+    local_server = config['LOCAL_SERVER']
+    local_dir_reports = local_server['local_dir_reports']
+    local_dir_logs = local_server['local_dir_logs']
+    activity_store_dir = f'{local_dir_reports}/activity_store'
+    #
+    logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    log_filename = f'{local_dir_logs}/activity_query_{logFileDateStr}.log'
+    logging_defined_before = logging.getLogger().hasHandlers() 
+    if not logging_defined_before:
+        logging.basicConfig(filename= f'{log_filename}', level=logging.INFO, format='%(asctime)s\t%(message)s', datefmt='%Y-%m-%d %I:%M:%S %p')
+    #
+    logging.info(f'Script running: {os.path.basename(__file__)}')
+    logging.info(f'Query parameters: {args}')
+    #
+    result = 'OK'
+    try:
+        parameters = getQueryParameters(args)
+        month_str = parameters.pop('month', '')
+        dbName = parameters.pop('db', '')
+        group_by = parameters.pop('group_by', '')
+        group_by = QUERY_PARAMETERS.get(group_by, group_by)
+        limit = int(parameters.pop('limit', '0'))
+        startTime = time.perf_counter()
+        activities = queryActivityStore(activity_store_dir, parameters, month_str, dbName, group_by, limit)
+        elapsedTime = time.perf_counter() - startTime
+        if group_by != '':
+            print(f'{group_by}\tActividades')
+        else:
+            print("Fecha y Hora        " + "\tUsuario de BD" + "\tHostname" + "\tLinea" + "\tActividad" + "\tSchema" + "\tTable" + "\tQuery" + "\tArchivo" + "\tDB")
+        for activity in activities:
+            print(joinActivityRow(activity))
+        logging.info(f'Results found: {len(activities)} in {elapsedTime * 1000:.1f} ms')
+    except Exception as e:
+        logging.error('Exception occurred:' )
+        logging.error(f'{e}')
+        logging.error(f'Traceback: {traceback.format_exc()}')
+        print(f'{e}')
+        result = 'ERROR'
+    return result
+
+def main():
+    #Call example: python.exe Activity_query.py "schema=BILLDB" "table=BB_LOG_MERGE" "activity=Truncate" "month=202404"
+    result = activity_query(sys.argv[1:])
+    print (result)
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,11 @@ The database audited activity are: Insert, Update, Delete, Truncate and Drop
 
 The main function is checkForAuditedActivities. This function parse all AUD files in a directory (parameter local_dir_audit_files_by_db defined in config.properties file) to search for audited activities.
 All data from audited activities founded is saved in a report file named as activity_report-{logFileDateStr}.txt
+When read_archives is enabled, AUD files of months already compressed ({month}_db_aud_files.tar.gz, .gzm or .cas) are streamed out of the archives, nothing is extracted to disk
+When parse_cache is enabled, files that only grew since last execution are parsed from the checkpoint saved in cache, only appended bytes are read (see parseAudFileTail)
+SQLTEXT of a statement is kept in memory up to sqltext_max_kb, the rest of a bigger text is truncated or spilled to {local_dir_reports}/sqltext_spill (see SqlTextAssembler)
+SQLTEXT ends at its declared length SQLTEXT:[n], a record whose text does not end with a quote there is malformed and it is ignored (see getSqlTextLineStatus)
+When activity_store is enabled, activities are also saved in an indexed store ({local_dir_reports}/activity_store/{YYYYMM}/{db}.sqlite) and report lines are written from it
 logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
 
 A content example of audit file (.aud) is (without hyphens):
@@ -61,16 +66,46 @@ Imports:
     - os
     - logging
     - configparser
-    - re
     - datetime
     - Util_string.getAuditedActivity
     - Util_string.getDataBetween
     - Util_string.getObjectNameFromQuery
+    - Util_string.tokenizeAudRecord
+    - Util_string.AudRecord
     - Util_files.writeScriptsChecksumInLog
     - Util_files.read_config
+    - Util_files.getFileCatalog
+    - Util_files.readChecksumManifests
+    - Util_files.getTrustedChecksum
+    - Util_files.readArchiveIndex
+    - Util_files.openIndexedArchiveMember
+    - Util_files.readContentArchive
+    - Util_files.openContentArchiveMember
+    - Util_files.ArchiveSection
+    - Util_parse_cache.openParseCache
+    - Util_parse_cache.getCachedParse
+    - Util_parse_cache.getParseCheckpoint
+    - Util_parse_cache.putCachedParse
+    - Util_parse_cache.evictParseCache
+    - Util_activity_store.storeActivityRows
+    - Util_activity_store.readActivityRows
+    - Util_activity_store.closeActivityStores
+    - Util_matcher.getDateFileMatcher
+    - Util_matcher.getContainsMatcher
+    - Util_compression.openCompressedReader
+    - Util_metrics.measuredStage
+    - Util_metrics.addStageCounters
+    - Util_metrics.writeMetrics
     - traceback
-    - glob
     - sys
+    - concurrent.futures.ProcessPoolExecutor
+    - functools.partial
+    - mmap
+    - locale
+    - io
+    - tarfile
+    - codecs
+    - collections.namedtuple
 
 Functions:
     1. getUserDB(line)
@@ -78,10 +113,26 @@ Functions:
     3. getTable(objectName)
     4. getSchema(objectName, userDB)
     5. getDate(dateLine)
-    6. getQuery(line)
-    7. checkForAuditedActivities(dir, month_str='', exceptfiles='', add_summary_report='0')
-    8. activity_report_generator(month_str)
-    9. main()
+    6. getActivityRow(fecha, record, query, queryLineNumber, file)
+    7. SqlTextAssembler(file, limits=None)
+    8. countNewLines(mm, start, end)
+    9. getSqlTextEnd(lineBytes, lineStart, sqltextLength)
+    10. getSqlTextLineStatus(lineBytes, remaining)
+    11. decodeMmapText(data, encoding)
+    12. parseAudFileMmap(file, sqltext_limits=None)
+    13. parseAudFile(file, report_scanner='text', sqltext_limits=None)
+    14. getCompleteLinesEnd(myfile, offset, size)
+    15. parseAudFileTail(file, checkpoint=None, sqltext_limits=None)
+    16. parseAudFileResumable(file, checkpoint=None, report_scanner='text', sqltext_limits=None)
+    17. parseAudLines(myfile, file, sqltext_limits=None)
+    18. getFileLineBytes(line, encoding, myfile)
+    19. parseAudLinesFrom(myfile, file, n=0, state=None, sqltext_limits=None)
+    20. parseAudArchive(archive, dir, month_str='', exceptfiles='', sqltext_limits=None)
+    21. getSqlTextLimits(config, local_dir_reports)
+    22. getParseCacheScanner(report_scanner, sqltext_limits=None)
+    23. checkForAuditedActivities(dir, month_str='', exceptfiles='', add_summary_report='0', report_workers=1, report_scanner='text', parse_cache_path='', parse_cache_max_mb=512, activity_store_dir='', read_archives='0', sqltext_limits=None)
+    24. activity_report_generator(month_str)
+    25. main()
 
 Usage Examples:
     1. Checking for audited activities in a directory:
@@ -101,20 +152,41 @@ Last update: 20240512
 
 import os
 import logging, configparser
-import re
 import datetime
-from Util_string import getAuditedActivity, getDataBetween, getObjectNameFromQuery
-from Util_files import writeScriptsChecksumInLog, read_config
+from Util_string import getAuditedActivity, getDataBetween, getObjectNameFromQuery, tokenizeAudRecord, AudRecord
+from Util_files import writeScriptsChecksumInLog, read_config, getFileCatalog, readChecksumManifests, getTrustedChecksum, readArchiveIndex, openIndexedArchiveMember, readContentArchive, openContentArchiveMember, ArchiveSection, ARCHIVE_FORMATS, ARCHIVE_EXTENSIONS
+from Util_parse_cache import openParseCache, getCachedParse, getParseCheckpoint, putCachedParse, evictParseCache
+from Util_activity_store import storeActivityRows, readActivityRows, closeActivityStores
+from Util_matcher import getDateFileMatcher, getContainsMatcher
+from Util_compression import openCompressedReader
+from Util_metrics import measuredStage, addStageCounters, writeMetrics
 import traceback
-import glob
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import mmap
+import locale
+import io
+import tarfile
+import codecs
+from collections import namedtuple
+
+# Successful statement marker searched by mmap scanner
+SUCCESS_MARKER = b'RETURNCODE:[8] "GS-00000"'
+# Bytes copied at once from memory-mapped file when lines are counted
+MMAP_COUNT_BLOCK_SIZE = 16 * 1024 * 1024
+# Bytes read at once from the end of file when last complete line is searched
+TAIL_BLOCK_SIZE = 64 * 1024
+# Limits of SQLTEXT assembly, see SqlTextAssembler. max_chars 0: no limit. overflow: truncate or spill. spill_dir: directory of spill files
+SqlTextLimits = namedtuple('SqlTextLimits', ['max_chars', 'overflow', 'spill_dir'])
+NO_SQLTEXT_LIMITS = SqlTextLimits(0, 'truncate', '')
 
 def getUserDB(line):
     # SESSIONID:[2] "75" STMTID:[1] "0" USER:[15] "LONG_USER_NAME1" HOST:[9] "127.0.0.1" ACTION:[7] "PREPARE" 
-    return getDataBetween(line, "USER:", "HOST:", "]")
+    return tokenizeAudRecord(line).user.strip()
 
 def getHost(line):
-    return getDataBetween(line, "HOST:", "ACTION:", "]")
+    return tokenizeAudRecord(line).host.strip()
 
 def getTable(objectName):
     result = objectName
@@ -137,41 +209,597 @@ def getDate(dateLine):
     result = dateLine.split(":00 ")[1].strip()
     return result
 
-def getQuery(line):
+def getActivityRow(fecha, record, query, queryLineNumber, file):
     """
-    Extracts SQL statement from a string like this
-        SESSIONID:[2] "75" STMTID:[1] "0" USER:[15] "LONG_USER_NAME1" HOST:[9] "127.0.0.1" ACTION:[7] "PREPARE" RETURNCODE:[8] "GS-01001" SQLTEXT:[89] "UPDATE SCHEM1.SOME_TABLE1 SET RECHARGE_AMT=10000 WHERE RECHARGE_LOG_ID=138300010024049163"
+    Builds the report line of a complete statement, or returns '' if it is not an audited activity.
+    """
+    row = ''
+    auditedActivity = getAuditedActivity(query)
+    if auditedActivity != "":
+        userDB = record.user
+        host = record.host
+        objectName = getObjectNameFromQuery(query, auditedActivity)
+        schema = getSchema(objectName, userDB)
+        table = getTable(objectName)
+        time = getDate(fecha)
+        row = time + "\t" + userDB+ "\t" + host + "\t" + str(queryLineNumber) + "\t" + auditedActivity + "\t" + schema + "\t" + table + "\t" + query + "\t" + file
+    return row
+
+class SqlTextAssembler:
+    """
+    Assembles the SQLTEXT of one statement from the statement line and its next lines. Pieces are kept in a list and joined once,
+    and only the first max_chars characters are kept in memory. When text is longer (bulk INSERT) the rest is ignored (overflow = truncate)
+    or the whole text is written to {spill_dir}/{db}_{file}.{line}.sql (overflow = spill). The report query of a longer text ends with ' ...' and the spill file path.
+    Text of a malformed record is discarded, its spill file is deleted.
+    """
+    def __init__(self, file, limits=None):
+        self.file = file
+        self.limits = limits or NO_SQLTEXT_LIMITS
+        self.spillFile = None
+        self.reset()
+
+    def reset(self, lineNumber=0):
+        self.close()
+        self.parts = []
+        self.length = 0
+        self.lineNumber = lineNumber
+        self.spillPath = ''
+        self.spillBytes = 0
+
+    def add(self, text):
+        maxChars = self.limits.max_chars
+        if maxChars > 0 and self.length + len(text) > maxChars:
+            if self.limits.overflow == 'spill':
+                self.spill(text)
+            if self.length < maxChars:
+                self.parts.append(text[:maxChars - self.length])
+        else:
+            self.parts.append(text)
+        self.length = self.length + len(text)
+
+    def spill(self, text):
+        if self.spillPath == '':
+            # First text after limit: text kept before it is the beginning of spill file
+            self.spillPath = os.path.join(self.limits.spill_dir, f'{os.path.basename(os.path.dirname(self.file))}_{os.path.basename(self.file)}.{self.lineNumber}.sql')
+            self.spillFile = open(self.spillPath, 'wb')
+            text = ''.join(self.parts) + text
+        elif self.spillFile is None:
+            # Parsing resumed from a checkpoint: bytes written after it are written again
+            self.spillFile = open(self.spillPath, 'r+b')
+            self.spillFile.truncate(self.spillBytes)
+            self.spillFile.seek(self.spillBytes)
+        data = text.encode('utf-8', errors='replace')
+        self.spillFile.write(data)
+        self.spillBytes = self.spillBytes + len(data)
+
+    def getQuery(self):
+        query = ''.join(self.parts).replace('"', '').strip()
+        if self.limits.max_chars > 0 and self.length > self.limits.max_chars:
+            query = query + ' ...' + ('' if self.spillPath == '' else f' {self.spillPath}')
+        self.close()
+        return query
+
+    def getState(self):
+        return {'query': ''.join(self.parts), 'queryLength': self.length, 'spillPath': self.spillPath, 'spillBytes': self.spillBytes}
+
+    def setState(self, state, lineNumber):
+        self.reset(lineNumber)
+        self.parts = [state['query']] if state['query'] != '' else []
+        self.length = state.get('queryLength', len(state['query']))
+        self.spillPath = state.get('spillPath', '')
+        self.spillBytes = state.get('spillBytes', 0)
+
+    def discard(self):
+        # Statement without a valid end: nothing is reported and spill file is deleted
+        spillPath = self.spillPath
+        self.reset()
+        if spillPath != '' and os.path.exists(spillPath):
+            os.remove(spillPath)
+
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+            self.spillFile = None
+
+def countNewLines(mm, start, end):
+    # Counted by blocks, so big regions are not copied at once
+    counter = 0
+    while start < end:
+        blockEnd = min(end, start + MMAP_COUNT_BLOCK_SIZE)
+        counter = counter + mm[start:blockEnd].count(b'\n')
+        start = blockEnd
+    return counter
+
+def getSqlTextEnd(lineBytes, lineStart, sqltextLength):
+    # Position in file of the closing quote of SQLTEXT according to its declared length SQLTEXT:[n], -1 when statement line has no SQLTEXT
+    sqltextKey = lineBytes.find(b'SQLTEXT:[')
+    valueStart = lineBytes.find(b'"', sqltextKey) + 1 if sqltextKey >= 0 else 0
+    return lineStart + valueStart + sqltextLength if valueStart > 0 else -1
+
+def getSqlTextLineStatus(lineBytes, remaining):
+    """
+    Continuation line of a multi-line SQLTEXT: returns 'open' when the text continues in next lines, 'closed' when it ends in this line,
+    or 'malformed' when the byte at its declared length is not the closing quote.
+    remaining: bytes of declared length SQLTEXT:[n] not read before this line. Quotes inside the declared length are part of the text,
+    and text is never read after it, so a record without closing quote does not take the next records.
+
+    Examples:
+        >>> getSqlTextLineStatus(b'WHERE NAME = "A"\\n', 30)
+        'open'
+        >>> getSqlTextLineStatus(b'WHERE NAME = "A""\\n', 16)
+        'closed'
+        >>> getSqlTextLineStatus(b'WHERE NAME = "A"\\n', 10)
+        'malformed'
+    """
+    if remaining >= len(lineBytes):
+        return 'open'
+    if remaining >= 0 and lineBytes[remaining:remaining + 1] == b'"':
+        return 'closed'
+    return 'malformed'
+
+def decodeMmapText(data, encoding):
+    # Line endings are translated like text scanner does (universal newlines), so both scanners give same query text
+    return data.decode(encoding, errors='replace').replace('\r\n', '\n')
+
+def parseAudFileMmap(file, sqltext_limits=None):
+    """
+    Same as parseAudFile, but the file is memory-mapped and bytes.find jumps straight to successful statements (GS-00000).
+    Only statement lines, their multi-line SQLTEXT and their date lines are decoded, the rest of the file never becomes str objects.
+    A multi-line SQLTEXT is taken at once using its declared length SQLTEXT:[n] when the closing quote is found there,
+    otherwise it is read line by line (see getSqlTextLineStatus). Report lines are the same as parseAudFile ones.
+
+    Examples:
+        Both scanners return the same report lines, with LF or CRLF line endings:
+        >>> import random, tempfile, shutil
+        >>> from Aud_file_generator import generateAudFile
+        >>> tmpDir = tempfile.mkdtemp()
+        >>> lfFile, crlfFile = os.path.join(tmpDir, 'lf.aud'), os.path.join(tmpDir, 'crlf.aud')
+        >>> _ = generateAudFile(lfFile, datetime.datetime(2024, 5, 1), 50000, random.Random(1), multiline_ratio=0.5)
+        >>> _ = generateAudFile(crlfFile, datetime.datetime(2024, 5, 1), 50000, random.Random(1), multiline_ratio=0.5, newline='\\r\\n')
+        >>> rows, lines, error = parseAudFileMmap(lfFile)
+        >>> len(rows) > 0 and error is None and (rows, lines, error) == parseAudFile(lfFile, 'text')
+        True
+        >>> crlfRows = parseAudFileMmap(crlfFile)[0]
+        >>> crlfRows == parseAudFile(crlfFile, 'text')[0]
+        True
+        >>> [row.replace(crlfFile, lfFile) for row in crlfRows] == rows[:len(crlfRows)]
+        True
+        >>> shutil.rmtree(tmpDir)
+    """
+    rows = []
+    n = 0
+    line = ''
+    encoding = locale.getpreferredencoding(False)
+    query = SqlTextAssembler(file, sqltext_limits)
+    try:
+        with open(file, 'rb') as myfile:
+            size = os.fstat(myfile.fileno()).st_size
+            if size == 0:
+                return rows, n, None
+            with mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                countedPosition = 0
+                countedLines = 1
+                position = 0
+                while True:
+                    hit = mm.find(SUCCESS_MARKER, position)
+                    if hit < 0:
+                        break
+                    lineStart = mm.rfind(b'\n', 0, hit) + 1
+                    lineEnd = mm.find(b'\n', hit)
+                    lineEnd = size if lineEnd < 0 else lineEnd + 1
+                    lineBytes = mm[lineStart:lineEnd]
+                    position = lineEnd
+                    if b'UTC-4:' in lineBytes or b'LENGTH:' in lineBytes or not (b'PREP_EXEC' in lineBytes or b'EXECUTE' in lineBytes):
+                        continue
+                    countedLines = countedLines + countNewLines(mm, countedPosition, lineStart)
+                    countedPosition = lineStart
+                    queryLineNumber = countedLines
+                    line = decodeMmapText(lineBytes, encoding)
+                    record = tokenizeAudRecord(line)
+                    query.reset(queryLineNumber)
+                    query.add(record.sqltext)
+                    dateStart = mm.rfind(b'UTC-4:', 0, lineStart)
+                    fecha = ''
+                    if dateStart >= 0:
+                        fecha = mm[mm.rfind(b'\n', 0, dateStart) + 1:lineStart].split(b'\n', 1)[0].decode(encoding, errors='replace').rstrip('\r')
+                    closingQuote = getSqlTextEnd(lineBytes, lineStart, record.sqltext_length) if not record.sqltext_complete else -1
+                    # A statement line without SQLTEXT has no text to read in next lines
+                    queryEnVariasLineas = closingQuote >= 0
+                    if position <= closingQuote < size and mm[closingQuote:closingQuote + 1] == b'"':
+                        closingLineEnd = mm.find(b'\n', closingQuote)
+                        closingLineEnd = size if closingLineEnd < 0 else closingLineEnd + 1
+                        if mm.find(b'UTC-4:', position, closingLineEnd) < 0 and mm.find(b'LENGTH:', position, closingLineEnd) < 0 and mm.find(SUCCESS_MARKER, position, closingLineEnd) < 0:
+                            # Same text than line by line reading: decoded by blocks, so only max_chars characters are kept in memory
+                            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(errors='replace'), translate=True)
+                            for blockStart in range(position, closingLineEnd, MMAP_COUNT_BLOCK_SIZE):
+                                blockEnd = min(closingLineEnd, blockStart + MMAP_COUNT_BLOCK_SIZE)
+                                query.add(decoder.decode(mm[blockStart:blockEnd], final=blockEnd == closingLineEnd))
+                            position = closingLineEnd
+                            queryEnVariasLineas = False
+                    # Multi-line SQLTEXT is read following text scanner rules
+                    remaining = closingQuote - position
+                    while queryEnVariasLineas and position < size:
+                        nextLineEnd = mm.find(b'\n', position)
+                        nextLineEnd = size if nextLineEnd < 0 else nextLineEnd + 1
+                        lineBytes = mm[position:nextLineEnd]
+                        if SUCCESS_MARKER in lineBytes and (b'PREP_EXEC' in lineBytes or b'EXECUTE' in lineBytes) and not (b'UTC-4:' in lineBytes or b'LENGTH:' in lineBytes):
+                            # A new statement starts before closing quote: it is processed by main loop
+                            break
+                        position = nextLineEnd
+                        line = decodeMmapText(lineBytes, encoding)
+                        if 'UTC-4:' in line:
+                            fecha = line
+                        elif 'LENGTH:' in line:
+                            continue
+                        else:
+                            sqltextStatus = getSqlTextLineStatus(lineBytes, remaining)
+                            if sqltextStatus == 'malformed':
+                                query.discard()
+                            else:
+                                query.add(line)
+                            queryEnVariasLineas = sqltextStatus == 'open'
+                            remaining = remaining - len(lineBytes)
+                    if queryEnVariasLineas and position < size:
+                        # Next statement starts before closing quote
+                        query.discard()
+                    if not queryEnVariasLineas and query.length > 0:
+                        row = getActivityRow(fecha, record, query.getQuery(), queryLineNumber, file)
+                        if row != '':
+                            rows.append(row)
+                n = countedLines - 1 + countNewLines(mm, countedPosition, size) + (0 if mm[size - 1:size] == b'\n' else 1)
+    except Exception as e:
+        return rows, n, (f'{e}', traceback.format_exc(), line)
+    finally:
+        query.close()
+    return rows, n, None
+
+def parseAudFile(file, report_scanner='text', sqltext_limits=None):
+    """
+    Parses one AUD file searching for audited activities.
+    It is executed in a worker process when report runs in parallel mode, so it does not write to log.
 
     Args:
-        line (str): The line containing the SQL statement.
+        file (str): The AUD file path.
+        report_scanner (str): text: File is read line by line. mmap: see parseAudFileMmap
+        sqltext_limits (SqlTextLimits): Limits of SQLTEXT kept in memory, see SqlTextAssembler. None: no limit
+
+    Returns:
+        tuple: (rows, lines, error)
+            rows: list of report lines, one for each audited activity, in file order
+            lines: number of lines read
+            error: None, or (exception, traceback, line) when file could not be parsed
 
     Examples:
-        >>> getQuery(line)
-        UPDATE SCHEM1.SOME_TABLE1 SET RECHARGE_AMT=10000 WHERE RECHARGE_LOG_ID=138300010024049163
-    """        
-    query = ''
-    n = line.find('SQLTEXT:') 
-    if n >= 0:
-        querytmp= line.split("SQLTEXT:",1)[1] #[89] "UPDATE SCHEM1.SOME_TABLE1 SET RECHARGE_AMT=10000 WHERE RECHARGE_LOG_ID=138300010024049163"
-        cantidadCar = querytmp.split("[")[1].split("]")[0] #89
-        cantidadCar = int(cantidadCar) + 2
-        query = querytmp[-cantidadCar:] # "UPDATE SCHEM1.SOME_TABLE1 SET RECHARGE_AMT=10000 WHERE RECHARGE_LOG_ID=138300010024049163"
-        if "[" in query:
-            query = "null|"+str(cantidadCar)
-        else:
-            query = query+"|"+str(cantidadCar)
-    else:
-        query =  'null|0'	
-    return query
+        A SQLTEXT without closing quote at its declared length is ignored: next records are parsed and nothing is spilled:
+        >>> import tempfile, shutil
+        >>> workDir = tempfile.mkdtemp()
+        >>> file = os.path.join(workDir, 'zengine_20240503.aud')
+        >>> statement = 'SESSIONID:[3] "977" USER:[4] "USR1" HOST:[9] "127.0.0.1" ACTION:[21] "PREP_EXEC[AUTOCOMMIT]" RETURNCODE:[8] "{}" SQLTEXT:[{}] "{}'
+        >>> with open(file, 'w') as audFile:
+        ...     _ = audFile.write('UTC-4:00 2024-05-03 00:00:01.000\\nLENGTH: "300"\\n' + statement.format('GS-00000', 60, ' \\n') + ' delete from SCHEM1.T1 where ID = 1\\n\\n')
+        ...     _ = audFile.write('UTC-4:00 2024-05-03 00:00:02.000\\nLENGTH: "200"\\n' + statement.format('GS-00001', 20, 'DROP TABLE SCHEM1.T2"\\n') + '\\n')
+        ...     _ = audFile.write('UTC-4:00 2024-05-03 00:00:03.000\\nLENGTH: "200"\\n' + statement.format('GS-00000', 20, 'DROP TABLE SCHEM1.T3"\\n') + '\\n')
+        >>> limits = SqlTextLimits(20, 'spill', workDir)
+        >>> rows, lines, error = parseAudFile(file, 'text', limits)
+        >>> [row.split('\\t')[3:7] for row in rows], lines, error
+        ([['12', 'Drop', 'SCHEM1', 'T3']], 13, None)
+        >>> parseAudFile(file, 'mmap', limits) == (rows, lines, error)
+        True
+        >>> os.listdir(workDir)
+        ['zengine_20240503.aud']
+        >>> shutil.rmtree(workDir)
+    """
+    if report_scanner == 'mmap':
+        return parseAudFileMmap(file, sqltext_limits)
+    try:
+        with open(file) as myfile:
+            return parseAudLines(myfile, file, sqltext_limits)
+    except Exception as e:
+        return [], 0, (f'{e}', traceback.format_exc(), '')
+
+def getCompleteLinesEnd(myfile, offset, size):
+    # Position after last new line between offset and size. Bytes after it are a line that zengine is still writing
+    position = size
+    while position > offset:
+        start = max(offset, position - TAIL_BLOCK_SIZE)
+        myfile.seek(start)
+        index = myfile.read(position - start).rfind(b'\n')
+        if index >= 0:
+            return start + index + 1
+        position = start
+    return offset
+
+def parseAudFileTail(file, checkpoint=None, sqltext_limits=None):
+    """
+    Parses an AUD file from a checkpoint of a previous parse (text scanner), so only bytes appended since then are read.
+    Rows and lines are the same ones parseAudFile finds reading the whole file.
 
+    Args:
+        file (str): The AUD file path.
+        checkpoint (tuple): (offset, lines, rowCount, state) returned by a previous call. None: file is parsed from line 1
+
+    Returns:
+        tuple: (rows, lines, error, checkpoint)
+            rows: report lines found after checkpoint offset
+            lines: number of lines of the file, lines before checkpoint included
+            error: see parseAudFile
+            checkpoint: (offset, lines, rowCount, state) after last complete line of file. rowCount: rows found before offset.
+                state: pending statement of a multi-line SQLTEXT, see parseAudLinesFrom. None when file could not be parsed
+    """
+    offset, n, state = (0, 0, None) if checkpoint is None else checkpoint[0:2] + (checkpoint[3],)
+    rows = []
+    encoding = locale.getpreferredencoding(False)
+    try:
+        with open(file, 'rb') as rawFile:
+            size = os.fstat(rawFile.fileno()).st_size
+            completeEnd = getCompleteLinesEnd(rawFile, offset, size)
+            with io.TextIOWrapper(io.BufferedReader(ArchiveSection(rawFile, offset, completeEnd - offset)), encoding=encoding) as myfile:
+                rows, n, error, state = parseAudLinesFrom(myfile, file, n, state, sqltext_limits)
+            if error is not None:
+                return rows, n, error, None
+            newCheckpoint = (completeEnd, n, len(rows), state)
+            if completeEnd < size:
+                # Last line is reported now, but it is parsed again from checkpoint when file grows
+                rawFile.seek(completeEnd)
+                with io.TextIOWrapper(io.BytesIO(rawFile.read(size - completeEnd)), encoding=encoding) as myfile:
+                    lastRows, n, error, lastState = parseAudLinesFrom(myfile, file, n, state, sqltext_limits)
+                rows = rows + lastRows
+                if error is not None:
+                    return rows, n, error, None
+    except Exception as e:
+        return rows, n, (f'{e}', traceback.format_exc(), ''), None
+    return rows, n, None, newCheckpoint
 
-def checkForAuditedActivities(dir, month_str='',exceptfiles='', add_summary_report='0'):
+def parseAudFileResumable(file, checkpoint=None, report_scanner='text', sqltext_limits=None):
+    """
+    Same as parseAudFileTail for text scanner. mmap scanner always parses the whole file and returns None as checkpoint.
+    """
+    if report_scanner == 'mmap':
+        return parseAudFileMmap(file, sqltext_limits) + (None,)
+    return parseAudFileTail(file, checkpoint, sqltext_limits)
+
+def parseAudLines(myfile, file, sqltext_limits=None):
+    """
+    Parses the lines of one AUD file searching for audited activities (text scanner). Lines can be read from disk or from an archive member.
+
+    Args:
+        myfile (iterable): AUD file lines.
+        file (str): AUD file path written in report lines.
+        sqltext_limits (SqlTextLimits): Limits of SQLTEXT kept in memory, see SqlTextAssembler. None: no limit
+
+    Returns:
+        tuple: (rows, lines, error), see parseAudFile
+    """
+    rows, n, error, state = parseAudLinesFrom(myfile, file, sqltext_limits=sqltext_limits)
+    return rows, n, error
+
+def getFileLineBytes(line, encoding, myfile):
+    # Bytes of a line read in text mode as they are in file
+    lineBytes = line.encode(encoding, errors='replace')
+    if getattr(myfile, 'newlines', None) == '\r\n' and lineBytes.endswith(b'\n'):
+        lineBytes = lineBytes[:-1] + b'\r\n'
+    return lineBytes
+
+def parseAudLinesFrom(myfile, file, n=0, state=None, sqltext_limits=None):
+    """
+    Same as parseAudLines, but lines can be the continuation of lines parsed before.
+
+    Args:
+        n (int): Number of lines parsed before, line numbers of report lines continue from it.
+        state (dict): Statement pending when lines parsed before ended in the middle of a multi-line SQLTEXT. None: no statement pending
+
+    Returns:
+        tuple: (rows, lines, error, state). state can be saved as JSON and given to next call
+    """
+    rows = []
+    line = ''
+    query = SqlTextAssembler(file, sqltext_limits)
+    # Declared length SQLTEXT:[n] counts bytes of file: lines are encoded again, with \r\n when file uses it (universal newlines translate it)
+    encoding = getattr(myfile, 'encoding', None) or locale.getpreferredencoding(False)
+    try:
+        fecha = ''
+        record = None
+        queryLineNumber = 0
+        restarVars = False
+        queryEnVariasLineas = False
+        sqltextRemaining = -1
+        if state is not None:
+            fecha = state['fecha']
+            queryLineNumber = state['queryLineNumber']
+            queryEnVariasLineas = state['queryEnVariasLineas']
+            sqltextRemaining = state.get('sqltextRemaining', -1)
+            record = None if state['record'] is None else AudRecord(*state['record'])
+            query.setState(state, queryLineNumber)
+        for line in myfile:
+            n = n + 1
+            if 'UTC-4:' in line:
+                fecha = line
+            elif 'LENGTH:' in line:
+                longitud = line
+            elif 'RETURNCODE:[8] "GS-00000"' in line and ('PREP_EXEC' in line or 'EXECUTE' in line):
+            #elif  ('PREPARE' in line or 'PREP_EXEC' in line or 'EXECUTE' in line):
+                # Statement line is read once, all record fields are taken from it.
+                # SQL text after the opening quote of a multi-line SQLTEXT is part of the query (baseline getQuery discarded it)
+                record = tokenizeAudRecord(line)
+                queryLineNumber = n
+                if queryEnVariasLineas:
+                    # Next statement starts before closing quote
+                    query.discard()
+                query.reset(queryLineNumber)
+                query.add(record.sqltext)
+                # A statement line without SQLTEXT has no text to read in next lines
+                queryEnVariasLineas = not record.sqltext_complete and 'SQLTEXT:[' in line
+                if queryEnVariasLineas:
+                    sqltextRemaining = record.sqltext_length - len(getFileLineBytes(record.sqltext, encoding, myfile))
+                else:
+                    sqltextRemaining = -1
+            elif queryEnVariasLineas:
+                lineBytes = getFileLineBytes(line, encoding, myfile)
+                # Text ends at its declared length, a quote inside the text does not end it
+                sqltextStatus = getSqlTextLineStatus(lineBytes, sqltextRemaining)
+                if sqltextStatus == 'malformed':
+                    query.discard()
+                    restarVars = True
+                else:
+                    query.add(line)
+                queryEnVariasLineas = sqltextStatus == 'open'
+                sqltextRemaining = sqltextRemaining - len(lineBytes)
+            elif line.strip() == '':
+                #Reset variables
+                restarVars = True
+            # If audited activity is founded then logging all related data
+            if not queryEnVariasLineas and query.length > 0:
+                row = getActivityRow(fecha, record, query.getQuery(), queryLineNumber, file)
+                if row != '':
+                    rows.append(row)
+                #Reset variables
+                restarVars = True
+            #
+            if restarVars:
+                query.reset()
+                record = None
+                queryLineNumber = 0
+                restarVars = False
+                queryEnVariasLineas = False
+    except Exception as e:
+        return rows, n, (f'{e}', traceback.format_exc(), line), None
+    finally:
+        query.close()
+    state = {'fecha': fecha, 'queryLineNumber': queryLineNumber, 'queryEnVariasLineas': queryEnVariasLineas,
+             'record': None if record is None else list(record), 'sqltextRemaining': sqltextRemaining}
+    state.update(query.getState())
+    return rows, n, None, state
+
+class ArchiveMemberReader(io.RawIOBase):
+    # Member of an archive read in streaming mode can not seek, io.TextIOWrapper needs a reader that says it
+    def __init__(self, memberFile):
+        self.memberFile = memberFile
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, buffer):
+        data = self.memberFile.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def parseAudArchive(archive, dir, month_str='', exceptfiles='', sqltext_limits=None):
+    """
+    Parses AUD files saved in a tar archive (.tar.gz, .tar.xz or .tar.zst). Archive is read in streaming mode ('r|'), members are parsed while they are decompressed
+    and nothing is extracted to disk. Members of indexed archives (.gzm) are read from their offset, see Util_files.createIndexedArchive.
+    Files of content archives (.cas) are read from content store, see Util_files.createContentArchive. It is executed in a worker process when report runs in parallel mode, so it does not write to log.
+
+    Args:
+        archive (str): The archive path, for example {local_dir_audit_files_by_db}/202404_db_aud_files.tar.gz
+        dir (str): Directory where archive was created, report lines use the member path before compression: os.path.join(dir, member)
+
+    Returns:
+        list: (name, rows, lines, error) for each AUD file, in archive order. See parseAudFile
+
+    Examples:
+        Report lines of archived files are the same as report lines of the files before compression:
+        >>> import tempfile, shutil
+        >>> from Aud_file_generator import generateAudTree
+        >>> from Util_files import createTarfile, createIndexedArchive, createContentArchive
+        >>> workDir = tempfile.mkdtemp()
+        >>> sourceDir = os.path.join(workDir, 'auditCBS_Processed')
+        >>> _ = generateAudTree(sourceDir, '20240503', ['billdb', 'usrdb'], nodes_per_db=1, file_size_mb=0.02)
+        >>> parsedFiles = sorted((os.path.relpath(os.path.join(root, name), sourceDir),) + parseAudFile(os.path.join(root, name)) for root, dirs, names in os.walk(sourceDir) for name in names)
+        >>> createTarfile(os.path.join(workDir, '202405_db_aud_files.tar.gz'), sourceDir, '202405', '')
+        'OK'
+        >>> sorted(parseAudArchive(os.path.join(workDir, '202405_db_aud_files.tar.gz'), sourceDir, '202405', '\\\\.tar\\\\.gz')) == parsedFiles
+        True
+        >>> createTarfile(os.path.join(workDir, '202405_db_aud_files_pgzip.tar.gz'), sourceDir, '202405', '', compression_codec='pgzip', compression_workers=4)
+        'OK'
+        >>> sorted(parseAudArchive(os.path.join(workDir, '202405_db_aud_files_pgzip.tar.gz'), sourceDir, '202405', '\\\\.tar\\\\.gz')) == parsedFiles
+        True
+        >>> createIndexedArchive(os.path.join(workDir, '202405_db_aud_files.gzm'), sourceDir, '202405', '')
+        'OK'
+        >>> sorted(parseAudArchive(os.path.join(workDir, '202405_db_aud_files.gzm'), sourceDir, '202405', '\\\\.tar\\\\.gz')) == parsedFiles
+        True
+        >>> createContentArchive(os.path.join(workDir, '202405_db_aud_files.cas'), sourceDir, '202405', '', content_store_dir=os.path.join(workDir, 'contentStore'))
+        'OK'
+        >>> sorted(parseAudArchive(os.path.join(workDir, '202405_db_aud_files.cas'), sourceDir, '202405', '\\\\.tar\\\\.gz')) == parsedFiles
+        True
+        >>> shutil.rmtree(workDir)
+    """
+    parsedMembers = []
+    isFileToCheck = getDateFileMatcher(month_str, 'aud', exceptfiles)
+    try:
+        if archive.endswith(ARCHIVE_FORMATS['cas']):
+            # Content archive: each file is read from content store
+            for contentEntry in readContentArchive(archive):
+                name = os.path.normpath(contentEntry.name)
+                if isFileToCheck(name):
+                    with openContentArchiveMember(contentEntry) as member, io.TextIOWrapper(member, encoding=locale.getpreferredencoding(False)) as memberFile:
+                        rows, lines, error = parseAudLines(memberFile, os.path.join(dir, name), sqltext_limits)
+                    parsedMembers.append((name, rows, lines, error))
+                    if error is not None:
+                        break
+            return parsedMembers
+        if archive.endswith(ARCHIVE_FORMATS['indexed']):
+            # Indexed archive: only members of requested month are decompressed
+            with open(archive, 'rb') as archiveFile:
+                for indexEntry in readArchiveIndex(archive):
+                    name = os.path.normpath(indexEntry.name)
+                    if isFileToCheck(name):
+                        with io.TextIOWrapper(openIndexedArchiveMember(archiveFile, indexEntry), encoding=locale.getpreferredencoding(False)) as memberFile:
+                            rows, lines, error = parseAudLines(memberFile, os.path.join(dir, name), sqltext_limits)
+                        parsedMembers.append((name, rows, lines, error))
+                        if error is not None:
+                            break
+            return parsedMembers
+        with open(archive, 'rb') as archiveFile, tarfile.open(fileobj=openCompressedReader(archiveFile, archive), mode='r|') as tar:
+            for member in tar:
+                name = os.path.normpath(member.name)
+                if member.isfile() and isFileToCheck(name):
+                    with io.TextIOWrapper(io.BufferedReader(ArchiveMemberReader(tar.extractfile(member))), encoding=locale.getpreferredencoding(False)) as memberFile:
+                        rows, lines, error = parseAudLines(memberFile, os.path.join(dir, name), sqltext_limits)
+                    parsedMembers.append((name, rows, lines, error))
+                    if error is not None:
+                        break
+    except Exception as e:
+        parsedMembers.append((os.path.basename(archive), [], 0, (f'{e}', traceback.format_exc(), '')))
+    return parsedMembers
+
+def getSqlTextLimits(config, local_dir_reports):
+    # SQLTEXT limits of [ACTIVITY_REPORT] section. Spill files are saved in {local_dir_reports}/sqltext_spill
+    activity_report_config = config['ACTIVITY_REPORT']
+    sqltext_max_kb = int (activity_report_config.get('sqltext_max_kb', '1024'))
+    sqltext_overflow = activity_report_config.get('sqltext_overflow', 'truncate')
+    spill_dir = f'{local_dir_reports}/sqltext_spill'
+    if sqltext_max_kb > 0 and sqltext_overflow == 'spill':
+        os.makedirs(spill_dir, exist_ok=True)
+    return SqlTextLimits(sqltext_max_kb * 1024, sqltext_overflow, spill_dir)
+
+def getParseCacheScanner(report_scanner, sqltext_limits=None):
+    # Rows saved in parse cache depend on scanner and on SQLTEXT limits
+    if sqltext_limits is None or sqltext_limits.max_chars == 0:
+        return report_scanner
+    return f'{report_scanner}-{sqltext_limits.max_chars}-{sqltext_limits.overflow}'
+
+@measuredStage('checkForAuditedActivities')
+def checkForAuditedActivities(dir, month_str='',exceptfiles='', add_summary_report='0', report_workers=1, report_scanner='text', parse_cache_path='', parse_cache_max_mb=512, activity_store_dir='', read_archives='0', sqltext_limits=None):
     """
     Reads all AUD files in a directory to search for audited activities.
     All data from audited activities founded is saved in logging file that was defined by invoker
     
     Args:
         dir (str): The directory path containing the files to analyze.
+        report_workers (int): Number of processes parsing files at the same time. 1: Sequential parsing.
+            Report content and order are the same in both modes.
+        report_scanner (str): text: AUD files are read line by line. mmap: AUD files are memory-mapped and only successful statements are decoded.
+        parse_cache_path (str): SQLite file with rows found in files parsed before (see Util_parse_cache). '': Cache is not used.
+            Files that grew since they were parsed are parsed from their checkpoint, only appended bytes are read.
+        parse_cache_max_mb (int): Maximum size of rows saved in cache, least recently used files are evicted.
+        activity_store_dir (str): Root directory of activity store (see Util_activity_store). Activities are saved in store and
+            report lines are read back from it. '': Store is not used.
+        read_archives (str): 1: AUD files saved in month archives of dir are also reported (see parseAudArchive), files on disk are used when both exist.
+            Archives are parsed in parallel processes when report_workers > 1. 0: Archives are not read.
+        sqltext_limits (SqlTextLimits): Maximum characters of a SQLTEXT kept in memory and what is done with the rest, see SqlTextAssembler. None: no limit
 
     Result:
         In console, for each AUD file analized where audited activities were found a message like this is showed
@@ -197,91 +825,110 @@ def checkForAuditedActivities(dir, month_str='',exceptfiles='', add_summary_repo
     logging.info("Fecha y Hora        " + "\tUsuario de BD" + "\tHostname" + "\tLinea" + "\tActividad" + "\tSchema" + "\tTable" + "\tQuery" + "\tArchivo")
     result = 'OK'   
     current_filename = ''
-    current_line_number = 0
-    current_line = ''
-    audited_activities_counter = 0
     summary_report = [] 
     try:
-        for name in sorted(glob.glob('**', recursive=True, root_dir=dir)):
-            
-        #for root, dirs, ficheros in os.walk(dir):
-            #for name in dirs:
-            #      print("Directorio", os.path.join(root, name))
-            #for name in sorted(ficheros):
-                if  not re.search(f'.*{exceptfiles}.*', name) and re.search(f'.*{month_str}.*\\.aud', name):
-                    #file = os.path.join(root, name)
-                    current_filename = name
-                    file = os.path.join(dir, name)
-                    with open(file) as myfile:
-                        n = 0
-                        audited_activities_counter = 0
-                        host = ''
-                        userDB = ''
-                        time = ''
-                        query = ''
-                        schema = ''
-                        table = ''
-                        queryLine = ''
-                        queryLineNumber = 0
-                        restarVars = False
-                        queryEnVariasLineas = False
-                        for line in myfile:
-                            n = n + 1
-                            current_line_number = n
-                            current_line = line
-                            if 'UTC-4:' in line:
-                                fecha = line
-                            elif 'LENGTH:' in line:
-                                longitud = line
-                            elif 'RETURNCODE:[8] "GS-00000"' in line and ('PREP_EXEC' in line or 'EXECUTE' in line):
-                            #elif  ('PREPARE' in line or 'PREP_EXEC' in line or 'EXECUTE' in line):
-                                queryLine = line
-                                queryLineNumber = n
-                                query = getQuery(line)
-                                queryCantidadCaracteres = query.split("|")[1]
-                                query = query.split("|")[0]
-                                queryEnVariasLineas = (query == 'null') 
-                                if queryEnVariasLineas:
-                                    query = ''
-                            elif queryEnVariasLineas:
-                                query = query + line
-                                if '"' in query:
-                                    queryEnVariasLineas = False
-                            elif line.strip() == '':
-                                #Reset variables
-                                restarVars = True
-                            # If audited activity is founded then logging all related data
-                            if not queryEnVariasLineas and query != '':
-                                query = query.replace('"', '').strip()
-                                auditedActivity = getAuditedActivity(query)
-                                if auditedActivity != "":
-                                    audited_activities_counter = audited_activities_counter + 1
-                                    userDB = getUserDB(queryLine)
-                                    host = getHost(queryLine)
-                                    objectName = getObjectNameFromQuery(query, auditedActivity)
-                                    schema = getSchema(objectName, userDB)
-                                    table = getTable(objectName)
-                                    time = getDate(fecha)
-                                    logging.info( time + "\t" + userDB+ "\t" + host + "\t" + str(queryLineNumber) + "\t" + auditedActivity + "\t" + schema + "\t" + table + "\t" + query + "\t" + file )
-                                #Reset variables
-                                restarVars = True
-                            #
-                            if restarVars:
-                                host = ''
-                                userDB = ''
-                                time = ''
-                                query = ''
-                                schema = ''
-                                table = ''
-                                queryLine = ''
-                                queryLineNumber = 0
-                                restarVars = False
-                                queryEnVariasLineas = False
-                        #if audited_activities_counter > 0:
-                        #    print("Existen", audited_activities_counter, "actividades auditadas en el archivo", file)   
-                    sumary_report_file = [audited_activities_counter, current_line_number, current_filename]
-                    summary_report.append(sumary_report_file)
-        if add_summary_report == '1':
+        isFileToCheck = getDateFileMatcher(month_str, 'aud', exceptfiles)
+        catalog = getFileCatalog(dir, month_str)
+        names = [name for name in sorted(entry.path for entry in catalog) if isFileToCheck(name)]
+        files = [os.path.join(dir, name) for name in names]
+        # Files not changed since they were parsed in a previous execution are taken from parse cache
+        cacheConnection = None
+        cacheScanner = getParseCacheScanner(report_scanner, sqltext_limits)
+        cachedFiles = {}
+        checkpointRows = {}
+        checkpoints = {}
+        fileKeys = {}
+        storeConnections = {}
+        if parse_cache_path != '':
+            cacheConnection = openParseCache(parse_cache_path)
+            manifestEntries = readChecksumManifests(dir, month_str)
+            for name, file in zip(names, files):
+                fileStats = os.stat(file)
+                checksum = getTrustedChecksum(manifestEntries, name.replace('\\', '/'), file, None) or ''
+                fileKeys[file] = (fileStats.st_size, int(fileStats.st_mtime), checksum)
+                cached = getCachedParse(cacheConnection, file, fileStats.st_size, fileStats.st_mtime, checksum, cacheScanner)
+                if cached is not None:
+                    cachedFiles[file] = (cached[0], cached[1], None)
+                    continue
+                # Files that only grew are parsed from last checkpoint
+                checkpointed = getParseCheckpoint(cacheConnection, file, cacheScanner)
+                if checkpointed is not None:
+                    checkpointRows[file] = checkpointed[0][:checkpointed[1][2]]
+                    checkpoints[file] = checkpointed[1]
+            logging.info(f'Files taken from parse cache: {len(cachedFiles)} of {len(files)}')
+            if len(checkpoints) > 0:
+                logging.info(f'Files parsed from checkpoint: {len(checkpoints)}')
+        filesToParse = [file for file in files if file not in cachedFiles]
+        fileCheckpoints = [checkpoints.get(file) for file in filesToParse]
+        archives = []
+        if read_archives == '1':
+            isArchive = getContainsMatcher(month_str)
+            archives = [os.path.join(dir, entry.path) for entry in catalog if entry.isFile and os.sep not in entry.path and entry.path.endswith(ARCHIVE_EXTENSIONS) and isArchive(entry.path)]
+        if int(report_workers) > 1 and len(filesToParse) + len(archives) > 1:
+            # Files are parsed in parallel processes, results are written in same file order than sequential mode
+            executor = ProcessPoolExecutor(max_workers=int(report_workers))
+            parsedFiles = executor.map(partial(parseAudFileResumable, report_scanner=report_scanner, sqltext_limits=sqltext_limits), filesToParse, fileCheckpoints)
+            parsedArchives = executor.map(partial(parseAudArchive, dir=dir, month_str=month_str, exceptfiles=exceptfiles, sqltext_limits=sqltext_limits), archives)
+        else:
+            executor = None
+            parsedFiles = map(partial(parseAudFileResumable, report_scanner=report_scanner, sqltext_limits=sqltext_limits), filesToParse, fileCheckpoints)
+            parsedArchives = map(partial(parseAudArchive, dir=dir, month_str=month_str, exceptfiles=exceptfiles, sqltext_limits=sqltext_limits), archives)
+        try:
+            # Archive members are reported in name order together with files on disk
+            archivedFiles = {}
+            for archive, parsedMembers in zip(archives, parsedArchives):
+                for name, rows, current_line_number, error in parsedMembers:
+                    if name not in archivedFiles and (error is not None or not os.path.exists(os.path.join(dir, name))):
+                        archivedFiles[name] = (rows, current_line_number, error)
+                logging.info(f'Files read from archive {archive}: {len(parsedMembers)}')
+            if archivedFiles:
+                names = sorted(set(names).union(archivedFiles))
+                files = [os.path.join(dir, name) for name in names]
+            for name, file in zip(names, files):
+                if name in archivedFiles:
+                    rows, current_line_number, error = archivedFiles[name]
+                elif file in cachedFiles:
+                    rows, current_line_number, error = cachedFiles[file]
+                else:
+                    rows, current_line_number, error, checkpoint = next(parsedFiles)
+                    if file in checkpointRows:
+                        # Rows found before checkpoint were saved in cache
+                        rows = checkpointRows[file] + rows
+                        if checkpoint is not None:
+                            checkpoint = (checkpoint[0], checkpoint[1], len(checkpointRows[file]) + checkpoint[2], checkpoint[3])
+                    if cacheConnection is not None and error is None:
+                        size, mtime, checksum = fileKeys[file]
+                        putCachedParse(cacheConnection, file, size, mtime, checksum, cacheScanner, rows, current_line_number, checkpoint)
+                current_filename = name
+                if activity_store_dir != '':
+                    # Text report is written from activities saved in store partitions of file database
+                    dbName = name.split(os.sep)[0] if os.sep in name else os.path.basename(os.path.normpath(dir))
+                    storePaths = storeActivityRows(storeConnections, activity_store_dir, dbName, rows, [file] if error is None else None)
+                    rows = readActivityRows(storeConnections, storePaths, file)
+                for row in rows:
+                    logging.info(row)
+                if error is not None:
+                    logging.error('Exception occurred:' )
+                    logging.error(f'{error[0]}')
+                    logging.error(f'Traceback: {error[1]}')
+                    logging.error(f'Error ocurred when processing file {current_filename} in line {current_line_number}:')
+                    logging.error(f'{error[2]}')
+                    result = 'ERROR'
+                    break
+                # Bytes of files read from archives are not known without reading them again
+                addStageCounters('checkForAuditedActivities', files=1, bytes=os.path.getsize(file) if name not in archivedFiles else 0)
+                sumary_report_file = [len(rows), current_line_number, current_filename]
+                summary_report.append(sumary_report_file)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if cacheConnection is not None:
+                evicted = evictParseCache(cacheConnection, parse_cache_max_mb)
+                if evicted > 0:
+                    logging.info(f'Files evicted from parse cache: {evicted}')
+                cacheConnection.close()
+            closeActivityStores(storeConnections)
+        if add_summary_report == '1' and result == 'OK':
             logging.info("================ Summary report ===================")
             logging.info("Nro archivo \t Nro actividades \t Nro lineas revisadas \t Archivo")
             counter = 0
@@ -292,8 +939,7 @@ def checkForAuditedActivities(dir, month_str='',exceptfiles='', add_summary_repo
         logging.error('Exception occurred:' )
         logging.error(f'{e}')
         logging.error(f'Traceback: {traceback.format_exc()}')
-        logging.error(f'Error ocurred when processing file {current_filename} in line {current_line_number}:')
-        logging.error(f'{current_line}')
+        logging.error(f'Error ocurred when processing file {current_filename}')
         result = 'ERROR'                 
     return result 
 
@@ -308,6 +954,18 @@ def activity_report_generator(month_str):
     #
     activity_report_config = config['ACTIVITY_REPORT']
     add_summary_report = activity_report_config['add_summary_report']
+    report_workers = int (activity_report_config.get('report_workers', '1'))
+    report_scanner = activity_report_config.get('report_scanner', 'text')
+    parse_cache = activity_report_config.get('parse_cache', '0')
+    parse_cache_max_mb = int (activity_report_config.get('parse_cache_max_mb', '512'))
+    parse_cache_path = f'{local_dir_reports}/activity_parse_cache.sqlite' if parse_cache == '1' else ''
+    activity_store = activity_report_config.get('activity_store', '0')
+    activity_store_dir = f'{local_dir_reports}/activity_store' if activity_store == '1' else ''
+    read_archives = activity_report_config.get('read_archives', '0')
+    sqltext_limits = getSqlTextLimits(config, local_dir_reports)
+    #
+    metrics = config.get('METRICS', 'metrics', fallback='0')
+    metrics_dir = config.get('METRICS', 'metrics_dir', fallback='') or local_server['local_dir_logs']
     #
     logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
     log_filename = f'{local_dir_reports}/activity_report_{logFileDateStr}.txt'
@@ -331,10 +989,19 @@ def activity_report_generator(month_str):
         if month_str.strip() != '' : 
             logging.info(f'Activity report using audit files from month: {month_str}') 
             logging.info(f'Source directory: {localDirOrganizedByDB}')        
-            result = checkForAuditedActivities(localDirOrganizedByDB, month_str, '\\.tar\\.gz', add_summary_report )
+            result = checkForAuditedActivities(localDirOrganizedByDB, month_str, '\\.tar\\.gz', add_summary_report, report_workers, report_scanner, parse_cache_path, parse_cache_max_mb, activity_store_dir, read_archives, sqltext_limits)
         else:
             logging.info(f'Month to process must be sent as parameter using format YYYYMM')
             result = 'ERROR'
+    if metrics == '1':
+        # Report result does not depend on metrics files
+        try:
+            jsonFilename, promFilename = writeMetrics(metrics_dir, 'activity_report')
+            logging.info(f'Stage metrics saved in {jsonFilename} and {promFilename}')
+        except Exception as e:
+            logging.error('Exception occurred:' )
+            logging.error(f'{e}')
+            logging.error(f'Traceback: {traceback.format_exc()}')
     return result
 
 def main():
@@ -0,0 +1,154 @@
+"""
+Module: Aud_file_generator
+
+A module for generating synthetic zengine audit files (*.aud) with the same format as CBS database audit files,
+used by Benchmark.py and to test extraction, load, compression and activity report without CBS data.
+
+Each record has a date line (UTC-4), a LENGTH line and a statement line with SESSIONID, STMTID, USER, HOST, ACTION, RETURNCODE
+and SQLTEXT fields. SQLTEXT can be written in several lines like CBS does with prepared statements:
+
+    UTC-4:00 2024-04-17 03:00:04.278
+    LENGTH: "228"
+    SESSIONID:[3] "977" STMTID:[1] "0" USER:[4] "USR1" HOST:[11] "11.12.1.123" ACTION:[21] "PREP_EXEC[AUTOCOMMIT]" RETURNCODE:[8] "GS-00000" SQLTEXT:[76] " 
+                 alter table SOME_TABLE_RE  drop partition _SYS_P4460
+            "
+
+Files are created with the extraction directory layout (see Extractor), or with CBS server layout when by_day = '0':
+
+    {baseDir}/{YYYYMMDD}/{db}-1-1-m-{node}/zengine_{YYYYMMDD}{HHMMSSmmm}.aud
+    {baseDir}/{db}-1-1-m-{node}/zengine_{YYYYMMDD}{HHMMSSmmm}.aud
+
+Same parameters and seed generate same files.
+
+Imports:
+    - os
+    - random
+    - datetime
+    - sys
+
+Functions:
+    1. getSqlText(generator, audited_ratio=0.3, ddl_ratio=0.2)
+    2. getAudRecord(recordTime, sessionId, user, host, action, returnCode, sqlText, multiline=False, newline='\\n')
+    3. generateAudFile(filename, fileDate, size_bytes, generator, audited_ratio=0.3, ddl_ratio=0.2, multiline_ratio=0.3, error_ratio=0.05, newline='\\n')
+    4. getNodeSubdirs(dbs, nodes_per_db)
+    5. generateAudTree(baseDir, fileDateStr, dbs=DEFAULT_DBS, nodes_per_db=2, files_per_node=1, file_size_mb=1, audited_ratio=0.3, ddl_ratio=0.2, multiline_ratio=0.3, error_ratio=0.05, seed=1, by_day='1')
+    6. main()
+
+Usage Examples:
+    1. From Python:
+    >>> from Aud_file_generator import generateAudTree
+    >>> generateAudTree('/tmp/auditCBS', '20240501', ['billdb', 'usrdb'], nodes_per_db=2, files_per_node=3, file_size_mb=10)
+
+    2. From console (name=value parameters, dbs separated by comma):
+    $ python.exe Aud_file_generator.py "dir=/tmp/auditCBS" "day=20240501" "dbs=billdb,usrdb" "file_size_mb=10" "files_per_node=3"
+
+    3. CBS server directory served by Sftp_test_server:
+    $ python.exe Aud_file_generator.py "dir=/tmp/cbs/auditlogs" "day=20240501" "by_day=0"
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240513
+"""
+
+import os
+import random
+import datetime
+import sys
+
+DEFAULT_DBS = ['billdb', 'billsharedb', 'bmpdb', 'edrdb', 'meddb', 'usrdb', 'uvcdb']
+USERS = ['USR1', 'GONZALESV', 'LONG_USER_NAME1', 'BILLING_APP', 'CRM_BATCH', 'DBA_OPER']
+HOSTS = ['11.12.1.123', '127.0.0.1', '10.24.4.6', '10.24.4.7', '172.16.20.31']
+SCHEMAS = ['USR1', 'SCHEM1', 'BILLDB', 'LONG_SCHEMA_DWH1', 'LONG_SCHEMA_NA1']
+TABLES = ['SOME_TABLE1', 'SOME_TABLE_RE', 'BB_LOG_MERGE', 'SUBSCRIBER_BALANCE', 'RECHARGE_LOG', 'LONG_TABLE_NAME_SCHEMAN1']
+# Only PREP_EXEC and EXECUTE statements with RETURNCODE GS-00000 are audited activities, PREPARE is written before them
+ACTIONS = ['PREP_EXEC[AUTOCOMMIT]', 'EXECUTE', 'PREPARE']
+ERROR_CODES = ['GS-01001', 'GS-00601', 'GS-00201']
+
+def getSqlText(generator, audited_ratio=0.3, ddl_ratio=0.2):
+    # audited_ratio: share of DML/DDL statements, other statements are queries
+    # ddl_ratio: share of DDL (truncate, drop) in audited statements
+    table = f'{generator.choice(SCHEMAS)}.{generator.choice(TABLES)}'
+    if generator.random() >= audited_ratio:
+        return f'SELECT BALANCE_ID, AMOUNT, STATUS FROM {table} WHERE SUBSCRIBER_ID={generator.randint(10**11, 10**12)}'
+    if generator.random() < ddl_ratio:
+        return generator.choice([f'truncate table {table}',
+                                 f'alter table {table} drop partition PRT_D_{generator.randint(20240101, 20240430)}',
+                                 f'drop table {table}'])
+    return generator.choice([f'INSERT INTO {table} (RECHARGE_LOG_ID, AMOUNT) VALUES ({generator.randint(10**17, 10**18)}, {generator.randint(1, 100000)})',
+                             f'UPDATE {table} SET RECHARGE_AMT={generator.randint(1, 100000)} WHERE RECHARGE_LOG_ID={generator.randint(10**17, 10**18)}',
+                             f'DELETE FROM {table} WHERE RECHARGE_LOG_ID={generator.randint(10**17, 10**18)}'])
+
+def getAudRecord(recordTime, sessionId, user, host, action, returnCode, sqlText, multiline=False, newline='\n'):
+    # LENGTH is the length of the statement text from SESSIONID to the end of SQLTEXT
+    # newline: line separator of the file ('\r\n': Windows line endings), it is counted in SQLTEXT length
+    if multiline:
+        sqlText = f' {newline}            {newline}            {sqlText}{newline}        {newline}        '
+    statement = f'SESSIONID:[{len(sessionId)}] "{sessionId}" STMTID:[1] "0" USER:[{len(user)}] "{user}" HOST:[{len(host)}] "{host}" ACTION:[{len(action)}] "{action}" RETURNCODE:[{len(returnCode)}] "{returnCode}" SQLTEXT:[{len(sqlText)}] "{sqlText}"'
+    return f'UTC-4:00 {recordTime.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]}{newline}LENGTH: "{len(statement)}"{newline}{statement}{newline}{newline}'
+
+def generateAudFile(filename, fileDate, size_bytes, generator, audited_ratio=0.3, ddl_ratio=0.2, multiline_ratio=0.3, error_ratio=0.05, newline='\n'):
+    # Records are written until file has size_bytes, record times are increasing during the day
+    # Returns (records, bytes)
+    records = 0
+    written = 0
+    recordTime = fileDate
+    with open(filename, 'w', newline='\n') as audFile:
+        while written < size_bytes:
+            recordTime = recordTime + datetime.timedelta(milliseconds=generator.randint(1, 2000))
+            returnCode = generator.choice(ERROR_CODES) if generator.random() < error_ratio else 'GS-00000'
+            record = getAudRecord(recordTime, str(generator.randint(1, 5000)), generator.choice(USERS), generator.choice(HOSTS), generator.choice(ACTIONS),
+                                  returnCode, getSqlText(generator, audited_ratio, ddl_ratio), generator.random() < multiline_ratio, newline)
+            audFile.write(record)
+            written = written + len(record)
+            records = records + 1
+    return records, written
+
+def getNodeSubdirs(dbs, nodes_per_db):
+    # billdb-1-1-m-0, billdb-1-1-m-1, ..
+    return [f'{db}-1-1-m-{node}' for db in dbs for node in range(int(nodes_per_db))]
+
+def generateAudTree(baseDir, fileDateStr, dbs=DEFAULT_DBS, nodes_per_db=2, files_per_node=1, file_size_mb=1, audited_ratio=0.3, ddl_ratio=0.2, multiline_ratio=0.3, error_ratio=0.05, seed=1, by_day='1'):
+    """
+    Generates synthetic AUD files of one day for each node
+    by_day: 1: Files are saved in {baseDir}/{YYYYMMDD}/{node} (extraction layout). 0: Files are saved in {baseDir}/{node} (CBS server layout)
+
+    Returns:
+        tuple: (files, records, bytes)
+    """
+    generator = random.Random(seed)
+    fileDate = datetime.datetime.strptime(fileDateStr, '%Y%m%d')
+    fileCounter = 0
+    recordCounter = 0
+    bytesCounter = 0
+    for subdir in getNodeSubdirs(dbs, nodes_per_db):
+        nodeDir = f'{baseDir}/{fileDateStr}/{subdir}' if by_day == '1' else f'{baseDir}/{subdir}'
+        os.makedirs(nodeDir, exist_ok=True)
+        for fileNumber in range(int(files_per_node)):
+            # Files of a node are rotated during the day
+            fileTime = fileDate + datetime.timedelta(seconds=fileNumber * 86400 // int(files_per_node), milliseconds=generator.randint(0, 999))
+            filename = f'{nodeDir}/zengine_{fileTime.strftime("%Y%m%d%H%M%S%f")[:-3]}.aud'
+            records, written = generateAudFile(filename, fileTime, int(float(file_size_mb) * 1024 * 1024), generator, audited_ratio, ddl_ratio, multiline_ratio, error_ratio)
+            fileCounter = fileCounter + 1
+            recordCounter = recordCounter + records
+            bytesCounter = bytesCounter + written
+    return fileCounter, recordCounter, bytesCounter
+
+def main():
+    #Call example: python.exe Aud_file_generator.py "dir=/tmp/auditCBS" "day=20240501" "dbs=billdb,usrdb" "file_size_mb=10"
+    parameters = {}
+    for arg in sys.argv[1:]:
+        name, separator, value = arg.partition('=')
+        if separator == '':
+            raise ValueError(f'Parameter must be sent as name=value: {arg}')
+        parameters[name.strip().lower()] = value.strip()
+    baseDir = parameters.pop('dir')
+    fileDateStr = parameters.pop('day', datetime.datetime.now().strftime('%Y%m%d'))
+    dbs = parameters.pop('dbs', ','.join(DEFAULT_DBS)).split(',')
+    seed = int(parameters.pop('seed', '1'))
+    by_day = parameters.pop('by_day', '1')
+    options = {name: float(value) for name, value in parameters.items()}
+    files, records, written = generateAudTree(baseDir, fileDateStr, dbs, seed=seed, by_day=by_day, **options)
+    print (f'{files} files, {records} records, {written} bytes generated in {baseDir}{f"/{fileDateStr}" if by_day == "1" else ""}')
+
+if __name__ == '__main__':
+    main()
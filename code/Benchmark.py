@@ -0,0 +1,312 @@
+"""
+Module: Benchmark
+
+A module for measuring ETL stages with synthetic AUD files (see Aud_file_generator), so performance changes between versions are visible.
+
+Algorithm:
+    Generate synthetic AUD files of one day in {dir}/auditCBS/{YYYYMMDD}/{db}-1-1-m-{node}
+    (remote = 1: files are generated in {dir}/cbs/auditlogs/{db}-1-1-m-{node} and served by Sftp_test_server)
+    For each repetition:
+        copyAudFilesFromExternalServer  remote = 1: /auditlogs of test server -> auditCBS/{YYYYMMDD}
+        checksumFiles              auditCBS -> auditCBS/{YYYYMMDD}.manifest
+        organizeAuditFilesbyDB     auditCBS/{YYYYMMDD} -> auditCBS_Processed/{db}
+        checkForAuditedActivities  auditCBS_Processed (report lines are written in {dir}/benchmark_report.txt)
+        createTarfile              auditCBS_Processed -> auditCBS_Processed/{YYYYMM}_db_aud_files.tar.gz
+    Best wall time of each stage is saved in results file (JSON, one line per benchmark) with scripts version,
+    and it is compared with the last result that used same parameters.
+
+Resume check (resume_check = 1): instead of stages, each file served by Sftp_test_server is synced (syncAudFileFromNode) and its connection
+is dropped when 3/4 of the file was sent (cutoff_bytes). File is synced again in a new connection, it must be resumed from the partial local
+copy and its checksum must be the same as source file one. Files must be bigger than sync chunk (1 MB), for example file_size_mb=4.
+Nothing is saved in results file.
+
+Results are saved in test/benchmarks/benchmark_results.jsonl of repository (it is not versioned: results are comparable only on the same machine). Each line has:
+    created, version (git commit), python, platform, cpus, parameters, generated (files, records, bytes) and
+    stages (Util_metrics stage metrics: wall_seconds, cpu_seconds, files, bytes, mb_per_s, rss_growth_mb)
+
+Parameters are sent as name=value:
+    dir                     Work directory, a temporary directory is used and deleted when it is not sent
+    day                     Day of AUD files (YYYYMMDD), default 20240501
+    dbs                     Databases separated by comma, default billdb,usrdb
+    nodes_per_db, files_per_node, file_size_mb, audited_ratio, ddl_ratio, multiline_ratio, error_ratio, seed
+                            Synthetic files (see Aud_file_generator.generateAudTree)
+    repeat                  Repetitions of stages, best wall time is saved. Default 3
+    remote                  1: Files are extracted from a local SFTP test server. 0: Extraction is not measured
+    extraction_mode, extraction_workers
+                            Same parameters of config.properties, used when remote = 1
+    latency_ms, bandwidth_kbps
+                            Network emulated by SFTP test server (one way delay and shared link in KB/s, 0: No limit)
+    checksum_algorithm, checksum_workers, placement_strategy, report_workers, report_scanner, compression_codec, compression_level, compression_workers
+                            Same parameters of config.properties
+    regression_threshold    Percentage of wall time increase showed as regression. Default 10
+    resume_check            1: Check resume of transfers cut off by SFTP test server instead of measuring stages. Default 0
+    results                 Results file, default test/benchmarks/benchmark_results.jsonl
+
+Imports:
+    - os
+    - sys
+    - json
+    - shutil
+    - logging
+    - platform
+    - tempfile
+    - datetime
+    - subprocess
+    - Aud_file_generator.generateAudTree
+    - Aud_file_generator.getNodeSubdirs
+    - Sftp_test_server.SftpTestServer
+    - Extractor.copyAudFilesFromExternalServer
+    - Extractor.checksumFiles
+    - Extractor.syncAudFileFromNode
+    - Loader_by_db.organizeAuditFilesbyDB
+    - Activity_report_generator.checkForAuditedActivities
+    - Util_files.createTarfile
+    - Util_files.getChecksumManifestPath
+    - Util_files.invalidateFileCatalog
+    - Util_files.closeSSHSessionPools
+    - Util_files.getSSHSessionPool
+    - Util_files.getChecksumFile
+    - Util_compression.getTarExtension
+    - Util_metrics.resetStageMetrics
+    - Util_metrics.getAggregatedStageMetrics
+
+Functions:
+    1. getBenchmarkParameters(args)
+    2. getScriptsVersion()
+    3. runBenchmarkStages(parameters, auditDir, byDbDir, testServer=None)
+    4. checkResumedTransfers(testServer, remoteDir, localDir, checksum_algorithm='md5')
+    5. readBenchmarkResults(results_file)
+    6. compareBenchmarkResults(previous, current, regression_threshold=10)
+    7. benchmark(args)
+    8. main()
+
+Usage Examples:
+    1. Default benchmark, 2 databases x 2 nodes x 1 file of 1 MB:
+    $ python.exe Benchmark.py
+
+    2. Bigger files and parallel workers:
+    $ python.exe Benchmark.py "dbs=billdb,usrdb,meddb" "file_size_mb=50" "files_per_node=4" "checksum_workers=4" "report_workers=4"
+
+    3. Remote extraction in sync mode with 4 workers, 20 ms latency and 10 MB/s link:
+    $ python.exe Benchmark.py "remote=1" "extraction_mode=sync" "extraction_workers=4" "latency_ms=20" "bandwidth_kbps=10240"
+
+    4. Resume of transfers cut off in the middle, files of 4 MB with 20 ms latency:
+    $ python.exe Benchmark.py "resume_check=1" "file_size_mb=4" "latency_ms=20"
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240513
+"""
+
+import os
+import sys
+import json
+import shutil
+import logging
+import platform
+import tempfile
+import datetime
+import subprocess
+from Aud_file_generator import generateAudTree, getNodeSubdirs
+from Sftp_test_server import SftpTestServer
+from Extractor import copyAudFilesFromExternalServer, checksumFiles, syncAudFileFromNode
+from Loader_by_db import organizeAuditFilesbyDB
+from Activity_report_generator import checkForAuditedActivities
+from Util_files import createTarfile, getChecksumManifestPath, invalidateFileCatalog, closeSSHSessionPools, getSSHSessionPool, getChecksumFile
+from Util_compression import getTarExtension
+from Util_metrics import resetStageMetrics, getAggregatedStageMetrics
+
+# Default parameters, values sent as name=value are converted to the type of default value
+BENCHMARK_PARAMETERS = {'day': '20240501', 'dbs': 'billdb,usrdb', 'nodes_per_db': 2, 'files_per_node': 1, 'file_size_mb': 1.0,
+                        'audited_ratio': 0.3, 'ddl_ratio': 0.2, 'multiline_ratio': 0.3, 'error_ratio': 0.05, 'seed': 1, 'repeat': 3,
+                        'remote': '0', 'extraction_mode': 'scp', 'extraction_workers': 1, 'latency_ms': 0.0, 'bandwidth_kbps': 0.0,
+                        'checksum_algorithm': 'md5', 'checksum_workers': 1, 'placement_strategy': 'copy',
+                        'report_workers': 1, 'report_scanner': 'text',
+                        'compression_codec': 'gzip', 'compression_level': 9, 'compression_workers': 1}
+BENCHMARK_RESULTS_FILE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'benchmarks', 'benchmark_results.jsonl'))
+
+def getBenchmarkParameters(args):
+    """
+    Converts name=value arguments to benchmark parameters
+
+    Examples:
+        >>> getBenchmarkParameters(['file_size_mb=10', 'report_workers=4'])['file_size_mb']
+        10.0
+    """
+    parameters = dict(BENCHMARK_PARAMETERS, dir='', results=BENCHMARK_RESULTS_FILE, regression_threshold=10.0, resume_check='0')
+    for arg in args:
+        name, separator, value = arg.partition('=')
+        if separator == '':
+            raise ValueError(f'Parameter must be sent as name=value: {arg}')
+        name = name.strip().lower()
+        if name not in parameters:
+            raise ValueError(f'Parameter not supported: {name}')
+        parameters[name] = type(parameters[name])(value.strip())
+    return parameters
+
+def getScriptsVersion():
+    # Git commit of scripts directory, modified scripts are marked as -dirty
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+def runBenchmarkStages(parameters, auditDir, byDbDir, testServer=None):
+    # Returns (result, stages) where stages are metrics of one repetition
+    day = parameters['day']
+    month = day[:6]
+    subdirs = '\n'.join(getNodeSubdirs(parameters['dbs'].split(','), parameters['nodes_per_db']))
+    resetStageMetrics()
+    result = 'OK'
+    if testServer is not None:
+        result = copyAudFilesFromExternalServer('/auditlogs', auditDir, day, subdirs, testServer.host, testServer.port, testServer.username, testServer.password,
+                                                parameters['extraction_workers'], parameters['extraction_mode'], 30, parameters['checksum_algorithm'])
+        closeSSHSessionPools()
+    if result == 'OK':
+        result = checksumFiles(auditDir, day, '0', '0', parameters['checksum_algorithm'], parameters['checksum_workers'])
+    if result == 'OK':
+        result = organizeAuditFilesbyDB(f'{auditDir}/{day}', byDbDir, day, subdirs, parameters['placement_strategy'])
+    if result == 'OK':
+        result = checkForAuditedActivities(byDbDir, month, '\\.tar\\.gz', '0', parameters['report_workers'], parameters['report_scanner'])
+    if result == 'OK':
+        result = createTarfile(f'{byDbDir}/{month}_db_aud_files{getTarExtension(parameters["compression_codec"])}', byDbDir, month, subdirs, 'aud',
+                               parameters['compression_codec'], parameters['compression_level'], parameters['compression_workers'])
+    return result, getAggregatedStageMetrics()
+
+def checkResumedTransfers(testServer, remoteDir, localDir, checksum_algorithm='md5'):
+    # Each file of remoteDir is cut off when 3/4 of it were sent and synced again: it must be resumed and be the same as source file
+    result = 'OK'
+    sessionPool = getSSHSessionPool(testServer.host, testServer.port, testServer.username, testServer.password)
+    sourceDir = testServer.getLocalPath(remoteDir)
+    print ('File\tSize\tPartial size\tResumed from\tResult')
+    for subdir in sorted(os.listdir(sourceDir)):
+        for filename in sorted(os.listdir(f'{sourceDir}/{subdir}')):
+            sourcePath = f'{sourceDir}/{subdir}/{filename}'
+            remotePath = f'{remoteDir}/{subdir}/{filename}'
+            localPath = f'{localDir}/{subdir}/{filename}'
+            os.makedirs(os.path.dirname(localPath), exist_ok=True)
+            size = os.path.getsize(sourcePath)
+            testServer.cutoff_bytes = max(1, size * 3 // 4)
+            cutOff = False
+            try:
+                with sessionPool.session() as session:
+                    sftp = session.sftp()
+                    syncAudFileFromNode(sftp, remotePath, localPath, sftp.stat(remotePath), checksum_algorithm)
+            except Exception as e:
+                logging.info(f'Transfer of {remotePath} cut off: {e}')
+                cutOff = True
+            testServer.cutoff_bytes = 0
+            partialSize = os.path.getsize(localPath) if os.path.exists(localPath) else 0
+            with sessionPool.session() as session:
+                sftp = session.sftp()
+                checksum, offset, transferredBytes = syncAudFileFromNode(sftp, remotePath, localPath, sftp.stat(remotePath), checksum_algorithm)
+            sourceChecksum = getChecksumFile(sourcePath, checksum_algorithm)
+            resumed = cutOff and offset > 0 and offset == partialSize and checksum == sourceChecksum and getChecksumFile(localPath, checksum_algorithm) == sourceChecksum
+            if not resumed:
+                result = 'ERROR'
+            print (f'{subdir}/{filename}\t{size}\t{partialSize}\t{offset}\t{"OK" if resumed else "ERROR"}')
+    closeSSHSessionPools()
+    return result
+
+def readBenchmarkResults(results_file):
+    results = []
+    if os.path.exists(results_file):
+        with open(results_file) as resultsFile:
+            for line in resultsFile:
+                if line.strip() != '':
+                    results.append(json.loads(line))
+    return results
+
+def compareBenchmarkResults(previous, current, regression_threshold=10):
+    """
+    Compares wall time of each stage with a previous benchmark
+
+    Returns:
+        list: Lines of comparison, stages slower than regression_threshold percent are marked as REGRESSION
+    """
+    lines = [f'Compared with {previous["version"]} ({previous["created"]}):', 'Stage\tPrevious s\tCurrent s\tChange %']
+    previousStages = {(stage['stage'], stage['node']): stage for stage in previous['stages']}
+    for stage in current['stages']:
+        previousStage = previousStages.get((stage['stage'], stage['node']))
+        if previousStage is None or previousStage['wall_seconds'] == 0:
+            continue
+        change = (stage['wall_seconds'] - previousStage['wall_seconds']) * 100 / previousStage['wall_seconds']
+        stageName = f'{stage["stage"]} {stage["node"]}'.strip()
+        lines.append(f'{stageName}\t{previousStage["wall_seconds"]:.3f}\t{stage["wall_seconds"]:.3f}\t{change:+.1f}{" REGRESSION" if change > regression_threshold else ""}')
+    return lines
+
+def benchmark(args):
+    parameters = getBenchmarkParameters(args)
+    workDir = parameters['dir'] if parameters['dir'] != '' else tempfile.mkdtemp(prefix='aud_benchmark_')
+    auditDir = f'{workDir}/auditCBS'
+    byDbDir = f'{workDir}/auditCBS_Processed'
+    os.makedirs(workDir, exist_ok=True)
+    logging_defined_before = logging.getLogger().hasHandlers()
+    if not logging_defined_before:
+        logging.basicConfig(filename=f'{workDir}/benchmark_report.txt', level=logging.INFO, format='%(asctime)s\t%(message)s', datefmt='%Y-%m-%d %I:%M:%S %p')
+    result = 'OK'
+    testServer = None
+    try:
+        generatorParameters = {name: parameters[name] for name in ['nodes_per_db', 'files_per_node', 'file_size_mb', 'audited_ratio', 'ddl_ratio', 'multiline_ratio', 'error_ratio', 'seed']}
+        if parameters['remote'] == '1' or parameters['resume_check'] == '1':
+            files, records, written = generateAudTree(f'{workDir}/cbs/auditlogs', parameters['day'], parameters['dbs'].split(','), by_day='0', **generatorParameters)
+            testServer = SftpTestServer(f'{workDir}/cbs', latency_ms=parameters['latency_ms'], bandwidth_kbps=parameters['bandwidth_kbps'])
+            testServer.start()
+            print (f'Generated: {files} files, {records} records, {written} bytes in {workDir}/cbs/auditlogs, served in {testServer.host}:{testServer.port}')
+            if parameters['resume_check'] == '1':
+                result = checkResumedTransfers(testServer, '/auditlogs', f'{workDir}/resume_check', parameters['checksum_algorithm'])
+                return result
+        else:
+            files, records, written = generateAudTree(auditDir, parameters['day'], parameters['dbs'].split(','), **generatorParameters)
+            print (f'Generated: {files} files, {records} records, {written} bytes in {auditDir}/{parameters["day"]}')
+        bestStages = {}
+        for repetition in range(max(1, parameters['repeat'])):
+            # Each repetition starts from extracted files only (remote = 1: from files in server): checksums are calculated again and files are organized again
+            if os.path.exists(byDbDir):
+                shutil.rmtree(byDbDir)
+            if testServer is not None and os.path.exists(f'{auditDir}/{parameters["day"]}'):
+                shutil.rmtree(f'{auditDir}/{parameters["day"]}')
+            manifestPath = getChecksumManifestPath(f'{auditDir}/{parameters["day"]}')
+            if os.path.exists(manifestPath):
+                os.remove(manifestPath)
+            invalidateFileCatalog(workDir)
+            result, stages = runBenchmarkStages(parameters, auditDir, byDbDir, testServer)
+            if result != 'OK':
+                break
+            for stage in stages:
+                key = (stage['stage'], stage['node'])
+                if key not in bestStages or stage['wall_seconds'] < bestStages[key]['wall_seconds']:
+                    bestStages[key] = stage
+        if result == 'OK':
+            current = {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'version': getScriptsVersion(),
+                       'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                       'parameters': {name: parameters[name] for name in BENCHMARK_PARAMETERS},
+                       'generated': {'files': files, 'records': records, 'bytes': written},
+                       'stages': list(bestStages.values())}
+            print ('Stage\tNode\tWall s\tCPU s\tFiles\tMB/s\tRSS growth MB')
+            for stage in current['stages']:
+                print (f'{stage["stage"]}\t{stage["node"]}\t{stage["wall_seconds"]:.3f}\t{stage["cpu_seconds"]:.3f}\t{stage["files"]}\t{stage["mb_per_s"]:.2f}\t{stage["rss_growth_mb"] if stage["rss_growth_mb"] is not None else ""}')
+            previousResults = [previous for previous in readBenchmarkResults(parameters['results']) if previous['parameters'] == current['parameters']]
+            if len(previousResults) > 0:
+                for line in compareBenchmarkResults(previousResults[-1], current, parameters['regression_threshold']):
+                    print (line)
+            os.makedirs(os.path.dirname(os.path.abspath(parameters['results'])), exist_ok=True)
+            with open(parameters['results'], 'a') as resultsFile:
+                resultsFile.write(json.dumps(current) + '\n')
+            print (f'Benchmark result saved in {parameters["results"]}')
+    finally:
+        if testServer is not None:
+            testServer.stop()
+        if parameters['dir'] == '':
+            logging.shutdown()
+            shutil.rmtree(workDir, ignore_errors=True)
+    return result
+
+def main():
+    #Call example: python.exe Benchmark.py "file_size_mb=10" "report_workers=4"
+    result = benchmark(sys.argv[1:])
+    print (result)
+
+if __name__ == '__main__':
+    main()
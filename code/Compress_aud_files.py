@@ -20,6 +20,8 @@ Imports:
     - Util_files.read_config
     - Util_files.writeScriptsChecksumInLog
     - Util_files.compressFiles
+    - Util_files.getArchiveFilename
+    - Util_files.getCompressMonthStr
     - sys
 
 Functions:
@@ -50,7 +52,7 @@ Last update: 20240510
 import os
 import logging
 import datetime
-from Util_files import read_config, writeScriptsChecksumInLog, compressFiles
+from Util_files import read_config, writeScriptsChecksumInLog, compressFiles, getArchiveFilename, getCompressMonthStr
 import sys
 
 def compress_aud_files(force_month_str =''):
@@ -62,9 +64,16 @@ def compress_aud_files(force_month_str =''):
     #
     extractionConfig = config['EXTRACTION']
     old_files_in_days_to_be_extracted = int (extractionConfig['old_files_in_days_to_be_extracted'])
+    checksum_algorithm = extractionConfig.get('checksum_algorithm', 'md5')
     #
     compress_config = config['COMPRESS']
     compress_imported_aud_files_n_months_after = int (compress_config['compress_imported_aud_files_n_months_after'])
+    archive_format = compress_config.get('archive_format', 'tar.gz')
+    compression_codec = compress_config.get('compression_codec', 'gzip')
+    compression_level = int (compress_config.get('compression_level', '9'))
+    compression_workers = int (compress_config.get('compression_workers', '1'))
+    content_store_dir = compress_config.get('content_store_dir', '')
+    verify_archive = compress_config.get('verify_archive', '0')
     #compress_aud_files_organized_by_db_n_months_after = int (compress_config['compress_aud_files_organized_by_db_n_months_after'])
     #
     local_server = config['LOCAL_SERVER']
@@ -94,13 +103,10 @@ def compress_aud_files(force_month_str =''):
     logging.info('======================Compress AUD files ============================')    
     #Compress imported AUD Files 
     if result == 'OK':
-        fileMonthStr = fileDate.strftime('%Y%m')
-        month_str = int(fileMonthStr) - compress_imported_aud_files_n_months_after
-        if force_month_str != '':
-            month_str = force_month_str
+        month_str = getCompressMonthStr(fileDate, compress_imported_aud_files_n_months_after, force_month_str)
         logging.info(f'''Compress files by month: {month_str} {'(Calculated internally)' if force_month_str =='' else ''}''')
-        output_filename = f'{destinyDir}/{month_str}_aud_files.tar.gz'
-        result = compressFiles(destinyDir, output_filename, month_str, subdirs)
+        output_filename = getArchiveFilename(f'{destinyDir}/{month_str}_aud_files', archive_format, compression_codec)
+        result = compressFiles(destinyDir, output_filename, month_str, subdirs, 'aud', compression_codec, compression_level, compression_workers, content_store_dir, verify_archive, checksum_algorithm)
     #
     return result
 
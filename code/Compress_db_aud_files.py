@@ -20,6 +20,8 @@ Imports:
     - Util_files.read_config
     - Util_files.writeScriptsChecksumInLog
     - Util_files.compressFiles
+    - Util_files.getArchiveFilename
+    - Util_files.getCompressMonthStr
     - sys
 
 Functions:
@@ -49,7 +51,7 @@ Last update: 20240510
 import os
 import logging
 import datetime
-from Util_files import read_config, writeScriptsChecksumInLog, compressFiles
+from Util_files import read_config, writeScriptsChecksumInLog, compressFiles, getArchiveFilename, getCompressMonthStr
 import sys
 
 def compress_db_aud_files(force_month_str):
@@ -61,9 +63,16 @@ def compress_db_aud_files(force_month_str):
     #
     extractionConfig = config['EXTRACTION']
     old_files_in_days_to_be_extracted = int (extractionConfig['old_files_in_days_to_be_extracted'])
+    checksum_algorithm = extractionConfig.get('checksum_algorithm', 'md5')
     #
     compress_config = config['COMPRESS']
     compress_aud_files_organized_by_db_n_months_after = int (compress_config['compress_aud_files_organized_by_db_n_months_after'])
+    archive_format = compress_config.get('archive_format', 'tar.gz')
+    compression_codec = compress_config.get('compression_codec', 'gzip')
+    compression_level = int (compress_config.get('compression_level', '9'))
+    compression_workers = int (compress_config.get('compression_workers', '1'))
+    content_store_dir = compress_config.get('content_store_dir', '')
+    verify_archive = compress_config.get('verify_archive', '0')
     #
     local_server = config['LOCAL_SERVER']
     #destinyDir = local_server['local_dir_audit_files']
@@ -92,14 +101,10 @@ def compress_db_aud_files(force_month_str):
     logging.info('===============Compress AUD files organized by DB ===================')
     #Compress AUD Files organized by DB
     if result == 'OK':
-        fileMonthStr = fileDate.strftime('%Y%m')
-        #fileMonthStr = '202406'
-        month_str = int(fileMonthStr) - compress_aud_files_organized_by_db_n_months_after
-        if force_month_str != '':
-            month_str = force_month_str
+        month_str = getCompressMonthStr(fileDate, compress_aud_files_organized_by_db_n_months_after, force_month_str)
         logging.info(f"Compress files by month: {month_str} {'(Calculated internally)' if force_month_str =='' else ''}")
-        output_filename = f'{localDirOrganizedByDB}/{month_str}_db_aud_files.tar.gz'
-        result = compressFiles(localDirOrganizedByDB, output_filename, month_str, subdirs)
+        output_filename = getArchiveFilename(f'{localDirOrganizedByDB}/{month_str}_db_aud_files', archive_format, compression_codec)
+        result = compressFiles(localDirOrganizedByDB, output_filename, month_str, subdirs, 'aud', compression_codec, compression_level, compression_workers, content_store_dir, verify_archive, checksum_algorithm)
     #
     return result
 
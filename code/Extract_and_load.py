@@ -42,21 +42,39 @@ Dependencies:
     - Compress_aud_files module: Provides functionality for compressing audit files to save tar files into local_dir_audit_files directory.
     - Compress_db_aud_files module: Provides functionality for compressing database audit files to save tar files into local_dir_audit_files_by_db directory.
     - Util_files module: Provides utility functions for reading configuration and writing checksum in logs.
+    - Util_metrics module: Provides wall/CPU time, files, bytes, MB/s and RSS growth of each stage and node.
+
+Metrics ([METRICS] section of config.properties):
+    When metrics = 1, stage metrics are added to the mail body and saved in metrics_dir as
+    extract_and_load_metrics_{logFileDateStr}.json and audit_etl_extract_and_load.prom (Prometheus textfile collector).
+
+Pipeline mode (pipeline_mode = 1 in [EXTRACTION] section of config.properties):
+    Each extracted file flows through fetch -> hash -> place by db as soon as it lands, using bounded queues between stages
+    (pipeline_queue_size), and compression of old months runs at the same time because it uses other files.
+    A compression of the extraction month (forced compress_aud_month or compress_db_aud_month) runs after load, like in sequential mode.
+    Wall-clock time is close to the slowest stage instead of the sum of all stages.
+    Pipeline mode needs extraction_mode = sync (or a localhost source): scp.get copies a whole node directory at once,
+    so its files could only be handed to next stages after each node, and the run is stopped with ERROR.
 
 Author: Victor Hugo Gonzales Alvarez
 email: gonzalesv@tigo.net.bo, vicogo@gmail.com
 Last update: 20240512    
 """
 from Extractor import extractor
-from Loader_by_db import loader_by_db
+from Loader_by_db import loader_by_db, organizeAuditFile
 from Compress_aud_files import compress_aud_files
 from Compress_db_aud_files import compress_db_aud_files 
-from Util_files import read_config, writeScriptsChecksumInLog
+from Util_metrics import measureStage, addStageCounters, getMetricsSummary, writeMetrics
+from Util_files import read_config, writeScriptsChecksumInLog, closeSSHSessionPools, deleteDirContent, getFilesQuantityInDir, getChecksumFile, readChecksumManifest, updateChecksumManifest, getChecksumManifestPath, getChecksumManifestEntry, getTrustedChecksum, invalidateFileCatalog, startPipelineStage, stopPipelineStage, writeChecksumFile, writeChecksumLog, getCompressMonthStr
 import datetime
 import logging
 import traceback
 import os
 import sys
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 #
 import smtplib
 from os.path import basename
@@ -104,6 +122,152 @@ def prepare_and_send_mail(config,result_acumulator,log_filename):
         logging.error('Error triying sent and email')
     return result   
 
+def extract_and_load_pipeline(config, extract_date='', compress_aud_month='', compress_db_aud_month=''):
+    """
+    Function: extract_and_load_pipeline
+
+    Pipeline mode of extract_and_load: extractor sends each file to hash stage as soon as it is complete (checksum_workers threads),
+    and hashed files are placed by database (organizeAuditFile). compress_aud_files and compress_db_aud_files run at the same time,
+    except when their month is the extraction month: then they run after files are placed, because they delete the files they compress.
+    Day and db manifests are written when all files are placed. Checksum files are written by hash stage and checksum log from pipeline checksums,
+    because extracted files could be already moved when placement_strategy = move.
+    Files are handed off one by one only by extraction_mode = sync (or a localhost source), other extraction modes return ERROR.
+
+    Returns:
+        tuple: (result, result_acumulator) like sequential mode
+    """
+    extractionConfig = config['EXTRACTION']
+    old_files_in_days_to_be_extracted = int (extractionConfig['old_files_in_days_to_be_extracted'])
+    delete_destiny_dir_content = extractionConfig['delete_destiny_dir_content']
+    generate_checksum_files = extractionConfig['generate_checksum_files']
+    generate_chesksum_log = extractionConfig['generate_chesksum_log']
+    checksum_algorithm = extractionConfig.get('checksum_algorithm', 'md5')
+    checksum_workers = int (extractionConfig.get('checksum_workers', '1'))
+    pipeline_queue_size = int (extractionConfig.get('pipeline_queue_size', '64'))
+    extraction_mode = extractionConfig.get('extraction_mode', 'scp')
+    server = config['CBS_SERVER']['host']
+    subdirs = config['CBS_SERVER']['cbs_sub_dir_list_audit_files']
+    local_server = config['LOCAL_SERVER']
+    destinyDir = local_server['local_dir_audit_files']
+    localDirOrganizedByDB = local_server['local_dir_audit_files_by_db']
+    placement_strategy = config.get('LOAD', 'placement_strategy', fallback='copy')
+    compress_config = config['COMPRESS']
+    #
+    fileDateStr = (datetime.datetime.now() - datetime.timedelta(days=old_files_in_days_to_be_extracted)).strftime('%Y%m%d')
+    if extract_date != '':
+        fileDateStr = extract_date
+    # Same months calculated by compress modules: (stage, function, month parameter, compressed month)
+    compressFileDate = datetime.datetime.now() - datetime.timedelta(days=old_files_in_days_to_be_extracted)
+    compressStages = [('compress_aud_files()', compress_aud_files, compress_aud_month, getCompressMonthStr(compressFileDate, compress_config['compress_imported_aud_files_n_months_after'], compress_aud_month)),
+                      ('compress_db_aud_files()', compress_db_aud_files, compress_db_aud_month, getCompressMonthStr(compressFileDate, compress_config['compress_aud_files_organized_by_db_n_months_after'], compress_db_aud_month))]
+    #
+    result = 'OK'
+    result_acumulator = ''
+    startTime = time.perf_counter()
+    logging.info('========================Pipeline mode================================')
+    if extraction_mode != 'sync' and server != 'localhost':
+        # scp.get copies a whole node directory: files would reach next stages once per node, not as soon as each one lands
+        logging.error(f'Pipeline mode needs extraction_mode = sync, extraction_mode is {extraction_mode}')
+        return 'ERROR', f'\t extract_and_load_pipeline(): ERROR (pipeline_mode = 1 needs extraction_mode = sync)\n'
+    logging.info(f'Queue size between stages: {pipeline_queue_size}. Hash workers: {checksum_workers}')
+    errors = []
+    lock = threading.Lock()
+    dayManifests = {}
+    dayManifestEntries = {}
+    dbManifestEntries = {}
+    placementCounter = {}
+    hashQueue = queue.Queue(maxsize=pipeline_queue_size)
+    placeQueue = queue.Queue(maxsize=pipeline_queue_size)
+
+    def hashFile(item):
+        # Checksum calculated during transfer (sync mode) or trusted from day manifest is not calculated again
+        dayDir, filename, checksum = item
+        filePath = os.path.join(dayDir, filename)
+        if checksum is None:
+            with lock:
+                if dayDir not in dayManifests:
+                    dayManifests[dayDir] = readChecksumManifest(getChecksumManifestPath(dayDir))
+            checksum = getTrustedChecksum(dayManifests[dayDir], filename, filePath, checksum_algorithm)
+        if checksum is None:
+            checksum = getChecksumFile(filePath, checksum_algorithm)
+        manifestEntry = getChecksumManifestEntry(filePath, checksum, checksum_algorithm)
+        with lock:
+            dayManifestEntries.setdefault(dayDir, {})[filename] = manifestEntry
+        # Checksum file is written before placement, file could be moved to local_dir_audit_files_by_db (placement_strategy = move)
+        if generate_checksum_files == '1':
+            writeChecksumFile(filePath, checksum)
+        return dayDir, filename, checksum
+
+    def placeAuditFile(item):
+        dayDir, filename, checksum = item
+        destFilename, destPath, usedStrategy = organizeAuditFile(dayDir, localDirOrganizedByDB, filename, placement_strategy)
+        manifestEntry = getChecksumManifestEntry(destPath, checksum, checksum_algorithm)
+        with lock:
+            placementCounter[usedStrategy] = placementCounter.get(usedStrategy, 0) + 1
+            dbManifestEntries.setdefault(os.path.basename(dayDir), {})[destFilename] = manifestEntry
+        addStageCounters('pipeline', files=1, bytes=os.path.getsize(destPath))
+        logging.info(f'Placed by DB: {destFilename}')
+
+    with ThreadPoolExecutor(max_workers=2) as compressExecutor:
+        # Old months compression does not use files of extraction day, compression of extraction month would delete files being extracted and placed
+        compressFutures = {}
+        for stage, function, month_str, compressMonthStr in compressStages:
+            if compressMonthStr == fileDateStr[:6]:
+                logging.info(f'{stage} month {compressMonthStr} is the extraction month, it runs after load')
+            else:
+                compressFutures[stage] = compressExecutor.submit(function, month_str)
+        exceptfiles='\\.tar\\.gz'
+        if delete_destiny_dir_content == '1' and getFilesQuantityInDir(localDirOrganizedByDB, fileDateStr, exceptfiles) > 0:
+            result = deleteDirContent(localDirOrganizedByDB, fileDateStr, exceptfiles, justSubdirs=subdirs)
+        # pipeline metrics: fetch, hash and place stages together, files and bytes placed by db
+        with measureStage('pipeline') as metric:
+            hashThreads = startPipelineStage(hashQueue, placeQueue, hashFile, checksum_workers, errors)
+            placeThreads = startPipelineStage(placeQueue, None, placeAuditFile, 1, errors)
+            try:
+                if result == 'OK':
+                    result = extractor(extract_date, lambda dayDir, filename, checksum: hashQueue.put((dayDir, filename, checksum)))
+                    result_acumulator = result_acumulator + f'\t extractor(): {result}\n'
+            finally:
+                stopPipelineStage(hashQueue, hashThreads)
+                stopPipelineStage(placeQueue, placeThreads)
+            metric.result = 'OK' if result == 'OK' and len(errors) == 0 else 'ERROR'
+        for dayDir, entries in dayManifestEntries.items():
+            updateChecksumManifest(getChecksumManifestPath(dayDir), entries)
+        for dayStr, entries in dbManifestEntries.items():
+            updateChecksumManifest(getChecksumManifestPath(f'{localDirOrganizedByDB}/{dayStr}'), entries)
+        invalidateFileCatalog(destinyDir)
+        invalidateFileCatalog(localDirOrganizedByDB)
+        for item, error, errorTraceback in errors:
+            logging.error(f'Exception occurred in pipeline processing {item}:')
+            logging.error(f'{error}')
+            logging.error(f'Traceback: {errorTraceback}')
+        for usedStrategy, counter in sorted(placementCounter.items()):
+            logging.info(f'Files placed using {usedStrategy}: {counter}')
+        loadResult = 'OK' if result == 'OK' and len(errors) == 0 else 'ERROR'
+        result_acumulator = result_acumulator + f'\t loader_by_db(): {loadResult}\n'
+        if loadResult == 'OK' and generate_chesksum_log =='1':
+            # Checksum log is written from pipeline checksums, extracted files could be already moved by placement
+            checksumLog = []
+            for dayDir, entries in sorted(dayManifestEntries.items()):
+                for filename, manifestEntry in sorted(entries.items()):
+                    checksumLog.append((os.path.relpath(os.path.join(dayDir, filename), destinyDir), manifestEntry[3]))
+            fileCounter = writeChecksumLog(checksumLog)
+            logging.info(f'Total checksum files calculated: {fileCounter}')
+        result = loadResult
+        for stage, function, month_str, compressMonthStr in compressStages:
+            # Like sequential mode, extraction month is compressed only when its files were loaded
+            if stage not in compressFutures and loadResult == 'OK':
+                compressFutures[stage] = compressExecutor.submit(function, month_str)
+        for stage, function, month_str, compressMonthStr in compressStages:
+            if stage not in compressFutures:
+                continue
+            compressResult = compressFutures[stage].result()
+            result_acumulator = result_acumulator + f'\t {stage}:{compressResult}\n'
+            if compressResult != 'OK':
+                result = 'ERROR'
+    logging.info(f'Pipeline finished in {time.perf_counter() - startTime:.2f} s')
+    return result, result_acumulator
+
 def extract_and_load(extract_date='', compress_aud_month='', compress_db_aud_month='' ):
     """
     Function: extract_and_load
@@ -129,6 +293,9 @@ def extract_and_load(extract_date='', compress_aud_month='', compress_db_aud_mon
     local_dir_logs = local_server['local_dir_logs']   
     local_dir_scripts = local_server['local_dir_scripts'] 
     #
+    metrics = config.get('METRICS', 'metrics', fallback='0')
+    metrics_dir = config.get('METRICS', 'metrics_dir', fallback='') or local_dir_logs
+    #
     logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
     log_filename = f'{local_dir_logs}/extract_and_load_{logFileDateStr}.log'
     logging_defined_before = logging.getLogger().hasHandlers() 
@@ -147,23 +314,39 @@ def extract_and_load(extract_date='', compress_aud_month='', compress_db_aud_mon
         result = writeScriptsChecksumInLog(local_dir_scripts)
         result_acumulator = result_acumulator + f'\t writeScriptsChecksumInLog(..): {result}\n'  
 
-    if result == 'OK': 
+    pipeline_mode = config['EXTRACTION'].get('pipeline_mode', '0')
+    if result == 'OK' and pipeline_mode == '1':
+        result, pipeline_result_acumulator = extract_and_load_pipeline(config, extract_date, compress_aud_month, compress_db_aud_month)
+        result_acumulator = result_acumulator + pipeline_result_acumulator
+    #
+    if result == 'OK' and pipeline_mode != '1': 
         result = extractor(extract_date)
         result_acumulator = result_acumulator + f'\t extractor(): {result}\n' 
     #
-    if result == 'OK':
+    if result == 'OK' and pipeline_mode != '1':
         result = loader_by_db(extract_date)
         result_acumulator = result_acumulator + f'\t loader_by_db(): {result}\n'
     #
 
-    if result == 'OK':
+    if result == 'OK' and pipeline_mode != '1':
         result = compress_aud_files(compress_aud_month)
         result_acumulator = result_acumulator + f'\t compress_aud_files():{result}\n'
     #
-    if result == 'OK':
+    if result == 'OK' and pipeline_mode != '1':
         result = compress_db_aud_files(compress_db_aud_month)
         result_acumulator = result_acumulator + f'\t compress_db_aud_files():{result}\n'
 
+    # SSH sessions are shared by all stages during the run
+    closeSSHSessionPools()
+    if metrics == '1':
+        try:
+            jsonFilename, promFilename = writeMetrics(metrics_dir, 'extract_and_load')
+            logging.info(f'Stage metrics saved in {jsonFilename} and {promFilename}')
+        except Exception as e:
+            logging.error('Exception occurred:' )
+            logging.error(f'{e}')
+            logging.error(f'Traceback: {traceback.format_exc()}')
+        result_acumulator = result_acumulator + '\n' + getMetricsSummary()
     result = prepare_and_send_mail(config,result_acumulator, log_filename)
     return result
 
@@ -12,6 +12,8 @@ Algorithm:
     If exists, delete files in local directory: aud-extract
     Copy audit files from external server, put this files in local directory: aud-extract
     Calculate checksum files from directory- aud-extract
+        extraction_mode = sync: checksum of each file is calculated while its bytes arrive and saved in day manifest, files are not read again
+        extraction_mode = scp: scp.get writes files without checksum, each copied file is read again from disk to calculate it
 
 Additional details:
     In remote server in a directory defined (see config.properties) there is a main directory that contains sub-directories like this:
@@ -114,26 +116,48 @@ Imports:
     - os
     - logging
     - datetime
-    - glob
-    - re
-    - SCPClient (from scp)
+    - SCPClient (from scp, optional: only extraction_mode = scp)
     - traceback
     - hashlib
+    - fnmatch
+    - Util_matcher.getDateFileMatcher
+    - concurrent.futures.ThreadPoolExecutor
+    - concurrent.futures.as_completed
     - Util_files.deleteDirContent
-    - Util_files.createSSHClient
     - Util_files.read_config
     - Util_files.createAudFilesInLocalDir
     - Util_files.writeScriptsChecksumInLog
     - Util_files.getFilesQuantityInRemoteDir
-    - Util_files.getParamikoSSHCLient
     - Util_files.getFilesQuantityInDir
+    - Util_files.getSSHSessionPool
+    - Util_files.closeSSHSessionPools
+    - Util_files.getChecksumFiles
+    - Util_files.newChecksum
+    - Util_files.updateChecksumFromFile
+    - Util_files.getChecksumManifestPath
+    - Util_files.readChecksumManifest
+    - Util_files.updateChecksumManifest
+    - Util_files.getChecksumManifestEntry
+    - Util_files.getTrustedChecksum
+    - Util_files.splitDayDirPath
+    - Util_files.getFileCatalog
+    - Util_files.invalidateFileCatalog
+    - Util_files.writeChecksumFile
+    - Util_files.writeChecksumLog
+    - Util_metrics.measureStage
+    - Util_metrics.measuredStage
+    - Util_metrics.addStageCounters
     - configparser
     - sys
 
 Functions:
-    1. copyAudFilesFromExternalServer(sourceDir, destinyDir, fileDateStr, subdirs, server='localhost', port='', user='', password='')
-    2. checksumFiles(destinyDir, fileDateStr, generate_checksum_files='0', generate_chesksum_log='1')
-    3. extractor(force_fileDateStr='')
+    1. copyAudFilesFromNode(session, sourceDir, destinyDir, fileDateStr, subdir, onFileReady=None)
+    2. syncAudFileFromNode(sftp, remotePath, localPath, attr, checksum_algorithm='md5')
+    3. syncAudFilesFromNode(session, sourceDir, destinyDir, fileDateStr, subdir, manifestEntries=None, checksum_algorithm='md5', onFileReady=None)
+    4. copyAudFilesFromNodeInPooledSession(sessionPool, sourceDir, destinyDir, fileDateStr, subdir, extraction_mode='scp', manifestEntries=None, checksum_algorithm='md5', onFileReady=None)
+    5. copyAudFilesFromExternalServer(sourceDir, destinyDir, fileDateStr, subdirs, server='localhost', port='', user='', password='', extraction_workers=1, extraction_mode='scp', keepalive_interval=30, checksum_algorithm='md5', onFileReady=None)
+    6. checksumFiles(destinyDir, fileDateStr, generate_checksum_files='0', generate_chesksum_log='1', checksum_algorithm='md5', checksum_workers=1)
+    7. extractor(force_fileDateStr='', onFileReady=None)
 
 Usage Examples:
     1. Copy audit files from an external server to a local directory:
@@ -161,59 +185,204 @@ import shutil
 import os
 import logging
 import datetime
-import glob
-import re
-from scp import SCPClient
+try:
+    from scp import SCPClient
+except ImportError:
+    # Only needed by extraction_mode = scp
+    SCPClient = None
 import traceback
 import hashlib
-from Util_files import deleteDirContent, createSSHClient, read_config, createAudFilesInLocalDir, writeScriptsChecksumInLog, getFilesQuantityInRemoteDir, getParamikoSSHCLient, getFilesQuantityInDir
+import fnmatch
+from Util_matcher import getDateFileMatcher
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from Util_files import deleteDirContent, read_config, createAudFilesInLocalDir, writeScriptsChecksumInLog, getFilesQuantityInRemoteDir, getFilesQuantityInDir, getSSHSessionPool, closeSSHSessionPools, getChecksumFiles, newChecksum, updateChecksumFromFile, getChecksumManifestPath, readChecksumManifest, updateChecksumManifest, getChecksumManifestEntry, getTrustedChecksum, splitDayDirPath, getFileCatalog, invalidateFileCatalog, writeChecksumFile, writeChecksumLog
+from Util_metrics import measureStage, measuredStage, addStageCounters
 import configparser
 import sys
 
-def copyAudFilesFromExternalServer(sourceDir,destinyDir, fileDateStr, subdirs, server='localhost', port='', user='', password='' ):
+# Bytes read from remote file on each SFTP request in incremental sync mode
+SYNC_CHUNK_SIZE = 1024 * 1024
+
+def copyAudFilesFromNode(session, sourceDir, destinyDir, fileDateStr, subdir, onFileReady=None):
+    result = 'OK'
+    fileCounter = 0
+    if SCPClient is None:
+        raise ValueError('extraction_mode scp needs scp module (pip install scp), extraction_mode sync needs paramiko only')
+    with SCPClient(session.transport(), sanitize=lambda x: x) as scp:
+        #If directory does not exists then it will be created
+        destinyPathDate= f'{destinyDir}/{fileDateStr}/{subdir}'
+        if not os.path.exists(destinyPathDate):
+            createAudFilesInLocalDir (destinyPathDate)
+        file_counter_destiny_directory = len([name for name in os.listdir(destinyPathDate) if os.path.isfile(os.path.join(destinyPathDate, name))])
+        if file_counter_destiny_directory ==0:
+            file_quantity_in_source_dir = getFilesQuantityInRemoteDir(session, f'{sourceDir}/{subdir}', fileDateStr)
+            logging.info (f'File quantity in source directory {subdir}: {file_quantity_in_source_dir}')
+            #This validation is neccesary to avoid error in scp.get command
+            if file_quantity_in_source_dir > 0:
+                scp.get(remote_path=f'{sourceDir}/{subdir}/*{fileDateStr}*.aud', local_path=f'{destinyPathDate}/.')
+                for filename in os.listdir(destinyPathDate):
+                    if os.path.isfile(os.path.join(destinyPathDate, filename)):
+                        fileCounter = fileCounter + 1
+                        addStageCounters('copyAudFilesFromNode', bytes=os.path.getsize(os.path.join(destinyPathDate, filename)), node=subdir)
+                        logging.info(f'{subdir} {fileCounter}: {filename}')
+                        if onFileReady is not None:
+                            onFileReady(f'{destinyDir}/{fileDateStr}', f'{subdir}/{filename}', None)
+        else:
+            logging.info(f'The directory {fileDateStr}/{subdir} has {file_counter_destiny_directory} files. Copy cannot by realized.')
+    return result, fileCounter
+
+def syncAudFileFromNode(sftp, remotePath, localPath, attr, checksum_algorithm='md5'):
+    # One file of incremental sync: returns (checksum, offset, transferredBytes), checksum is None when local copy is up to date
+    offset = 0
+    if os.path.isfile(localPath):
+        localStats = os.stat(localPath)
+        if localStats.st_size == attr.st_size and int(localStats.st_mtime) >= attr.st_mtime:
+            return None, 0, 0
+        if localStats.st_size < attr.st_size:
+            # AUD files are append only: a truncated or outdated local copy is resumed from its last byte
+            offset = localStats.st_size
+    transferredBytes = 0
+    checksum = newChecksum(checksum_algorithm)
+    if offset > 0:
+        updateChecksumFromFile(checksum, localPath)
+    with sftp.open(remotePath, 'rb') as remoteFile:
+        remoteFile.seek(offset)
+        remoteFile.prefetch(attr.st_size)
+        with open(localPath, 'ab' if offset > 0 else 'wb') as localFile:
+            while True:
+                data = remoteFile.read(SYNC_CHUNK_SIZE)
+                if not data:
+                    break
+                localFile.write(data)
+                checksum.update(data)
+                transferredBytes = transferredBytes + len(data)
+    os.utime(localPath, (attr.st_atime, attr.st_mtime))
+    return checksum.hexdigest(), offset, transferredBytes
+
+def syncAudFilesFromNode(session, sourceDir, destinyDir, fileDateStr, subdir, manifestEntries=None, checksum_algorithm='md5', onFileReady=None):
+    # Incremental sync: only missing, truncated or modified files are transferred, partial files are resumed
+    # Checksum of each transferred file is calculated while its bytes arrive and saved into manifestEntries
+    # onFileReady(dayDir, filename, checksum) is called as soon as each file is complete (pipeline mode), checksum is None when file was not transferred
+    result = 'OK'
+    fileCounter = 0
+    bytesCounter = 0
+    destinyPathDate= f'{destinyDir}/{fileDateStr}/{subdir}'
+    if not os.path.exists(destinyPathDate):
+        createAudFilesInLocalDir (destinyPathDate)
+    sftp = session.sftp()
+    remoteFiles = [attr for attr in sftp.listdir_attr(f'{sourceDir}/{subdir}') if fnmatch.fnmatch(attr.filename, f'*{fileDateStr}*.aud')]
+    logging.info (f'File quantity in source directory {subdir}: {len(remoteFiles)}')
+    for attr in sorted(remoteFiles, key=lambda attr: attr.filename):
+        remotePath = f'{sourceDir}/{subdir}/{attr.filename}'
+        localPath = f'{destinyPathDate}/{attr.filename}'
+        checksum, offset, transferredBytes = syncAudFileFromNode(sftp, remotePath, localPath, attr, checksum_algorithm)
+        if checksum is None:
+            if onFileReady is not None:
+                onFileReady(f'{destinyDir}/{fileDateStr}', f'{subdir}/{attr.filename}', None)
+            continue
+        bytesCounter = bytesCounter + transferredBytes
+        if manifestEntries is not None:
+            manifestEntries[f'{subdir}/{attr.filename}'] = getChecksumManifestEntry(localPath, checksum, checksum_algorithm)
+        fileCounter = fileCounter + 1
+        logging.info(f'{subdir} {fileCounter}: {attr.filename}{f" (resumed from byte {offset})" if offset > 0 else ""}')
+        if onFileReady is not None:
+            onFileReady(f'{destinyDir}/{fileDateStr}', f'{subdir}/{attr.filename}', checksum)
+    addStageCounters('copyAudFilesFromNode', bytes=bytesCounter, node=subdir)
+    logging.info(f'Bytes transferred from {subdir}: {bytesCounter}')
+    return result, fileCounter
+
+def copyAudFilesFromNodeInPooledSession(sessionPool, sourceDir, destinyDir, fileDateStr, subdir, extraction_mode='scp', manifestEntries=None, checksum_algorithm='md5', onFileReady=None):
+    # Each worker takes its own SSH session from the pool, so a failing node does not abort the others
+    # When the connection drops, node is copied again once on a new connection (sync mode resumes partial files)
+    # Node metrics: files and bytes transferred from node, they are added to copyAudFilesFromExternalServer metrics too
+    result = 'OK'
+    fileCounter = 0
+    attempts = []
+    readyFiles = set()
+
+    def onNodeFileReady(dayDir, filename, checksum):
+        # Files sent to next stages before the connection dropped are not sent again
+        if (dayDir, filename) not in readyFiles:
+            readyFiles.add((dayDir, filename))
+            onFileReady(dayDir, filename, checksum)
+
+    def copyNode(session):
+        attempts.append(session)
+        if extraction_mode == 'sync':
+            return syncAudFilesFromNode(session, sourceDir, destinyDir, fileDateStr, subdir, manifestEntries, checksum_algorithm, onNodeFileReady if onFileReady is not None else None)
+        destinyPathDate = f'{destinyDir}/{fileDateStr}/{subdir}'
+        if len(attempts) > 1 and os.path.isdir(destinyPathDate):
+            # scp copies only into an empty node directory: files of the copy cut off by the dropped connection are removed
+            for filename in os.listdir(destinyPathDate):
+                if os.path.isfile(os.path.join(destinyPathDate, filename)):
+                    os.remove(os.path.join(destinyPathDate, filename))
+        return copyAudFilesFromNode(session, sourceDir, destinyDir, fileDateStr, subdir, onNodeFileReady if onFileReady is not None else None)
+
+    with measureStage('copyAudFilesFromNode', subdir) as metric:
+        try:
+            result, fileCounter = sessionPool.run(copyNode)
+        except Exception as e:
+            logging.error(f'Exception occurred copying node {subdir}:' )
+            logging.error(f'server={sessionPool.host}, port={sessionPool.port}')
+            logging.error(f'{e}')
+            logging.error(f'Traceback: {traceback.format_exc()}')
+            result = 'ERROR'
+        metric.add(files=fileCounter)
+        metric.result = result
+    addStageCounters('copyAudFilesFromExternalServer', files=fileCounter, bytes=metric.bytes)
+    return result, fileCounter
+
+@measuredStage('copyAudFilesFromExternalServer')
+def copyAudFilesFromExternalServer(sourceDir,destinyDir, fileDateStr, subdirs, server='localhost', port='', user='', password='', extraction_workers=1, extraction_mode='scp', keepalive_interval=30, checksum_algorithm='md5', onFileReady=None):
     result = 'OK'
     logging.info(f'Start copying files from server {server}, directory {sourceDir} to local directory {destinyDir}/{fileDateStr}')
     fileCounter = 0
     try:    
         if server == 'localhost':
-            for filename in glob.glob('**', recursive=True, root_dir=sourceDir):
+            isFileToCopy = getDateFileMatcher(fileDateStr, 'aud')
+            for entry in getFileCatalog(sourceDir, fileDateStr):
+                filename = entry.path
                 destPath = os.path.join(destinyDir, filename)
                 sourcePath = os.path.join(sourceDir, filename)
-                if os.path.isfile(sourcePath) and re.search(f'.*{fileDateStr}.*\\.aud', filename):
+                if entry.isFile and isFileToCopy(filename):
                     fileCounter = fileCounter + 1
                     destDir = os.path.join(destinyDir, os.path.dirname(filename))
                     if not os.path.exists(destDir):
                         os.makedirs(destDir, exist_ok=True)
                         logging.info(f'Directory {destDir} created')
                     shutil.copy(sourcePath, destPath)
+                    addStageCounters('copyAudFilesFromExternalServer', files=1, bytes=os.path.getsize(destPath))
                     logging.info(f'{fileCounter}: {filename}')
+                    if onFileReady is not None:
+                        dayDir, relPath = splitDayDirPath(filename)
+                        onFileReady(os.path.join(destinyDir, dayDir), relPath, None)
         else:
-            ssh = createSSHClient(server, port, user, password)
-            paramikoSSHCLient =  getParamikoSSHCLient(server, port, user, password)
-            with SCPClient(ssh.get_transport(), sanitize=lambda x: x) as scp:
-                for subdir in  subdirs.split('\n'):
-                    if subdir != '':
-                        #If directory does not exists then it will be created
-                        destinyPathDate= f'{destinyDir}/{fileDateStr}/{subdir}'
-                        if not os.path.exists(destinyPathDate):
-                            createAudFilesInLocalDir (destinyPathDate)
-                        file_counter_destiny_directory = len([name for name in os.listdir(destinyPathDate) if os.path.isfile(os.path.join(destinyPathDate, name))])                            
-                        if file_counter_destiny_directory ==0:
-                            #file_quantity_in_source_dir = getFilesQuantityInRemoteDir(server, port, user, password, f'{sourceDir}/{subdir}', fileDateStr)
-                            file_quantity_in_source_dir = getFilesQuantityInRemoteDir(paramikoSSHCLient, f'{sourceDir}/{subdir}', fileDateStr)
-                            logging.info (f'File quantity in source directory {subdir}: {file_quantity_in_source_dir}')
-                            #This validation is neccesary to avoid error in scp.get command
-                            if file_quantity_in_source_dir > 0:
-                                scp.get(remote_path=f'{sourceDir}/{subdir}/*{fileDateStr}*.aud', local_path=f'{destinyPathDate}/.')                            
-                                for filename in os.listdir(destinyPathDate):
-                                    if os.path.isfile(os.path.join(destinyPathDate, filename)):
-                                        fileCounter = fileCounter + 1
-                                        logging.info(f'{fileCounter}: {filename}')
-                                fileCounter = fileCounter - file_counter_destiny_directory 
-                        else:
-                          logging.info(f'The directory {fileDateStr}/{subdir} has {file_counter_destiny_directory} files. Copy cannot by realized.')
-            ssh.close()
-            paramikoSSHCLient.close()
+            subdirList = [subdir for subdir in subdirs.split('\n') if subdir != '']
+            failedSubdirs = []
+            manifestEntries = {}
+            sessionPool = getSSHSessionPool(server, port, user, password, max(1, int(extraction_workers)), keepalive_interval)
+            if int(extraction_workers) > 1:
+                logging.info(f'Concurrent extraction using {extraction_workers} workers')
+                with ThreadPoolExecutor(max_workers=int(extraction_workers)) as executor:
+                    futures = {executor.submit(copyAudFilesFromNodeInPooledSession, sessionPool, sourceDir, destinyDir, fileDateStr, subdir, extraction_mode, manifestEntries, checksum_algorithm, onFileReady): subdir for subdir in subdirList}
+                    for future in as_completed(futures):
+                        nodeResult, nodeFileCounter = future.result()
+                        fileCounter = fileCounter + nodeFileCounter
+                        if nodeResult != 'OK':
+                            failedSubdirs.append(futures[future])
+            else:
+                for subdir in subdirList:
+                    nodeResult, nodeFileCounter = copyAudFilesFromNodeInPooledSession(sessionPool, sourceDir, destinyDir, fileDateStr, subdir, extraction_mode, manifestEntries, checksum_algorithm, onFileReady)
+                    fileCounter = fileCounter + nodeFileCounter
+                    if nodeResult != 'OK':
+                        failedSubdirs.append(subdir)
+            if len(manifestEntries) > 0:
+                updateChecksumManifest(getChecksumManifestPath(f'{destinyDir}/{fileDateStr}'), manifestEntries)
+                logging.info(f'Checksums calculated during transfer: {len(manifestEntries)}')
+            if len(failedSubdirs) > 0:
+                logging.error(f'Nodes with extraction errors: {", ".join(sorted(failedSubdirs))}')
+                result = 'ERROR'
+        invalidateFileCatalog(destinyDir)
         logging.info(f'Total files copied: {fileCounter}')
     except Exception as e:
         logging.error('Exception occurred:' )
@@ -223,7 +392,8 @@ def copyAudFilesFromExternalServer(sourceDir,destinyDir, fileDateStr, subdirs, s
         result = 'ERROR'
     return result
 
-def checksumFiles(destinyDir, fileDateStr, generate_checksum_files='0', generate_chesksum_log='1'):
+@measuredStage('checksumFiles')
+def checksumFiles(destinyDir, fileDateStr, generate_checksum_files='0', generate_chesksum_log='1', checksum_algorithm='md5', checksum_workers=1):
     result = 'OK'
     fileCounter = 0
     logging.info(f'Start calculating checksum files from {destinyDir}')    
@@ -233,23 +403,47 @@ def checksumFiles(destinyDir, fileDateStr, generate_checksum_files='0', generate
     else:
         try:
             #for filename in os.listdir(destinyDir):
-            for filename in glob.glob('**', recursive=True, root_dir=destinyDir):
+            filenames = []
+            isFileToChecksum = getDateFileMatcher(fileDateStr, 'aud')
+            for entry in getFileCatalog(destinyDir, fileDateStr):
+                filename = entry.path
+                filePath = os.path.join(destinyDir, filename)
+                if not filename.endswith('~') and entry.isFile and isFileToChecksum(filePath):
+                    filenames.append(filename)
+                    addStageCounters('checksumFiles', files=1, bytes=os.path.getsize(filePath))
+            # Checksums calculated during extraction are read from day manifest, other files are hashed
+            manifests = {}
+            checksums = {}
+            for filename in filenames:
                 filePath = os.path.join(destinyDir, filename)
-                if not filename.endswith('~') and os.path.isfile(filePath) and re.search(f'.*{fileDateStr}.*\\.aud', filePath):
-                    fileCounter = fileCounter +1
-                    #fnaav = os.path.join(destinyDir, filename);
-                    #fd = open(fnaav, 'rb');
-                    fd = open(filePath, 'rb')
-                    data = fd.read()
-                    fd.close()
-                    checksumFile = hashlib.md5(data).hexdigest()
-                    #crear archivo checksum
-                    if generate_checksum_files == '1':
-                        with open(f'{filePath}.cheksum', "w") as text_file:
-                            text_file.write("%s" % checksumFile)
-                    #
-                    if generate_chesksum_log == '1':
-                        logging.info(f'{fileCounter}: {filename} - {checksumFile}')
+                dayDir, relPath = splitDayDirPath(filename)
+                if dayDir not in manifests:
+                    manifests[dayDir] = readChecksumManifest(getChecksumManifestPath(os.path.join(destinyDir, dayDir)))
+                checksumFile = getTrustedChecksum(manifests[dayDir], relPath, filePath, checksum_algorithm)
+                if checksumFile is not None:
+                    checksums[filePath] = checksumFile
+            logging.info(f'Checksums trusted from manifest: {len(checksums)}')
+            pendingPaths = set(os.path.join(destinyDir, filename) for filename in filenames) - set(checksums)
+            checksums.update(getChecksumFiles(sorted(pendingPaths), checksum_algorithm, checksum_workers))
+            newManifestEntries = {}
+            checksumLog = []
+            for filename in filenames:
+                filePath = os.path.join(destinyDir, filename)
+                fileCounter = fileCounter +1
+                checksumFile = checksums[filePath]
+                if filePath in pendingPaths:
+                    dayDir, relPath = splitDayDirPath(filename)
+                    newManifestEntries.setdefault(dayDir, {})[relPath] = getChecksumManifestEntry(filePath, checksumFile, checksum_algorithm)
+                #crear archivo checksum
+                if generate_checksum_files == '1':
+                    writeChecksumFile(filePath, checksumFile)
+                checksumLog.append((filename, checksumFile))
+            #
+            if generate_chesksum_log == '1':
+                writeChecksumLog(checksumLog)
+            for dayDir, entries in newManifestEntries.items():
+                if dayDir != '':
+                    updateChecksumManifest(getChecksumManifestPath(os.path.join(destinyDir, dayDir)), entries)
         except Exception as e:
             logging.error('Exception occurred:' )
             logging.error(f'{e}')
@@ -258,7 +452,10 @@ def checksumFiles(destinyDir, fileDateStr, generate_checksum_files='0', generate
     logging.info(f'Total checksum files calculated: {fileCounter}')
     return result
 
-def extractor(force_fileDateStr=''):
+@measuredStage('extractor')
+def extractor(force_fileDateStr='', onFileReady=None):
+    # onFileReady: pipeline mode (see Extract_and_load), each extracted file is sent to next stages as soon as it lands
+    # and checksums are calculated by pipeline instead of checksumFiles
     # 
     config = read_config(f'{os.path.dirname(os.path.abspath(__file__))}\\config.properties')
     #
@@ -267,6 +464,7 @@ def extractor(force_fileDateStr=''):
     port = cbs_config['port']
     user = cbs_config['user']
     password = cbs_config['password']
+    keepalive_interval = int (cbs_config.get('keepalive_interval', '30'))
     sourceDir = cbs_config['cbs_base_dir_audit_files']
     subdirs = cbs_config['cbs_sub_dir_list_audit_files']
     #
@@ -281,6 +479,10 @@ def extractor(force_fileDateStr=''):
     delete_destiny_dir_content = extractionConfig['delete_destiny_dir_content']
     generate_checksum_files = extractionConfig['generate_checksum_files']
     generate_chesksum_log = extractionConfig['generate_chesksum_log']
+    extraction_workers = int (extractionConfig.get('extraction_workers', '1'))
+    extraction_mode = extractionConfig.get('extraction_mode', 'scp')
+    checksum_algorithm = extractionConfig.get('checksum_algorithm', 'md5')
+    checksum_workers = int (extractionConfig.get('checksum_workers', '1'))
     #
     fileDate = datetime.datetime.now() - datetime.timedelta(days=old_files_in_days_to_be_extracted)
     fileDateStr = fileDate.strftime('%Y%m%d')
@@ -310,14 +512,17 @@ def extractor(force_fileDateStr=''):
     exceptfiles='\\.tar\\.gz'
     file_quantity_in_dir = getFilesQuantityInDir(f'{destinyDir}/{fileDateStr}', fileDateStr, exceptfiles)      
     if result == 'OK' and delete_destiny_dir_content == '1' and file_quantity_in_dir > 0:
-        result = deleteDirContent(f'{destinyDir}/{fileDateStr}', fileDateStr,exceptfiles)
+        if extraction_mode == 'sync':
+            logging.info(f'Incremental sync mode: content of {destinyDir}/{fileDateStr} is kept to be completed')
+        else:
+            result = deleteDirContent(f'{destinyDir}/{fileDateStr}', fileDateStr,exceptfiles)
 
     if result == 'OK':
         #result = extractor (sourceDir, destinyDir, fileDateStr, subdirs, server, port, user, password)
-        result = copyAudFilesFromExternalServer(sourceDir,destinyDir, fileDateStr, subdirs, server, port, user, password)
+        result = copyAudFilesFromExternalServer(sourceDir,destinyDir, fileDateStr, subdirs, server, port, user, password, extraction_workers, extraction_mode, keepalive_interval, checksum_algorithm, onFileReady)
 
-    if result == 'OK' and (generate_checksum_files == '1' or generate_chesksum_log =='1'):
-        result = checksumFiles(destinyDir, fileDateStr, generate_checksum_files, generate_chesksum_log)
+    if result == 'OK' and (generate_checksum_files == '1' or generate_chesksum_log =='1') and onFileReady is None:
+        result = checksumFiles(destinyDir, fileDateStr, generate_checksum_files, generate_chesksum_log, checksum_algorithm, checksum_workers)
     #
     return result
 
@@ -329,6 +534,7 @@ def main():
         if i==1:
             force_fileDateStr = arg     
     result = extractor(force_fileDateStr) 
+    closeSSHSessionPools()
     print (result)
 
 if __name__ == '__main__':
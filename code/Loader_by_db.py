@@ -39,19 +39,29 @@ Imports:
     - os
     - logging
     - traceback
-    - glob
-    - re
     - shutil
     - datetime
     - Util_files.read_config
     - Util_files.deleteDirContent
     - Util_files.writeScriptsChecksumInLog
     - Util_files.getFilesQuantityInDir
+    - Util_files.readChecksumManifest
+    - Util_files.updateChecksumManifest
+    - Util_files.getChecksumManifestPath
+    - Util_files.getChecksumManifestEntry
+    - Util_files.getTrustedChecksum
+    - Util_files.placeFile
+    - Util_files.getFileCatalog
+    - Util_files.invalidateFileCatalog
+    - Util_matcher.getDateFileMatcher
+    - Util_metrics.measuredStage
+    - Util_metrics.addStageCounters
     - sys
 
 Functions:
-    1. organizeAuditFilesbyDB(sourceDir, destinyDir, fileDateStr, subdirs)
-    2. loader_by_db(force_fileDateStr='')
+    1. organizeAuditFile(sourceDir, destinyDir, filename, placement_strategy='copy')
+    2. organizeAuditFilesbyDB(sourceDir, destinyDir, fileDateStr, subdirs, placement_strategy='copy')
+    3. loader_by_db(force_fileDateStr='')
 
 Usage Examples:
     1. Organize audit files by database and load them into the destination directory:
@@ -72,33 +82,65 @@ Last update: 20240510
 import os
 import logging
 import traceback
-import glob
-import re
 import shutil
 import datetime
-from Util_files import read_config, deleteDirContent, writeScriptsChecksumInLog, getFilesQuantityInDir
+from Util_files import read_config, deleteDirContent, writeScriptsChecksumInLog, getFilesQuantityInDir, readChecksumManifest, updateChecksumManifest, getChecksumManifestPath, getChecksumManifestEntry, getTrustedChecksum, placeFile, getFileCatalog, invalidateFileCatalog
+from Util_matcher import getDateFileMatcher
+from Util_metrics import measuredStage, addStageCounters
 import sys
 
-def organizeAuditFilesbyDB(sourceDir, destinyDir, fileDateStr, subdirs):
+def organizeAuditFile(sourceDir, destinyDir, filename, placement_strategy='copy'):
+    # Places one AUD file of day directory (billdb-1-1-m-0/zengine_20240503.aud) in its database directory (billdb/zengine_20240503.aud)
+    # Returns (destFilename, destPath, usedStrategy)
+    sourcePath = os.path.join(sourceDir, filename)
+    simpleFilename = os.path.basename(filename)
+    subdir = os.path.dirname(filename)
+    dbName = subdir.split('-')[0]
+    destPath = f'{destinyDir}/{dbName}/{simpleFilename}'
+    destFilename = f'{dbName}/{simpleFilename}'
+    destDir = os.path.dirname(destPath)
+    if not os.path.exists(destDir):
+        os.makedirs(destDir, exist_ok=True)
+        logging.info(f'Directory {destDir} created')
+    usedStrategy = placeFile(sourcePath, destPath, placement_strategy)
+    # Catalogs built before placement do not have the new file (nor the moved one)
+    invalidateFileCatalog(destDir)
+    if usedStrategy == 'move':
+        invalidateFileCatalog(os.path.dirname(sourcePath))
+    return destFilename, destPath, usedStrategy
+
+@measuredStage('organizeAuditFilesbyDB')
+def organizeAuditFilesbyDB(sourceDir, destinyDir, fileDateStr, subdirs, placement_strategy='copy'):
     logging.info(f'Start organizing AUD files by Database')
+    logging.info(f'Placement strategy: {placement_strategy}')
     result = 'OK'    
     try:
         fileCounter = 0    
-        for filename in glob.glob('**', recursive=True, root_dir=sourceDir):
+        placementCounter = {}
+        # Checksums calculated during extraction are carried to organized by DB manifest without reading files again
+        sourceManifestEntries = readChecksumManifest(getChecksumManifestPath(sourceDir))
+        destinyManifestEntries = {}
+        isFileToOrganize = getDateFileMatcher(fileDateStr, 'aud')
+        for entry in getFileCatalog(sourceDir, fileDateStr):
+            filename = entry.path
             sourcePath = os.path.join(sourceDir, filename)
-            simpleFilename = os.path.basename(filename)
-            subdir = os.path.dirname(filename)
-            dbName = subdir.split('-')[0]
-            destPath = f'{destinyDir}/{dbName}/{simpleFilename}'
-            if os.path.isfile(sourcePath) and re.search(f'.*{fileDateStr}.*\\.aud', filename) :
+            if entry.isFile and isFileToOrganize(filename) :
                 fileCounter = fileCounter + 1
-                destFilename = f'{dbName}/{simpleFilename}'
-                destDir = os.path.dirname(destPath)
-                if not os.path.exists(destDir):
-                    os.makedirs(destDir, exist_ok=True)
-                    logging.info(f'Directory {destDir} created')
-                shutil.copy(sourcePath, destPath)
+                destFilename, destPath, usedStrategy = organizeAuditFile(sourceDir, destinyDir, filename, placement_strategy)
+                placementCounter[usedStrategy] = placementCounter.get(usedStrategy, 0) + 1
+                addStageCounters('organizeAuditFilesbyDB', files=1, bytes=os.path.getsize(destPath))
                 logging.info(f'{fileCounter}: {destFilename}')
+                sourceEntry = sourceManifestEntries.get(filename.replace('\\', '/'))
+                if sourceEntry is not None and getTrustedChecksum(sourceManifestEntries, filename.replace('\\', '/'), destPath if usedStrategy == 'move' else sourcePath, sourceEntry[2]) is not None:
+                    destinyManifestEntries[destFilename] = getChecksumManifestEntry(destPath, sourceEntry[3], sourceEntry[2])
+        if len(destinyManifestEntries) > 0:
+            updateChecksumManifest(getChecksumManifestPath(f'{destinyDir}/{fileDateStr}'), destinyManifestEntries)
+            logging.info(f'Checksums carried from extraction manifest: {len(destinyManifestEntries)}')
+        invalidateFileCatalog(destinyDir)
+        if placement_strategy == 'move':
+            invalidateFileCatalog(sourceDir)
+        for usedStrategy, counter in sorted(placementCounter.items()):
+            logging.info(f'Files placed using {usedStrategy}: {counter}')
         logging.info(f'Total files organized: {fileCounter}')
     except Exception as e:
         logging.error('Exception occurred:' )
@@ -124,6 +166,8 @@ def loader_by_db(force_fileDateStr=''):
     local_dir_logs = local_server['local_dir_logs']
     local_dir_scripts = local_server['local_dir_scripts']
     #
+    placement_strategy = config.get('LOAD', 'placement_strategy', fallback='copy')
+    #
     logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
     local_dir_logs = f'{local_dir_logs}/loader_by_db_{logFileDateStr}.log'
     logging_defined_before = logging.getLogger().hasHandlers() 
@@ -157,7 +201,7 @@ def loader_by_db(force_fileDateStr=''):
         result = deleteDirContent(localDirOrganizedByDB, fileDateStr, exceptfiles, justSubdirs=subdirs)    
 
     if result == 'OK':
-       result = organizeAuditFilesbyDB(f'{destinyDir}/{fileDateStr}', localDirOrganizedByDB, fileDateStr, subdirs)
+       result = organizeAuditFilesbyDB(f'{destinyDir}/{fileDateStr}', localDirOrganizedByDB, fileDateStr, subdirs, placement_strategy)
     #
     return result
 
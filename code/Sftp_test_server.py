@@ -0,0 +1,396 @@
+"""
+Module: Sftp_test_server
+
+A module with an SSH/SFTP server running inside the Python process, used as CBS server stand-in to test and benchmark remote extraction
+(copyAudFilesFromExternalServer with extraction_mode scp or sync, extraction_workers and resume of partial files) on one machine.
+
+Server serves a local directory as remote root, for example {rootDir}/auditlogs/billdb-1-1-m-0/zengine_20240503134936581.aud
+is the remote file /auditlogs/billdb-1-1-m-0/zengine_20240503134936581.aud. Files can be created with Aud_file_generator (by_day='0').
+
+Supported requests:
+    - Password authentication (username and password of server)
+    - SFTP subsystem, read only: listdir, listdir_attr, stat and open/read (prefetch included)
+    - scp -f command (SCPClient.get), wildcards in file names are expanded by server like a shell does
+
+Network emulation:
+    - latency_ms: each packet sent by server is delivered latency_ms later (one way delay), packets are pipelined like a real link
+    - bandwidth_kbps: all connections share a link of bandwidth_kbps KB/s. 0: No limit
+    - cutoff_bytes: all connections are dropped once cutoff_bytes bytes of file content were sent (one time), like a link lost
+      in the middle of a transfer, so resume of partial files can be checked (see Benchmark resume_check). 0: No cut
+
+Imports:
+    - os
+    - glob
+    - time
+    - queue
+    - socket
+    - logging
+    - threading
+    - traceback
+    - paramiko
+    - sys
+
+Functions:
+    1. BandwidthLimiter(bandwidth_kbps=0)
+    2. ThrottledSocket(sock, latency_ms=0, bandwidthLimiter=None)
+    3. AudServerInterface(testServer)
+    4. AudSftpHandle(flags=0)
+    5. AudSftpServerInterface(server, testServer)
+    6. SftpTestServer(rootDir, username='arcsight', password='arcsight', host='127.0.0.1', port=0, latency_ms=0, bandwidth_kbps=0, cutoff_bytes=0)
+    7. sendScpFiles(testServer, channel, command)
+    8. main()
+
+Usage Examples:
+    1. From Python:
+    >>> from Sftp_test_server import SftpTestServer
+    >>> with SftpTestServer('/tmp/cbs', latency_ms=20, bandwidth_kbps=10240) as server:
+    ...     copyAudFilesFromExternalServer('/auditlogs', '/tmp/auditCBS', '20240501', subdirs, '127.0.0.1', server.port, 'arcsight', 'arcsight', 4, 'sync')
+
+    2. From console, server runs until Ctrl+C (name=value parameters):
+    $ python.exe Sftp_test_server.py "dir=/tmp/cbs" "port=2222" "latency_ms=20" "bandwidth_kbps=10240"
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240513
+"""
+
+import os
+import glob
+import time
+import queue
+import socket
+import logging
+import threading
+import traceback
+import paramiko
+import sys
+
+# Bytes sent on each SCP data packet
+SCP_CHUNK_SIZE = 32768
+
+class BandwidthLimiter:
+    """
+    Link shared by all connections of a server: bytes are sent at bandwidth_kbps KB/s at most
+    """
+    def __init__(self, bandwidth_kbps=0):
+        self.bytesPerSecond = float(bandwidth_kbps) * 1024
+        self.nextSendTime = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self, nbytes):
+        if self.bytesPerSecond <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            sendTime = max(now, self.nextSendTime)
+            self.nextSendTime = sendTime + nbytes / self.bytesPerSecond
+        if sendTime > now:
+            time.sleep(sendTime - now)
+
+class ThrottledSocket:
+    """
+    Socket given to paramiko Transport: packets sent by server are delayed latency_ms and limited by bandwidthLimiter.
+    Packets are queued and sent by another thread, so server keeps sending while earlier packets are on the link.
+    """
+    def __init__(self, sock, latency_ms=0, bandwidthLimiter=None):
+        self.sock = sock
+        self.latency = float(latency_ms) / 1000
+        self.bandwidthLimiter = bandwidthLimiter
+        self.pending = queue.Queue()
+        self.broken = False
+        self.thread = threading.Thread(target=self._sendPending, daemon=True)
+        self.thread.start()
+
+    def _sendPending(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            if item == 'drop':
+                # Packets queued before are delivered, then link is lost without SSH disconnect.
+                # Only sending side is shut down: a reset would make client discard bytes already received
+                self.broken = True
+                try:
+                    self.sock.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                break
+            dueTime, data = item
+            delay = dueTime - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.bandwidthLimiter is not None:
+                self.bandwidthLimiter.wait(len(data))
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.broken = True
+                break
+
+    def send(self, data):
+        if self.broken:
+            raise socket.error('Connection closed by client')
+        self.pending.put((time.monotonic() + self.latency, bytes(data)))
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def drop(self):
+        self.pending.put('drop')
+
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join(timeout=10)
+        self.sock.close()
+
+    def __getattr__(self, name):
+        # settimeout, gettimeout, fileno, getpeername.. are used from real socket
+        return getattr(self.sock, name)
+
+class AudServerInterface(paramiko.ServerInterface):
+    def __init__(self, testServer):
+        self.testServer = testServer
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if username == self.testServer.username and password == self.testServer.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        # Only scp -f (download) is supported, it runs in its own thread like a remote process
+        command = command.decode() if isinstance(command, bytes) else command
+        if not command.startswith('scp ') or ' -f ' not in f'{command} ':
+            return False
+        threading.Thread(target=sendScpFiles, args=(self.testServer, channel, command), daemon=True).start()
+        return True
+
+class AudSftpHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def read(self, offset, length):
+        data = super().read(offset, length)
+        if isinstance(data, bytes):
+            self.testServer.addSentBytes(len(data))
+        return data
+
+class AudSftpServerInterface(paramiko.SFTPServerInterface):
+    """
+    Read only SFTP server over rootDir of test server
+    """
+    def __init__(self, server, testServer, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.testServer = testServer
+
+    def _getLocalPath(self, path):
+        return self.testServer.getLocalPath(path)
+
+    def list_folder(self, path):
+        try:
+            localPath = self._getLocalPath(path)
+            attrs = []
+            for filename in sorted(os.listdir(localPath)):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(localPath, filename)))
+                attr.filename = filename
+                attrs.append(attr)
+            return attrs
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._getLocalPath(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self._getLocalPath(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC):
+            return paramiko.SFTP_PERMISSION_DENIED
+        try:
+            handle = AudSftpHandle(flags)
+            handle.readfile = open(self._getLocalPath(path), 'rb')
+            handle.filename = self._getLocalPath(path)
+            handle.testServer = self.testServer
+            return handle
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def canonicalize(self, path):
+        return '/' + os.path.normpath('/' + path).lstrip('/').replace(os.sep, '/')
+
+def sendScpFiles(testServer, channel, command):
+    # Source side of scp protocol: client sends \0 when it is ready, server sends "C0644 size name" and waits \0,
+    # then file bytes and \0, and waits \0 again
+    exitStatus = 0
+    try:
+        arguments = command.split()
+        patterns = arguments[arguments.index('-f') + 1:]
+        filenames = []
+        for pattern in patterns:
+            matches = sorted(path for path in glob.glob(testServer.getLocalPath(pattern.strip("\'\""))) if os.path.isfile(path))
+            if len(matches) == 0:
+                raise FileNotFoundError(f'{pattern}: No such file or directory')
+            filenames.extend(matches)
+        if channel.recv(1) != b'\x00':
+            raise IOError('scp client is not ready')
+        for filename in filenames:
+            fileStats = os.stat(filename)
+            if '-p' in arguments:
+                channel.sendall(f'T{int(fileStats.st_mtime)} 0 {int(fileStats.st_atime)} 0\n'.encode())
+                channel.recv(1)
+            channel.sendall(f'C0644 {fileStats.st_size} {os.path.basename(filename)}\n'.encode())
+            if channel.recv(1) != b'\x00':
+                raise IOError(f'scp client refused {filename}')
+            with open(filename, 'rb') as localFile:
+                while True:
+                    data = localFile.read(SCP_CHUNK_SIZE)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                    testServer.addSentBytes(len(data))
+            channel.sendall(b'\x00')
+            channel.recv(1)
+    except Exception as e:
+        logging.error(f'scp error in test server: {e}')
+        exitStatus = 1
+        try:
+            channel.sendall(f'\x01scp: {e}\n'.encode())
+        except Exception:
+            pass
+    finally:
+        channel.send_exit_status(exitStatus)
+        channel.close()
+
+class SftpTestServer:
+    """
+    SSH server with SFTP and scp over rootDir, listening in host:port (port=0: a free port is used, see port attribute after start)
+    """
+    def __init__(self, rootDir, username='arcsight', password='arcsight', host='127.0.0.1', port=0, latency_ms=0, bandwidth_kbps=0, cutoff_bytes=0):
+        self.rootDir = os.path.abspath(rootDir)
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = int(port)
+        self.latency_ms = float(latency_ms)
+        self.bandwidthLimiter = BandwidthLimiter(bandwidth_kbps)
+        # Bytes of file content left to send before connections are dropped, it can be set again between transfers
+        self.cutoff_bytes = int(cutoff_bytes)
+        self.cutoffLock = threading.Lock()
+        self.hostKey = None
+        self.listenSocket = None
+        self.transports = []
+        self.thread = None
+        self.stopping = False
+
+    def getLocalPath(self, path):
+        # Remote paths can not go out of rootDir
+        localPath = os.path.normpath(os.path.join(self.rootDir, os.path.normpath('/' + path).lstrip('/\\')))
+        if localPath != self.rootDir and not localPath.startswith(self.rootDir + os.sep):
+            raise PermissionError(f'Path out of server root: {path}')
+        return localPath
+
+    def addSentBytes(self, nbytes):
+        with self.cutoffLock:
+            if self.cutoff_bytes <= 0:
+                return
+            self.cutoff_bytes = self.cutoff_bytes - nbytes
+            if self.cutoff_bytes > 0:
+                return
+            self.cutoff_bytes = 0
+        logging.info('SFTP test server: connections dropped (cutoff_bytes)')
+        self.dropConnections()
+
+    def dropConnections(self):
+        # Client sees a lost connection in the middle of its transfer
+        for transport in self.transports:
+            transport.sock.drop()
+
+    def start(self):
+        self.hostKey = paramiko.RSAKey.generate(2048)
+        self.listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listenSocket.bind((self.host, self.port))
+        self.listenSocket.listen(100)
+        self.port = self.listenSocket.getsockname()[1]
+        self.stopping = False
+        self.thread = threading.Thread(target=self._acceptConnections, daemon=True)
+        self.thread.start()
+        logging.info(f'SFTP test server listening in {self.host}:{self.port}, root directory {self.rootDir}')
+        return self.port
+
+    def _acceptConnections(self):
+        while not self.stopping:
+            try:
+                clientSocket, address = self.listenSocket.accept()
+            except OSError:
+                break
+            try:
+                clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                transport = paramiko.Transport(ThrottledSocket(clientSocket, self.latency_ms, self.bandwidthLimiter))
+                transport.add_server_key(self.hostKey)
+                transport.set_subsystem_handler('sftp', paramiko.SFTPServer, AudSftpServerInterface, self)
+                transport.start_server(server=AudServerInterface(self))
+                self.transports.append(transport)
+            except Exception as e:
+                logging.error('Exception occurred:' )
+                logging.error(f'{e}')
+                logging.error(f'Traceback: {traceback.format_exc()}')
+                clientSocket.close()
+
+    def stop(self):
+        self.stopping = True
+        if self.listenSocket is not None:
+            self.listenSocket.close()
+            self.listenSocket = None
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.stop()
+
+def main():
+    #Call example: python.exe Sftp_test_server.py "dir=/tmp/cbs" "port=2222" "latency_ms=20" "bandwidth_kbps=10240"
+    parameters = {}
+    for arg in sys.argv[1:]:
+        name, separator, value = arg.partition('=')
+        if separator == '':
+            raise ValueError(f'Parameter must be sent as name=value: {arg}')
+        parameters[name.strip().lower()] = value.strip()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s\t%(message)s', datefmt='%Y-%m-%d %I:%M:%S %p')
+    testServer = SftpTestServer(parameters.pop('dir'), **parameters)
+    testServer.start()
+    print (f'SFTP test server listening in {testServer.host}:{testServer.port}, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        testServer.stop()
+
+if __name__ == '__main__':
+    main()
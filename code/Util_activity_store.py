@@ -0,0 +1,244 @@
+"""
+Util module contains the activity store of the activity report.
+
+Audited activities found in AUD files are saved in an append-only SQLite store partitioned by month and database:
+    {local_dir_reports}/activity_store/{YYYYMM}/{db}.sqlite
+Each activity is saved once (file and line are unique), so processing the same AUD file again does not duplicate rows.
+When the whole file is parsed again (activity report), its saved rows are replaced, so the store has the rows of the current parse.
+Text report is written from rows read back from the store, and Activity_query.py answers ad-hoc questions using its indexes.
+
+Imports:
+    - os
+    - glob
+    - hashlib
+    - sqlite3
+
+Functions:
+    1. getActivityStorePath(storeDir, month, dbName)
+    2. getActivityStorePaths(storeDir, month_str='', dbName='')
+    3. openActivityStore(storePath)
+    4. splitActivityRow(row)
+    5. joinActivityRow(activity)
+    6. storeActivityRows(connections, storeDir, dbName, rows, replacedFiles=None)
+    7. readActivityRows(connections, storePaths, file)
+    8. closeActivityStores(connections)
+    9. getPartitionsInTimeRange(storePaths, time_from='', time_to='')
+    10. queryActivityStore(storeDir, filters, month_str='', dbName='', group_by='', limit=0)
+
+Usage Examples:
+    >>> connections = {}
+    >>> storePaths = storeActivityRows(connections, '/root/Scripts/reports/activity_store', 'billdb', rows)
+    >>> readActivityRows(connections, storePaths, '/data/billdb/zengine_20240503.aud')
+    ['2024-05-03 03:00:02.926\tUSR1\t11.12.1.123\t11\tTruncate\tUSR1\tSOME_TABLE\ttruncate table SOME_TABLE\t/data/billdb/zengine_20240503.aud']
+    >>> closeActivityStores(connections)
+    >>> queryActivityStore('/root/Scripts/reports/activity_store', {'schema': 'BILLDB', 'tablename': 'BB_LOG_MERGE', 'activity': 'Truncate'}, '202404')
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240512
+"""
+
+import os
+import glob
+import hashlib
+import sqlite3
+
+# Columns of activity report, in report order (query_hash is not written in text report)
+ACTIVITY_COLUMNS = ['time', 'user', 'host', 'line', 'activity', 'schema', 'tablename', 'query', 'file']
+# Columns that can be used as equality filters or to group activities
+FILTER_COLUMNS = ['user', 'host', 'activity', 'schema', 'tablename', 'query_hash', 'file']
+# Expressions used to count activities by group (db is the database partition)
+GROUP_EXPRESSIONS = dict({column: column for column in FILTER_COLUMNS}, day='substr(time, 1, 10)', month='substr(time, 1, 7)', hour='substr(time, 1, 13)')
+
+def getActivityStorePath(storeDir, month, dbName):
+    return f'{storeDir}/{month}/{dbName}.sqlite'
+
+def getActivityStorePaths(storeDir, month_str='', dbName=''):
+    # Partitions of a month (YYYYMM) and/or database, all partitions when both are ''
+    monthPattern = month_str if month_str != '' else '[0-9]' * 6
+    dbPattern = glob.escape(dbName) if dbName != '' else '*'
+    return sorted(glob.glob(f'{glob.escape(storeDir)}/{monthPattern}/{dbPattern}.sqlite'))
+
+def openActivityStore(storePath):
+    os.makedirs(os.path.dirname(storePath), exist_ok=True)
+    connection = sqlite3.connect(storePath)
+    connection.execute('''CREATE TABLE IF NOT EXISTS activities (
+                            time TEXT,
+                            user TEXT,
+                            host TEXT,
+                            line INTEGER,
+                            activity TEXT,
+                            schema TEXT,
+                            tablename TEXT,
+                            query TEXT,
+                            query_hash TEXT,
+                            file TEXT,
+                            UNIQUE (file, line))''')
+    connection.execute('CREATE INDEX IF NOT EXISTS activities_user ON activities (user, time)')
+    connection.execute('CREATE INDEX IF NOT EXISTS activities_host ON activities (host, time)')
+    connection.execute('CREATE INDEX IF NOT EXISTS activities_object ON activities (schema, tablename, time)')
+    connection.execute('CREATE INDEX IF NOT EXISTS activities_activity ON activities (activity, time)')
+    connection.execute('CREATE INDEX IF NOT EXISTS activities_time ON activities (time)')
+    connection.commit()
+    return connection
+
+def splitActivityRow(row):
+    """
+    Splits a report line in its fields, query may contain tabs so it is taken between the first 7 fields and the file
+
+    Examples:
+        >>> splitActivityRow('2024-04-17 03:00:02.926\\tUSR1\\t11.12.1.123\\t11\\tTruncate\\tUSR1\\tSOME_TABLE\\ttruncate table SOME_TABLE\\t/data/file.aud')
+        ('2024-04-17 03:00:02.926', 'USR1', '11.12.1.123', 11, 'Truncate', 'USR1', 'SOME_TABLE', 'truncate table SOME_TABLE', '/data/file.aud')
+    """
+    fields = row.split('\t', 7)
+    query, file = fields[7].rsplit('\t', 1)
+    return (fields[0], fields[1], fields[2], int(fields[3]), fields[4], fields[5], fields[6], query, file)
+
+def joinActivityRow(activity):
+    return '\t'.join(str(field) for field in activity)
+
+def storeActivityRows(connections, storeDir, dbName, rows, replacedFiles=None):
+    """
+    Appends report lines to the partitions of their month. Rows already saved are ignored.
+    With replacedFiles, rows are all the rows of those files: rows saved before for them are deleted first, in every month partition of the database,
+    so a file parsed again without activities or with activities of other month does not keep its old rows.
+
+    Args:
+        connections (dict): Open stores by path, it is filled by this function and closed with closeActivityStores.
+        storeDir (str): Root directory of activity store.
+        dbName (str): Database of AUD file.
+        rows (list): Report lines built by getActivityRow.
+        replacedFiles (list): AUD files whose whole content was parsed, their rows saved before are replaced by rows. None: only new rows are added.
+
+    Returns:
+        list: Store paths where rows were saved.
+
+    Examples:
+        >>> import tempfile, shutil
+        >>> storeDir, connections = tempfile.mkdtemp(), {}
+        >>> april = '2024-04-30 23:59:00.001\\tUSR1\\t127.0.0.1\\t3\\tTruncate\\tUSR1\\tT1\\ttruncate table T1\\t/data/billdb/zengine_20240430.aud'
+        >>> may = '2024-05-01 00:00:01.002\\tUSR1\\t127.0.0.1\\t7\\tDelete\\tUSR1\\tT2\\tDELETE FROM T2\\t/data/billdb/zengine_20240430.aud'
+        >>> [os.path.basename(os.path.dirname(path)) for path in storeActivityRows(connections, storeDir, 'billdb', [april, may], ['/data/billdb/zengine_20240430.aud'])]
+        ['202404', '202405']
+
+        Rows added again without replacedFiles are not duplicated:
+        >>> _ = storeActivityRows(connections, storeDir, 'billdb', [may])
+        >>> len(readActivityRows(connections, getActivityStorePaths(storeDir, '', 'billdb'), '/data/billdb/zengine_20240430.aud'))
+        2
+
+        A new parse of the file replaces its rows in every month partition:
+        >>> fixedMay = may.replace('\\t7\\t', '\\t8\\t')
+        >>> _ = storeActivityRows(connections, storeDir, 'billdb', [fixedMay], ['/data/billdb/zengine_20240430.aud'])
+        >>> readActivityRows(connections, getActivityStorePaths(storeDir, '', 'billdb'), '/data/billdb/zengine_20240430.aud') == [fixedMay]
+        True
+        >>> _ = storeActivityRows(connections, storeDir, 'billdb', [], ['/data/billdb/zengine_20240430.aud'])
+        >>> readActivityRows(connections, getActivityStorePaths(storeDir, '', 'billdb'), '/data/billdb/zengine_20240430.aud')
+        []
+        >>> closeActivityStores(connections)
+        >>> shutil.rmtree(storeDir)
+    """
+    activitiesByPath = {}
+    for row in rows:
+        activity = splitActivityRow(row)
+        month = activity[0][:7].replace('-', '')
+        storePath = getActivityStorePath(storeDir, month, dbName)
+        activitiesByPath.setdefault(storePath, []).append(activity + (hashlib.md5(activity[7].encode()).hexdigest(),))
+    if replacedFiles:
+        # A new parse could give different rows (parser or SQLTEXT limits changed): rows of previous parse are not kept
+        for storePath in getActivityStorePaths(storeDir, '', dbName):
+            if storePath not in connections:
+                connections[storePath] = openActivityStore(storePath)
+            connections[storePath].executemany('DELETE FROM activities WHERE file = ?', [(file,) for file in sorted(set(replacedFiles))])
+    for storePath, activities in activitiesByPath.items():
+        if storePath not in connections:
+            connections[storePath] = openActivityStore(storePath)
+        connections[storePath].executemany('INSERT OR IGNORE INTO activities (time, user, host, line, activity, schema, tablename, query, file, query_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', activities)
+    return sorted(activitiesByPath)
+
+def readActivityRows(connections, storePaths, file):
+    # Report lines of a file, in line order
+    activities = []
+    for storePath in storePaths:
+        if storePath not in connections:
+            connections[storePath] = openActivityStore(storePath)
+        activities.extend(connections[storePath].execute('SELECT time, user, host, line, activity, schema, tablename, query, file FROM activities WHERE file = ? ORDER BY line', (file,)).fetchall())
+    activities.sort(key=lambda activity: activity[3])
+    return [joinActivityRow(activity) for activity in activities]
+
+def closeActivityStores(connections):
+    for connection in connections.values():
+        connection.commit()
+        connection.close()
+    connections.clear()
+
+def getPartitionsInTimeRange(storePaths, time_from='', time_to=''):
+    # Month partitions out of [time_from, time_to) are not opened
+    partitions = []
+    for storePath in storePaths:
+        month = os.path.basename(os.path.dirname(storePath))
+        monthStart = f'{month[:4]}-{month[4:6]}'
+        if time_from != '' and monthStart < time_from[:7]:
+            continue
+        if time_to != '' and monthStart > time_to[:7]:
+            continue
+        partitions.append(storePath)
+    return partitions
+
+def queryActivityStore(storeDir, filters, month_str='', dbName='', group_by='', limit=0):
+    """
+    Searches activities in store partitions using their indexes.
+
+    Args:
+        storeDir (str): Root directory of activity store.
+        filters (dict): Equality filters by column (see FILTER_COLUMNS), plus time_from (included) and time_to (excluded) like '2024-04-01' or '2024-04-17 03:00'.
+        month_str (str): Month partition (YYYYMM). '': All months in time range.
+        dbName (str): Database partition. '': All databases.
+        group_by (str): Column (see GROUP_EXPRESSIONS), day, month, hour or db used to count activities. '': Activities are returned.
+        limit (int): Maximum number of activities returned. 0: No limit.
+
+    Returns:
+        list: Activities (time, user, host, line, activity, schema, tablename, query, file, db) ordered by time,
+            or (value, count) ordered by count when group_by is used.
+    """
+    if group_by != '' and group_by != 'db' and group_by not in GROUP_EXPRESSIONS:
+        raise ValueError(f'Activities can not be grouped by {group_by}')
+    conditions = []
+    params = []
+    for column, value in filters.items():
+        if column in FILTER_COLUMNS:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    time_from = filters.get('time_from', '')
+    time_to = filters.get('time_to', '')
+    if time_from != '':
+        conditions.append('time >= ?')
+        params.append(time_from)
+    if time_to != '':
+        conditions.append('time < ?')
+        params.append(time_to)
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+    results = []
+    counters = {}
+    for storePath in getPartitionsInTimeRange(getActivityStorePaths(storeDir, month_str, dbName), time_from, time_to):
+        partitionDbName = os.path.splitext(os.path.basename(storePath))[0]
+        connection = sqlite3.connect(f'file:{storePath}?mode=ro', uri=True)
+        try:
+            if group_by == 'db':
+                counter = connection.execute(f'SELECT COUNT(*) FROM activities{where}', params).fetchone()[0]
+                if counter > 0:
+                    counters[partitionDbName] = counters.get(partitionDbName, 0) + counter
+            elif group_by != '':
+                expression = GROUP_EXPRESSIONS[group_by]
+                for value, counter in connection.execute(f'SELECT {expression}, COUNT(*) FROM activities{where} GROUP BY {expression}', params):
+                    counters[value] = counters.get(value, 0) + counter
+            else:
+                sql = f'SELECT time, user, host, line, activity, schema, tablename, query, file FROM activities{where} ORDER BY time'
+                if limit > 0:
+                    sql = f'{sql} LIMIT {int(limit)}'
+                results.extend(activity + (partitionDbName,) for activity in connection.execute(sql, params))
+        finally:
+            connection.close()
+    if group_by != '':
+        return sorted(counters.items(), key=lambda item: (-item[1], str(item[0])))
+    results.sort(key=lambda activity: activity[0])
+    return results[:limit] if limit > 0 else results
@@ -0,0 +1,178 @@
+"""
+Util module contains the compression backends used to create and read archives.
+
+Codecs (compression_codec parameter in [COMPRESS] section of config.properties):
+    gzip    Single thread gzip (zlib), same as tarfile "w:gz"
+    pgzip   Block-parallel gzip writer (pigz style): data is split in blocks compressed by a thread pool (zlib releases the GIL),
+            each block uses the last 32 KB of the previous block as dictionary and blocks are written in order, so output is a standard gzip file
+    xz      lzma module, single thread
+    zstd    zstandard module (optional dependency), multi-thread
+Archives created with every codec are read in streaming mode with openCompressedReader.
+
+Imports:
+    - gzip
+    - lzma
+    - zlib
+    - struct
+    - time
+    - collections.deque
+    - concurrent.futures.ThreadPoolExecutor
+    - zstandard (optional)
+
+Functions:
+    1. ParallelGzipWriter(fileobj, level=6, workers=4, block_size=PGZIP_BLOCK_SIZE)
+    2. getCompressionCodec(compression_codec)
+    3. getTarExtension(compression_codec)
+    4. openCompressedWriter(fileobj, compression_codec='gzip', compression_level=9, compression_workers=1)
+    5. openCompressedReader(fileobj, filename)
+
+Usage Examples:
+    >>> with open('/root/auditCBS_Processed/202405_db_aud_files.tar.gz', 'wb') as archiveFile:
+    ...     with openCompressedWriter(archiveFile, 'pgzip', 6, 4) as writer:
+    ...         writer.write(data)
+    >>> with open('/root/auditCBS_Processed/202405_db_aud_files.tar.gz', 'rb') as archiveFile:
+    ...     data = openCompressedReader(archiveFile, archiveFile.name).read()
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240512
+"""
+
+import gzip
+import lzma
+import zlib
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import zstandard
+except ImportError:
+    # zstd codec is not available, gzip, pgzip and xz are
+    zstandard = None
+
+COMPRESSION_CODECS = ['gzip', 'pgzip', 'xz', 'zstd']
+# Extension of files and tar archives created by each codec
+COMPRESSED_EXTENSIONS = {'gzip': '.gz', 'pgzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+TAR_EXTENSIONS = {codec: f'.tar{extension}' for codec, extension in COMPRESSED_EXTENSIONS.items()}
+# Uncompressed bytes compressed by each pgzip task
+PGZIP_BLOCK_SIZE = 1024 * 1024
+# Deflate window: each pgzip block is compressed with the previous 32 KB as dictionary
+DEFLATE_DICT_SIZE = 32 * 1024
+
+def compressBlock(block, dictionary, level, last):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary) if dictionary else zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # Not final blocks end in a byte boundary (sync flush), so all blocks are concatenated as one deflate stream
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class ParallelGzipWriter:
+    """
+    Writable file object that produces a standard gzip stream compressing blocks in parallel.
+
+    Args:
+        fileobj: Binary file where gzip stream is written, it is not closed.
+        level (int): zlib compression level (1-9).
+        workers (int): Threads compressing blocks at the same time.
+        block_size (int): Uncompressed bytes of each block.
+
+    Examples:
+        Output is one standard gzip stream, blocks are decompressed as a whole:
+        >>> import io
+        >>> data = b''.join(b'UTC-4:00 2024-05-03 00:00:%02d.001\\n' % (second % 60) for second in range(20000))
+        >>> output = io.BytesIO()
+        >>> with ParallelGzipWriter(output, level=6, workers=4, block_size=64 * 1024) as writer:
+        ...     _ = writer.write(data[:100000])
+        ...     _ = writer.write(data[100000:])
+        >>> gzip.decompress(output.getvalue()) == data
+        True
+        >>> openCompressedReader(io.BytesIO(output.getvalue()), '202405_db_aud_files.tar.gz').read() == data
+        True
+    """
+    def __init__(self, fileobj, level=6, workers=4, block_size=PGZIP_BLOCK_SIZE, mtime=None):
+        self.fileobj = fileobj
+        self.level = int(level)
+        self.workers = max(1, int(workers))
+        self.block_size = int(block_size)
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.closed = False
+        # gzip header: magic, deflate, no flags, mtime, extra flags, unknown OS
+        self.fileobj.write(struct.pack('<BBBBLBB', 0x1f, 0x8b, 8, 0, int(time.time() if mtime is None else mtime) & 0xffffffff, 0, 255))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size = self.size + len(data)
+        while len(self.buffer) > self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self.submitBlock(block, False)
+        return len(data)
+
+    def submitBlock(self, block, last):
+        self.pending.append(self.executor.submit(compressBlock, block, self.dictionary, self.level, last))
+        self.dictionary = block[-DEFLATE_DICT_SIZE:]
+        # Compressed blocks are written in order, memory is bounded to a few blocks for each worker
+        while len(self.pending) > self.workers * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.submitBlock(bytes(self.buffer), True)
+            self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.write(struct.pack('<LL', self.crc & 0xffffffff, self.size & 0xffffffff))
+        finally:
+            self.executor.shutdown()
+
+def getCompressionCodec(compression_codec):
+    compression_codec = compression_codec.strip().lower()
+    if compression_codec not in COMPRESSION_CODECS:
+        raise ValueError(f'Compression codec not supported: {compression_codec}')
+    if compression_codec == 'zstd' and zstandard is None:
+        raise ValueError('Compression codec zstd needs zstandard module (pip install zstandard)')
+    return compression_codec
+
+def getTarExtension(compression_codec):
+    return TAR_EXTENSIONS[getCompressionCodec(compression_codec)]
+
+def openCompressedWriter(fileobj, compression_codec='gzip', compression_level=9, compression_workers=1):
+    # Returns a writable file object that compresses data into fileobj, it must be closed before fileobj
+    compression_codec = getCompressionCodec(compression_codec)
+    if compression_codec == 'pgzip':
+        return ParallelGzipWriter(fileobj, compression_level, compression_workers)
+    if compression_codec == 'xz':
+        return lzma.open(fileobj, 'wb', preset=int(compression_level))
+    if compression_codec == 'zstd':
+        return zstandard.ZstdCompressor(level=int(compression_level), threads=int(compression_workers)).stream_writer(fileobj, closefd=False)
+    return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=int(compression_level))
+
+def openCompressedReader(fileobj, filename):
+    # Codec is selected by file extension, data is decompressed while it is read
+    if filename.endswith(COMPRESSED_EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise ValueError('Reading zstd archives needs zstandard module (pip install zstandard)')
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    if filename.endswith(COMPRESSED_EXTENSIONS['xz']):
+        return lzma.open(fileobj, 'rb')
+    return gzip.GzipFile(fileobj=fileobj, mode='rb')
@@ -4,20 +4,57 @@ Util module contains utilities functions that helps to manage files and director
 
 Author: Victor Hugo Gonzales Alvarez
 email: gonzalesv@tigo.net.bo, vicogo@gmail.com
-Last update: 20240511
+Last update: 20240512
 """
 
 import os
+import re
 import logging
 import shutil
 import paramiko
-import glob
 import configparser
 import traceback
 import hashlib
-import re
 import tarfile
 import datetime
+import socket
+import threading
+import queue
+import time
+import errno
+import gzip
+import io
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from Util_matcher import getDateFileMatcher, getContainsMatcher
+from Util_metrics import measuredStage, addStageCounters
+from Util_compression import openCompressedWriter, openCompressedReader, getCompressionCodec, getTarExtension, TAR_EXTENSIONS, COMPRESSED_EXTENSIONS
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: reflink placement falls back to copy
+    fcntl = None
+
+# Linux ioctl request to clone a file sharing its data blocks (btrfs, xfs, ...)
+FICLONE = 0x40049409
+PLACEMENT_STRATEGIES = ['copy', 'hardlink', 'reflink', 'move']
+
+# Bytes read from disk on each step of streaming checksum calculation
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+CHECKSUM_ALGORITHMS = {'md5': hashlib.md5, 'sha256': hashlib.sha256, 'blake2b': hashlib.blake2b, 'blake2s': hashlib.blake2s}
+
+# Archive formats: tar.gz is one gzip stream for the whole month.
+# indexed: each file is an independent gzip member appended to a .gzm file (still a valid gzip file),
+# and a sidecar .gzm.idx file saves name, offset, compressed size, size, mtime and checksum of each member, so one file is read without decompressing the others
+# cas: each unique file content is compressed once in a content store ({content_store_dir}/{algorithm}/{checksum[:2]}/{checksum}.gz),
+# and a .cas manifest saves name, size, mtime, algorithm, checksum and content path of each file. Per node and per db copies share the same content
+# Extension of tar archives depends on compression codec (see Util_compression)
+ARCHIVE_FORMATS = {'tar.gz': '.tar.gz', 'indexed': '.gzm', 'cas': '.cas'}
+ARCHIVE_EXTENSIONS = tuple(sorted(set(TAR_EXTENSIONS.values()))) + (ARCHIVE_FORMATS['indexed'], ARCHIVE_FORMATS['cas'])
+ArchiveIndexEntry = namedtuple('ArchiveIndexEntry', ['name', 'offset', 'csize', 'size', 'mtime', 'algorithm', 'checksum'])
+ContentArchiveEntry = namedtuple('ContentArchiveEntry', ['name', 'size', 'mtime', 'algorithm', 'checksum', 'content'])
 
 def deleteAudFilesInLocalDir(destinyDir, fileDate):
     result = 'OK'
@@ -47,15 +84,119 @@ def createAudFilesInLocalDir (destinyDir):
         result = 'ERROR'
     return result
 
+# File catalog: directory trees are enumerated once per run with os.scandir and shared by all stages.
+# Day directories (named YYYYMMDD) that do not belong to requested date or month are not entered.
+# Out of a day directory (organized by DB layout {db}/zengine_YYYYMMDD*.aud, day manifests and month archives in root directory)
+# files are skipped using the date of their name.
+# Catalogs live during one run (clearFileCatalog at start of each run or daemon poll), least recently used catalogs are dropped
+# when all of them have more than FILE_CATALOG_MAX_ENTRIES entries
+CatalogEntry = namedtuple('CatalogEntry', ['path', 'isFile', 'isDir', 'isLink'])
+FILE_CATALOG_MAX_ENTRIES = 1000000
+_fileCatalog = OrderedDict()
+_fileCatalogLock = threading.RLock()
+# zengine_20240503134936581.aud, 20240503.manifest, 202404_db_aud_files.tar.gz -> 20240503, 20240503, 202404
+FILE_NAME_DATE = re.compile(r'^(\d{6,8})[._]|_(\d{8})\d*\.aud$')
+
+def isDateDirOutOfScope(dirName, fileDateStr):
+    fileDateStr = str(fileDateStr)
+    if fileDateStr == '' or not dirName.isdigit() or len(dirName) < 6:
+        return False
+    return not (dirName.startswith(fileDateStr) or fileDateStr.startswith(dirName))
+
+def isDateFileOutOfScope(filename, fileDateStr):
+    """
+    Examples:
+        >>> isDateFileOutOfScope('zengine_20240503134936581.aud', '202404')
+        True
+        >>> isDateFileOutOfScope('202405_db_aud_files.tar.gz', '20240503')
+        False
+    """
+    match = FILE_NAME_DATE.search(filename) if str(fileDateStr) != '' else None
+    return match is not None and isDateDirOutOfScope(match.group(1) or match.group(2), fileDateStr)
+
+def isCatalogEntryOutOfScope(entry, fileDateStr):
+    # Same entries that scanDirTree skips
+    dirNames = entry.path.split(os.sep)[:-1 if entry.isFile else None]
+    if any(isDateDirOutOfScope(part, fileDateStr) for part in dirNames):
+        return True
+    inDateDir = any(part.isdigit() and len(part) >= 6 for part in dirNames)
+    return entry.isFile and not inDateDir and isDateFileOutOfScope(os.path.basename(entry.path), fileDateStr)
+
+def scanDirTree(rootDir, fileDateStr='', relDir='', inDateDir=False):
+    entries = []
+    try:
+        with os.scandir(os.path.join(rootDir, relDir) if relDir else rootDir) as iterator:
+            dirEntries = sorted(iterator, key=lambda dirEntry: dirEntry.name)
+    except FileNotFoundError:
+        return entries
+    for dirEntry in dirEntries:
+        if dirEntry.name.startswith('.'):
+            # Hidden files are ignored, as glob does
+            continue
+        relPath = os.path.join(relDir, dirEntry.name) if relDir else dirEntry.name
+        isLink = dirEntry.is_symlink()
+        isDir = dirEntry.is_dir()
+        if isDir and isDateDirOutOfScope(dirEntry.name, fileDateStr):
+            continue
+        isFile = dirEntry.is_file()
+        if isFile and not inDateDir and isDateFileOutOfScope(dirEntry.name, fileDateStr):
+            continue
+        entries.append(CatalogEntry(relPath, isFile, isDir, isLink))
+        if isDir and not isLink:
+            entries.extend(scanDirTree(rootDir, fileDateStr, relPath, inDateDir or (dirEntry.name.isdigit() and len(dirEntry.name) >= 6)))
+    return entries
+
+def getFileCatalog(rootDir, fileDateStr=''):
+    # Catalog of a directory is reused while nobody changes it (see invalidateFileCatalog)
+    # A sub-directory catalog is taken from an already built catalog of a parent directory
+    rootDir = os.path.normpath(rootDir)
+    key = (rootDir, str(fileDateStr))
+    with _fileCatalogLock:
+        entries = _fileCatalog.get(key)
+        if entries is None:
+            for (catalogRoot, catalogDateStr), catalogEntries in list(_fileCatalog.items()):
+                prefix = os.path.relpath(rootDir, catalogRoot)
+                if catalogDateStr in ('', str(fileDateStr)) and not prefix.startswith('..') and prefix != '.':
+                    prefix = prefix + os.sep
+                    entries = [CatalogEntry(entry.path[len(prefix):], entry.isFile, entry.isDir, entry.isLink) for entry in catalogEntries if entry.path.startswith(prefix)]
+                    entries = [entry for entry in entries if not isCatalogEntryOutOfScope(entry, fileDateStr)]
+                    break
+            if entries is None:
+                entries = scanDirTree(rootDir, fileDateStr)
+            _fileCatalog[key] = entries
+            catalogEntries = sum(len(catalog) for catalog in _fileCatalog.values())
+            while catalogEntries > FILE_CATALOG_MAX_ENTRIES and len(_fileCatalog) > 1:
+                catalogEntries = catalogEntries - len(_fileCatalog.popitem(last=False)[1])
+        else:
+            _fileCatalog.move_to_end(key)
+    return entries
+
+def clearFileCatalog():
+    # Start of a run: directories may have been changed by other processes since last run
+    with _fileCatalogLock:
+        _fileCatalog.clear()
+
+def invalidateFileCatalog(changedDir):
+    # Must be called after files are created or deleted in changedDir
+    changedDir = os.path.normpath(changedDir)
+    with _fileCatalogLock:
+        for key in list(_fileCatalog):
+            catalogRoot = key[0]
+            if catalogRoot == changedDir or catalogRoot.startswith(changedDir + os.sep) or changedDir.startswith(catalogRoot + os.sep):
+                del _fileCatalog[key]
+
 def deleteDirContent(destinyDir, fileDateStr, exceptfiles='', justSubdirs=''):
     result = 'OK'
     logging.info(f'Start deleting files from directory {destinyDir}')
     fileCounter = 0
-    for filename in glob.glob('**', recursive=True, root_dir=destinyDir):
+    isFileToDelete = getDateFileMatcher(fileDateStr, 'aud', exceptfiles)
+    isSubdirToDelete = getContainsMatcher(justSubdirs)
+    for entry in getFileCatalog(destinyDir, fileDateStr):
+        filename = entry.path
         filePath = os.path.join(destinyDir, filename)
         try:
             if os.path.exists(filePath):
-                if os.path.isfile(filePath) and re.search(f'''.*{fileDateStr}.*\\.aud''', filePath) and not re.search(f'''.*{exceptfiles}.*''', filePath):
+                if os.path.isfile(filePath) and isFileToDelete(filePath):
                     os.remove(filePath)
                     fileCounter = fileCounter +1
                     logging.info(f'{fileCounter}: {filename} deleted (file)')
@@ -63,7 +204,7 @@ def deleteDirContent(destinyDir, fileDateStr, exceptfiles='', justSubdirs=''):
                     os.unlink(filePath)
                     fileCounter = fileCounter +1
                     logging.info(f'{fileCounter}: {filename} deleted (link)')
-                elif os.path.isdir(filePath) and re.search(f'.*{justSubdirs}.*', filePath):
+                elif os.path.isdir(filePath) and isSubdirToDelete(filePath):
                     shutil.rmtree(filePath)
                     fileCounter = fileCounter +1
                     logging.info(f'{fileCounter}: {filename} deleted (directory)')
@@ -74,30 +215,192 @@ def deleteDirContent(destinyDir, fileDateStr, exceptfiles='', justSubdirs=''):
             logging.error('Exception occurred. Failed to delete %s. Reason: %s' % (filePath, e) )
             logging.error(f'Traceback: {traceback.format_exc()}')
             result = 'ERROR'   
+    invalidateFileCatalog(destinyDir)
     logging.info(f'Total files/directories deleted: {fileCounter}')
     return  result
 
 
-def createSSHClient(server, port, user, password):
-    client = paramiko.SSHClient()
-    client.load_system_host_keys()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(server, port, user, password)
-    return client
-
 def read_config(file_path):
     config = configparser.ConfigParser(allow_no_value=True)
     config.read(file_path)
     return config
 
-def getChecksumFile(filename):
-    with open(filename, 'rb') as fd:
-        #fd = open(filename, 'rb');                    
-        data = fd.read();
-        #fd.close();
-    checksumFile = hashlib.md5(data).hexdigest();
+def newChecksum(algorithm='md5'):
+    return CHECKSUM_ALGORITHMS[algorithm.lower()]()
+
+def updateChecksumFromFile(checksum, filename):
+    # File is hashed by chunks, so memory used does not depend on file size
+    buffer = bytearray(CHECKSUM_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(filename, 'rb', buffering=0) as fd:
+        while True:
+            size = fd.readinto(buffer)
+            if not size:
+                break
+            checksum.update(view[:size])
+    return checksum
+
+def getChecksumFile(filename, algorithm='md5'):
+    checksumFile = updateChecksumFromFile(newChecksum(algorithm), filename).hexdigest()
     return checksumFile
 
+def getChecksumFiles(filePaths, algorithm='md5', workers=1):
+    # Files are hashed in a thread pool, hashlib releases the GIL while hashing each chunk
+    checksums = {}
+    totalBytes = 0
+    startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as executor:
+        for filePath, checksumFile in zip(filePaths, executor.map(lambda filePath: getChecksumFile(filePath, algorithm), filePaths)):
+            checksums[filePath] = checksumFile
+            totalBytes = totalBytes + os.path.getsize(filePath)
+    elapsed = time.perf_counter() - startTime
+    throughput = (totalBytes / 1024 / 1024) / elapsed if elapsed > 0 else 0
+    logging.info(f'Checksum {algorithm}: {len(checksums)} files, {totalBytes} bytes in {elapsed:.2f} s ({throughput:.2f} MB/s)')
+    return checksums
+
+def writeChecksumFile(filePath, checksum):
+    # Checksum file next to AUD file (generate_checksum_files = 1)
+    with open(f'{filePath}.cheksum', "w") as text_file:
+        text_file.write("%s" % checksum)
+
+def writeChecksumLog(checksums):
+    # Numbered checksum lines of the log (generate_chesksum_log = 1), checksums: [(filename, checksum)]
+    fileCounter = 0
+    for filename, checksum in checksums:
+        fileCounter = fileCounter +1
+        logging.info(f'{fileCounter}: {filename} - {checksum}')
+    return fileCounter
+
+def getChecksumArchiveMembers(archivePath, algorithm='md5', fileDateStr='', extension_file='aud'):
+    # Members are hashed while archive is streamed ('r|'), nothing is extracted to disk
+    checksums = {}
+    isFileToCheck = getDateFileMatcher(fileDateStr, extension_file)
+    if archivePath.endswith(ARCHIVE_FORMATS['cas']):
+        for contentEntry in readContentArchive(archivePath):
+            if isFileToCheck(contentEntry.name):
+                checksum = newChecksum(algorithm)
+                with openContentArchiveMember(contentEntry) as memberFile:
+                    for chunk in iter(lambda: memberFile.read(CHECKSUM_CHUNK_SIZE), b''):
+                        checksum.update(chunk)
+                checksums[contentEntry.name] = checksum.hexdigest()
+        return checksums
+    if archivePath.endswith(ARCHIVE_FORMATS['indexed']):
+        with open(archivePath, 'rb') as archiveFile:
+            for indexEntry in readArchiveIndex(archivePath):
+                if isFileToCheck(indexEntry.name):
+                    checksum = newChecksum(algorithm)
+                    with openIndexedArchiveMember(archiveFile, indexEntry) as memberFile:
+                        for chunk in iter(lambda: memberFile.read(CHECKSUM_CHUNK_SIZE), b''):
+                            checksum.update(chunk)
+                    checksums[indexEntry.name] = checksum.hexdigest()
+        return checksums
+    with open(archivePath, 'rb') as archiveFile, tarfile.open(fileobj=openCompressedReader(archiveFile, archivePath), mode='r|') as tar:
+        for member in tar:
+            if member.isfile() and isFileToCheck(member.name):
+                checksum = newChecksum(algorithm)
+                memberFile = tar.extractfile(member)
+                for chunk in iter(lambda: memberFile.read(CHECKSUM_CHUNK_SIZE), b''):
+                    checksum.update(chunk)
+                checksums[member.name] = checksum.hexdigest()
+    return checksums
+
+def verifyArchive(archivePath, sourceDir, fileDateStr, extension_file='aud', algorithm='md5'):
+    """
+    Returns source files that are missing in archive or whose content is not the same (checksum of archive member).
+    Checksums saved in manifests are trusted when they use the same algorithm, other files are read again.
+
+    Examples:
+        >>> import tempfile
+        >>> from Aud_file_generator import generateAudTree
+        >>> workDir = tempfile.mkdtemp()
+        >>> sourceDir = os.path.join(workDir, 'auditCBS')
+        >>> _ = generateAudTree(sourceDir, '20240503', ['billdb', 'usrdb'], nodes_per_db=1, file_size_mb=0.02)
+        >>> createTarfile(os.path.join(workDir, '202405_aud_files.tar.gz'), sourceDir, '202405', '')
+        'OK'
+        >>> verifyArchive(os.path.join(workDir, '202405_aud_files.tar.gz'), sourceDir, '202405')
+        []
+
+        A source file that is not the same in archive is returned:
+        >>> changedFile = os.path.join('20240503', 'usrdb-1-1-m-0', os.listdir(os.path.join(sourceDir, '20240503', 'usrdb-1-1-m-0'))[0])
+        >>> with open(os.path.join(sourceDir, changedFile), 'a') as audFile:
+        ...     _ = audFile.write('LENGTH: "228"\\n')
+        >>> verifyArchive(os.path.join(workDir, '202405_aud_files.tar.gz'), sourceDir, '202405') == [changedFile]
+        True
+        >>> shutil.rmtree(workDir)
+    """
+    archiveChecksums = {name.replace('\\', '/'): checksum for name, checksum in getChecksumArchiveMembers(archivePath, algorithm, fileDateStr, extension_file).items()}
+    isFileToCheck = getDateFileMatcher(fileDateStr, extension_file)
+    manifests = {}
+    mismatches = []
+    for entry in getFileCatalog(sourceDir, fileDateStr):
+        filename = entry.path
+        if entry.isFile and isFileToCheck(filename):
+            manifestChecksum = getManifestChecksum(sourceDir, filename, manifests)
+            checksum = manifestChecksum[1] if manifestChecksum is not None and manifestChecksum[0] == algorithm else getChecksumFile(os.path.join(sourceDir, filename), algorithm)
+            if archiveChecksums.get(filename.replace('\\', '/')) != checksum:
+                mismatches.append(filename)
+    logging.info(f'Archive verified: {archivePath}, {len(archiveChecksums)} files, {len(mismatches)} not the same as source')
+    return mismatches
+
+def splitDayDirPath(filename):
+    # 20240503/billdb-1-1-m-0/zengine_20240503134936581.aud -> ('20240503', 'billdb-1-1-m-0/zengine_20240503134936581.aud')
+    filename = filename.replace('\\', '/')
+    if '/' not in filename:
+        return '', filename
+    dayDir, relPath = filename.split('/', 1)
+    return dayDir, relPath
+
+def getChecksumManifestPath(dayDir):
+    # Manifest is saved next to day directory, for example auditCBS/20240503.manifest
+    return f'{dayDir.rstrip("/")}.manifest'
+
+def readChecksumManifest(manifestPath):
+    # Manifest line: relative path, size, mtime, algorithm and checksum separated by tab
+    entries = {}
+    if os.path.exists(manifestPath):
+        with open(manifestPath, 'r') as manifestFile:
+            for line in manifestFile:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == 5:
+                    entries[fields[0]] = (int(fields[1]), int(fields[2]), fields[3], fields[4])
+    return entries
+
+def readChecksumManifests(rootDir, fileDateStr=''):
+    # All manifests of a day or month saved in rootDir, for example auditCBS_Processed/20240503.manifest
+    entries = {}
+    isManifest = getDateFileMatcher(fileDateStr, 'manifest')
+    for entry in getFileCatalog(rootDir, fileDateStr):
+        if entry.isFile and os.sep not in entry.path and entry.path.endswith('.manifest') and isManifest(entry.path):
+            entries.update(readChecksumManifest(os.path.join(rootDir, entry.path)))
+    return entries
+
+_manifestLock = threading.Lock()
+
+def updateChecksumManifest(manifestPath, newEntries):
+    with _manifestLock:
+        entries = readChecksumManifest(manifestPath)
+        entries.update(newEntries)
+        tmpPath = f'{manifestPath}.tmp'
+        with open(tmpPath, 'w') as manifestFile:
+            for relPath in sorted(entries):
+                size, mtime, algorithm, checksum = entries[relPath]
+                manifestFile.write(f'{relPath}\t{size}\t{mtime}\t{algorithm}\t{checksum}\n')
+        os.replace(tmpPath, manifestPath)
+    return 'OK'
+
+def getChecksumManifestEntry(filePath, checksum, algorithm='md5'):
+    fileStats = os.stat(filePath)
+    return (fileStats.st_size, int(fileStats.st_mtime), algorithm.lower(), checksum)
+
+def getTrustedChecksum(entries, relPath, filePath, algorithm='md5'):
+    # Checksum in manifest is trusted only while file size and mtime are unchanged. algorithm=None accepts any algorithm
+    entry = entries.get(relPath)
+    if entry is not None and (algorithm is None or entry[2] == algorithm.lower()):
+        fileStats = os.stat(filePath)
+        if fileStats.st_size == entry[0] and int(fileStats.st_mtime) == entry[1]:
+            return entry[3]
+    return None
+
 def writeScriptsChecksumInLog(local_dir_scripts):
     result = 'OK'
     try:
@@ -110,6 +413,13 @@ def writeScriptsChecksumInLog(local_dir_scripts):
         checkUtil = getChecksumFile(f'{local_dir_scripts}/Util_string.py')
         checkUtilFiles = getChecksumFile(f'{local_dir_scripts}/Util_files.py')
         checkTransform = getChecksumFile(f'{local_dir_scripts}/Activity_report_generator.py')
+        checkUtilMatcher = getChecksumFile(f'{local_dir_scripts}/Util_matcher.py')
+        checkUtilParseCache = getChecksumFile(f'{local_dir_scripts}/Util_parse_cache.py')
+        checkUtilActivityStore = getChecksumFile(f'{local_dir_scripts}/Util_activity_store.py')
+        checkActivityQuery = getChecksumFile(f'{local_dir_scripts}/Activity_query.py')
+        checkUtilCompression = getChecksumFile(f'{local_dir_scripts}/Util_compression.py')
+        checkUtilMetrics = getChecksumFile(f'{local_dir_scripts}/Util_metrics.py')
+        checkWatchAndLoad = getChecksumFile(f'{local_dir_scripts}/Watch_and_load.py')
         logging.info(f'1: {local_dir_scripts}/config.properties - {checksumConfig}')
         logging.info(f'2: {local_dir_scripts}/Extract_and_load.py - {checksumExtract_and_load}')
         logging.info(f'3: {local_dir_scripts}/Extractor.py - {checksumExtractor}')
@@ -119,6 +429,13 @@ def writeScriptsChecksumInLog(local_dir_scripts):
         logging.info(f'7: {local_dir_scripts}/Compress_db_aud_files.py - {checksumCompress_db_aud_files}')
         logging.info(f'8: {local_dir_scripts}/Util_string.py - {checkUtil}')
         logging.info(f'9: {local_dir_scripts}/Util_files.py - {checkUtilFiles}') 
+        logging.info(f'10: {local_dir_scripts}/Util_matcher.py - {checkUtilMatcher}')
+        logging.info(f'11: {local_dir_scripts}/Util_parse_cache.py - {checkUtilParseCache}')
+        logging.info(f'12: {local_dir_scripts}/Util_activity_store.py - {checkUtilActivityStore}')
+        logging.info(f'13: {local_dir_scripts}/Activity_query.py - {checkActivityQuery}')
+        logging.info(f'14: {local_dir_scripts}/Util_compression.py - {checkUtilCompression}')
+        logging.info(f'15: {local_dir_scripts}/Util_metrics.py - {checkUtilMetrics}')
+        logging.info(f'16: {local_dir_scripts}/Watch_and_load.py - {checkWatchAndLoad}')
     except Exception as e:
         logging.error('Exception occurred:' )
         logging.error(f'{e}')
@@ -126,22 +443,40 @@ def writeScriptsChecksumInLog(local_dir_scripts):
         result = 'ERROR'
     return result
 
-def createTarfile(output_filename, sourceDir, fileDateStr, subdirs, extension_file = 'aud'):
+def logCompressionStats(compression_codec, compression_level, inputBytes, outputBytes, elapsed):
+    # Input bytes are also the bytes processed by archive stage metrics (see Util_metrics)
+    ratio = inputBytes / outputBytes if outputBytes > 0 else 0
+    throughput = (inputBytes / 1024 / 1024) / elapsed if elapsed > 0 else 0
+    logging.info(f'Compression {compression_codec} level {compression_level}: {inputBytes} bytes -> {outputBytes} bytes, ratio {ratio:.2f} in {elapsed:.2f} s ({throughput:.2f} MB/s)')
+
+@measuredStage('createTarfile')
+def createTarfile(output_filename, sourceDir, fileDateStr, subdirs, extension_file = 'aud', compression_codec='gzip', compression_level=9, compression_workers=1):
     result = 'OK'    
     logging.info(f'Start compressing files from directory {sourceDir}')
     try:
         if not os.path.exists(output_filename):
             fileCounter = 0  
+            inputBytes = 0
+            startTime = time.perf_counter()
             logging.info(f'Compressed file created: {output_filename}') 
-            with tarfile.open(output_filename, "w:gz") as tar:
-                for filename in glob.glob('**', recursive=True, root_dir=sourceDir):
-                    sourcePath = os.path.join(sourceDir, filename)
-                    if os.path.isfile(sourcePath) and re.search(f'.*{fileDateStr}.*\\.{extension_file}', filename):
-                        arcname = os.path.relpath(sourcePath, sourceDir)
-                        tar.add(sourcePath, arcname=arcname)     
-                        fileCounter = fileCounter + 1
-                        logging.info(f'{fileCounter}: {filename}') 
+            isFileToCompress = getDateFileMatcher(fileDateStr, extension_file)
+            # tar stream is written to the compression backend selected by compression_codec
+            with open(output_filename, 'wb') as archiveFile:
+                with openCompressedWriter(archiveFile, compression_codec, compression_level, compression_workers) as writer:
+                    with tarfile.open(fileobj=writer, mode='w|') as tar:
+                        for entry in getFileCatalog(sourceDir, fileDateStr):
+                            filename = entry.path
+                            sourcePath = os.path.join(sourceDir, filename)
+                            if entry.isFile and isFileToCompress(filename):
+                                arcname = os.path.relpath(sourcePath, sourceDir)
+                                tar.add(sourcePath, arcname=arcname)     
+                                inputBytes = inputBytes + os.path.getsize(sourcePath)
+                                fileCounter = fileCounter + 1
+                                logging.info(f'{fileCounter}: {filename}') 
             logging.info(f'Total files compressed: {fileCounter}') 
+            logCompressionStats(compression_codec, compression_level, inputBytes, os.path.getsize(output_filename), time.perf_counter() - startTime)
+            addStageCounters('createTarfile', files=fileCounter, bytes=inputBytes)
+            invalidateFileCatalog(sourceDir)
             if fileCounter == 0:
                 os.remove(output_filename) 
                 logging.info(f'Zero (0) bytes compressed file deleted: {output_filename} ') 
@@ -154,12 +489,33 @@ def createTarfile(output_filename, sourceDir, fileDateStr, subdirs, extension_fi
         result = 'ERROR'                 
     return result                      
 
-def compressFiles(fileDir, output_filename, compressedFileDateStr, subdirs, extension_file = 'aud'):
+def getCompressMonthStr(fileDate, n_months_after, force_month_str=''):
+    # Month compressed by Compress_* modules: N months before extraction date month, or forced month
+    if force_month_str != '':
+        return str(force_month_str)
+    return str(int(fileDate.strftime('%Y%m')) - int(n_months_after))
+
+def compressFiles(fileDir, output_filename, compressedFileDateStr, subdirs, extension_file = 'aud', compression_codec='gzip', compression_level=9, compression_workers=1, content_store_dir='', verify_archive='0', checksum_algorithm='md5'):
     result = 'OK'    
     try:
-        result = createTarfile(output_filename, fileDir, compressedFileDateStr, subdirs, extension_file)
+        if output_filename.endswith(ARCHIVE_FORMATS['cas']):
+            result = createContentArchive(output_filename, fileDir, compressedFileDateStr, subdirs, extension_file, content_store_dir, compression_codec=compression_codec, compression_level=compression_level, compression_workers=compression_workers)
+        elif output_filename.endswith(ARCHIVE_FORMATS['indexed']):
+            result = createIndexedArchive(output_filename, fileDir, compressedFileDateStr, subdirs, extension_file, compression_codec=compression_codec, compression_level=compression_level, compression_workers=compression_workers)
+        else:
+            result = createTarfile(output_filename, fileDir, compressedFileDateStr, subdirs, extension_file, compression_codec, compression_level, compression_workers)
         #Delete files AUD files except TAR.GZ file
         if result == 'OK':
+            if os.path.exists(output_filename) and output_filename.endswith(ARCHIVE_FORMATS['indexed']):
+                # Archive could be left without index by a previous run: members can not be found without it, so source files are kept
+                checkArchiveIndex(output_filename)
+            if os.path.exists(output_filename) and verify_archive == '1':
+                # Archive is read back before source files are deleted
+                mismatches = verifyArchive(output_filename, fileDir, compressedFileDateStr, extension_file, checksum_algorithm)
+                for filename in mismatches:
+                    logging.error(f'File not the same in archive: {filename}')
+                if len(mismatches) > 0:
+                    raise ValueError(f'{len(mismatches)} files are not the same in {output_filename}, they are not deleted')
             if os.path.exists(output_filename):
                 file_stats = os.stat(output_filename)
                 file_size = file_stats.st_size
@@ -177,37 +533,508 @@ def compressFiles(fileDir, output_filename, compressedFileDateStr, subdirs, exte
         result = 'ERROR'                 
     return result   
 
-def getParamikoSSHCLient(host, port, username, password):
-    client = paramiko.client.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(host, port, username, password)  
-    return client
+def getArchiveFilename(baseFilename, archive_format='tar.gz', compression_codec='gzip'):
+    # /root/auditCBS_Processed/202405_db_aud_files -> /root/auditCBS_Processed/202405_db_aud_files.tar.gz (.tar.xz, .tar.zst), .gzm or .cas
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f'Archive format not supported: {archive_format}')
+    if archive_format in ['indexed', 'cas']:
+        return f'{baseFilename}{ARCHIVE_FORMATS[archive_format]}'
+    return f'{baseFilename}{getTarExtension(compression_codec)}'
+
+def getArchiveIndexPath(archivePath):
+    return f'{archivePath}.idx'
+
+@measuredStage('createIndexedArchive')
+def createIndexedArchive(output_filename, sourceDir, fileDateStr, subdirs, extension_file = 'aud', checksum_algorithm='md5', compression_codec='gzip', compression_level=9, compression_workers=1):
+    result = 'OK'
+    logging.info(f'Start compressing files from directory {sourceDir}')
+    try:
+        if getCompressionCodec(compression_codec) not in ['gzip', 'pgzip']:
+            raise ValueError(f'Indexed archives are made of gzip members, compression codec {compression_codec} can not be used')
+        if not os.path.exists(output_filename):
+            fileCounter = 0
+            inputBytes = 0
+            startTime = time.perf_counter()
+            logging.info(f'Compressed file created: {output_filename}')
+            isFileToCompress = getDateFileMatcher(fileDateStr, extension_file)
+            indexEntries = []
+            buffer = bytearray(CHECKSUM_CHUNK_SIZE)
+            view = memoryview(buffer)
+            with open(output_filename, 'wb') as archiveFile:
+                for entry in getFileCatalog(sourceDir, fileDateStr):
+                    filename = entry.path
+                    sourcePath = os.path.join(sourceDir, filename)
+                    if entry.isFile and isFileToCompress(filename):
+                        arcname = os.path.relpath(sourcePath, sourceDir).replace('\\', '/')
+                        fileStats = os.stat(sourcePath)
+                        offset = archiveFile.tell()
+                        checksum = newChecksum(checksum_algorithm)
+                        size = 0
+                        # Each file is an independent gzip member, it is decompressed starting at its offset
+                        with open(sourcePath, 'rb', buffering=0) as sourceFile, openCompressedWriter(archiveFile, compression_codec, compression_level, compression_workers) as member:
+                            while True:
+                                readSize = sourceFile.readinto(buffer)
+                                if not readSize:
+                                    break
+                                checksum.update(view[:readSize])
+                                member.write(view[:readSize])
+                                size = size + readSize
+                        indexEntries.append(ArchiveIndexEntry(arcname, offset, archiveFile.tell() - offset, size, int(fileStats.st_mtime), checksum_algorithm, checksum.hexdigest()))
+                        inputBytes = inputBytes + size
+                        fileCounter = fileCounter + 1
+                        logging.info(f'{fileCounter}: {filename}')
+            # Index is written last: an archive without index is not complete
+            writeArchiveIndex(getArchiveIndexPath(output_filename), indexEntries)
+            logging.info(f'Total files compressed: {fileCounter}')
+            logCompressionStats(compression_codec, compression_level, inputBytes, os.path.getsize(output_filename), time.perf_counter() - startTime)
+            addStageCounters('createIndexedArchive', files=fileCounter, bytes=inputBytes)
+            invalidateFileCatalog(sourceDir)
+            if fileCounter == 0:
+                os.remove(output_filename)
+                os.remove(getArchiveIndexPath(output_filename))
+                logging.info(f'Zero (0) bytes compressed file deleted: {output_filename} ')
+        else:
+            logging.info(f'Compressed file exists: {output_filename} ')
+    except Exception as e:
+        logging.error('Exception occurred:' )
+        logging.error(f'{e}')
+        logging.error(f'Traceback: {traceback.format_exc()}')
+        result = 'ERROR'
+    return result
+
+def writeArchiveIndex(indexPath, indexEntries):
+    # Index line: name, offset, compressed size, size, mtime, algorithm and checksum separated by tab
+    tmpPath = f'{indexPath}.tmp'
+    with open(tmpPath, 'w') as indexFile:
+        for indexEntry in indexEntries:
+            indexFile.write('\t'.join(str(field) for field in indexEntry) + '\n')
+    os.replace(tmpPath, indexPath)
+
+def checkArchiveIndex(archivePath):
+    # An indexed archive is complete when its index loads and its members cover the whole archive file
+    indexEntries = readArchiveIndex(archivePath)
+    archiveSize = os.path.getsize(archivePath)
+    indexedSize = max((indexEntry.offset + indexEntry.csize for indexEntry in indexEntries), default=0)
+    if len(indexEntries) == 0 or indexedSize != archiveSize:
+        raise ValueError(f'Index of {archivePath} is not complete: {len(indexEntries)} members, {indexedSize} of {archiveSize} bytes indexed')
+    return indexEntries
+
+def readArchiveIndex(archivePath):
+    indexEntries = []
+    with open(getArchiveIndexPath(archivePath), 'r') as indexFile:
+        for line in indexFile:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 7:
+                indexEntries.append(ArchiveIndexEntry(fields[0], int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]), fields[5], fields[6]))
+    return indexEntries
 
-def getFilesQuantityInRemoteDir(SSHClient, dir, fileDateStr):
+class ArchiveSection(io.RawIOBase):
+    # Bytes of one member of an indexed archive. Archive file is shared, so its members are read one at a time
+    def __init__(self, archiveFile, offset, size):
+        self.archiveFile = archiveFile
+        self.position = offset
+        self.end = offset + size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.end - self.position)
+        if size <= 0:
+            return 0
+        self.archiveFile.seek(self.position)
+        data = self.archiveFile.read(size)
+        buffer[:len(data)] = data
+        self.position = self.position + len(data)
+        return len(data)
+
+def openIndexedArchiveMember(archiveFile, indexEntry):
+    """
+    Returns a binary file object with decompressed content of one member, only its compressed bytes are read.
+
+    Examples:
+        >>> import tempfile
+        >>> from Aud_file_generator import generateAudTree
+        >>> workDir = tempfile.mkdtemp()
+        >>> sourceDir = os.path.join(workDir, 'auditCBS')
+        >>> _ = generateAudTree(sourceDir, '20240503', ['billdb', 'usrdb'], nodes_per_db=1, file_size_mb=0.02)
+        >>> archivePath = os.path.join(workDir, '202405_aud_files.gzm')
+        >>> createIndexedArchive(archivePath, sourceDir, '202405', '')
+        'OK'
+        >>> indexEntries = checkArchiveIndex(archivePath)
+        >>> with open(archivePath, 'rb') as archiveFile:
+        ...     [hashlib.md5(openIndexedArchiveMember(archiveFile, indexEntry).read()).hexdigest() == indexEntry.checksum == getChecksumFile(os.path.join(sourceDir, indexEntry.name)) for indexEntry in indexEntries]
+        [True, True]
+
+        An index that does not cover the whole archive is not complete, so compressFiles keeps source files:
+        >>> with open(getArchiveIndexPath(archivePath)) as indexFile:
+        ...     indexLines = indexFile.readlines()
+        >>> with open(getArchiveIndexPath(archivePath), 'w') as indexFile:
+        ...     _ = indexFile.write(indexLines[0])
+        >>> checkArchiveIndex(archivePath)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        ValueError: Index of ... is not complete: 1 members, ... bytes indexed
+        >>> shutil.rmtree(workDir)
+    """
+    return gzip.GzipFile(fileobj=io.BufferedReader(ArchiveSection(archiveFile, indexEntry.offset, indexEntry.csize), CHECKSUM_CHUNK_SIZE), mode='rb')
+
+def getContentPath(content_store_dir, algorithm, checksum, compression_codec='gzip'):
+    return f'{content_store_dir}/{algorithm}/{checksum[:2]}/{checksum}{COMPRESSED_EXTENSIONS[getCompressionCodec(compression_codec)]}'
+
+def getManifestChecksum(rootDir, filename, manifests):
+    """
+    Returns (algorithm, checksum) saved by extraction (day manifest, 20240503.manifest) or by loader (db manifest) for a file
+    under rootDir, or None when it is unknown or file changed after checksum. manifests caches manifests already read.
+    """
+    filename = filename.replace('\\', '/')
+    filePath = os.path.join(rootDir, filename)
+    dayDir, relPath = splitDayDirPath(filename)
+    candidates = [(getChecksumManifestPath(os.path.join(rootDir, dayDir)), relPath)] if dayDir.isdigit() else []
+    candidates.append(('', filename))
+    for manifestPath, key in candidates:
+        if manifestPath not in manifests:
+            manifests[manifestPath] = readChecksumManifest(manifestPath) if manifestPath != '' else readChecksumManifests(rootDir)
+        entry = manifests[manifestPath].get(key)
+        if entry is not None and getTrustedChecksum(manifests[manifestPath], key, filePath, entry[2]) is not None:
+            return entry[2], entry[3]
+    return None
+
+@measuredStage('createContentArchive')
+def createContentArchive(output_filename, sourceDir, fileDateStr, subdirs, extension_file = 'aud', content_store_dir = '', checksum_algorithm='md5', compression_codec='gzip', compression_level=9, compression_workers=1):
+    result = 'OK'
+    logging.info(f'Start compressing files from directory {sourceDir}')
+    try:
+        if content_store_dir == '':
+            raise ValueError('Content archives need content_store_dir parameter ([COMPRESS] section)')
+        if not os.path.exists(output_filename):
+            fileCounter = 0
+            storedCounter = 0
+            inputBytes = 0
+            storedBytes = 0
+            outputBytes = 0
+            startTime = time.perf_counter()
+            logging.info(f'Compressed file created: {output_filename}')
+            isFileToCompress = getDateFileMatcher(fileDateStr, extension_file)
+            manifests = {}
+            contentEntries = []
+            for entry in getFileCatalog(sourceDir, fileDateStr):
+                filename = entry.path
+                sourcePath = os.path.join(sourceDir, filename)
+                if entry.isFile and isFileToCompress(filename):
+                    arcname = os.path.relpath(sourcePath, sourceDir).replace('\\', '/')
+                    fileStats = os.stat(sourcePath)
+                    # Checksum calculated by checksumFiles is the content key, file is read only when it is not known
+                    manifestChecksum = getManifestChecksum(sourceDir, filename, manifests)
+                    algorithm, checksum = manifestChecksum if manifestChecksum is not None else (checksum_algorithm, getChecksumFile(sourcePath, checksum_algorithm))
+                    contentPath = getContentPath(content_store_dir, algorithm, checksum, compression_codec)
+                    if not os.path.exists(contentPath):
+                        os.makedirs(os.path.dirname(contentPath), exist_ok=True)
+                        # Same content can be stored at the same time by other compress stage (pipeline mode): each writer has its own temporary file
+                        # and os.replace of identical content by the last one is harmless
+                        tmpPath = f'{contentPath}.{os.getpid()}.{threading.get_ident()}.tmp'
+                        with open(sourcePath, 'rb') as sourceFile, open(tmpPath, 'wb') as contentFile:
+                            with openCompressedWriter(contentFile, compression_codec, compression_level, compression_workers) as writer:
+                                shutil.copyfileobj(sourceFile, writer, CHECKSUM_CHUNK_SIZE)
+                        os.replace(tmpPath, contentPath)
+                        storedCounter = storedCounter + 1
+                        storedBytes = storedBytes + fileStats.st_size
+                        outputBytes = outputBytes + os.path.getsize(contentPath)
+                    contentEntries.append(ContentArchiveEntry(arcname, fileStats.st_size, int(fileStats.st_mtime), algorithm, checksum, contentPath))
+                    inputBytes = inputBytes + fileStats.st_size
+                    fileCounter = fileCounter + 1
+                    logging.info(f'{fileCounter}: {filename}')
+            writeContentArchive(output_filename, contentEntries)
+            logging.info(f'Total files compressed: {fileCounter}')
+            logging.info(f'Contents stored: {storedCounter}. Contents already in store: {fileCounter - storedCounter} ({inputBytes - storedBytes} bytes not compressed again)')
+            logCompressionStats(compression_codec, compression_level, storedBytes, outputBytes, time.perf_counter() - startTime)
+            addStageCounters('createContentArchive', files=fileCounter, bytes=inputBytes)
+            invalidateFileCatalog(sourceDir)
+            if fileCounter == 0:
+                os.remove(output_filename)
+                logging.info(f'Zero (0) bytes compressed file deleted: {output_filename} ')
+        else:
+            logging.info(f'Compressed file exists: {output_filename} ')
+    except Exception as e:
+        logging.error('Exception occurred:' )
+        logging.error(f'{e}')
+        logging.error(f'Traceback: {traceback.format_exc()}')
+        result = 'ERROR'
+    return result
+
+def writeContentArchive(output_filename, contentEntries):
+    # Manifest line: name, size, mtime, algorithm, checksum and content path separated by tab
+    tmpPath = f'{output_filename}.tmp'
+    with open(tmpPath, 'w') as manifestFile:
+        for contentEntry in contentEntries:
+            manifestFile.write('\t'.join(str(field) for field in contentEntry) + '\n')
+    os.replace(tmpPath, output_filename)
+
+def readContentArchive(archivePath):
+    """
+    Returns the entries of a content archive (.cas manifest), in archive order.
+
+    Examples:
+        Per node and per db archives of the same files share their content, each content is compressed once:
+        >>> import tempfile
+        >>> from Aud_file_generator import generateAudTree
+        >>> workDir = tempfile.mkdtemp()
+        >>> contentStoreDir = os.path.join(workDir, 'contentStore')
+        >>> _ = generateAudTree(os.path.join(workDir, 'auditCBS'), '20240503', ['billdb', 'usrdb'], nodes_per_db=1, file_size_mb=0.02)
+        >>> _ = shutil.copytree(os.path.join(workDir, 'auditCBS', '20240503', 'billdb-1-1-m-0'), os.path.join(workDir, 'auditCBS_Processed', 'billdb'))
+        >>> createContentArchive(os.path.join(workDir, '202405_aud_files.cas'), os.path.join(workDir, 'auditCBS'), '202405', '', content_store_dir=contentStoreDir)
+        'OK'
+        >>> createContentArchive(os.path.join(workDir, '202405_db_aud_files.cas'), os.path.join(workDir, 'auditCBS_Processed'), '202405', '', content_store_dir=contentStoreDir)
+        'OK'
+        >>> contentEntries = readContentArchive(os.path.join(workDir, '202405_aud_files.cas')) + readContentArchive(os.path.join(workDir, '202405_db_aud_files.cas'))
+        >>> len(contentEntries), len(set(contentEntry.content for contentEntry in contentEntries))
+        (3, 2)
+        >>> def readMember(contentEntry):
+        ...     with openContentArchiveMember(contentEntry) as member:
+        ...         return member.read()
+        >>> [hashlib.md5(readMember(contentEntry)).hexdigest() == contentEntry.checksum for contentEntry in contentEntries]
+        [True, True, True]
+        >>> verifyArchive(os.path.join(workDir, '202405_db_aud_files.cas'), os.path.join(workDir, 'auditCBS_Processed'), '202405')
+        []
+        >>> shutil.rmtree(workDir)
+    """
+    contentEntries = []
+    with open(archivePath, 'r') as manifestFile:
+        for line in manifestFile:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 6:
+                contentEntries.append(ContentArchiveEntry(fields[0], int(fields[1]), int(fields[2]), fields[3], fields[4], fields[5]))
+    return contentEntries
+
+@contextmanager
+def openContentArchiveMember(contentEntry):
+    # Decompressed content of one file of a content archive
+    with open(contentEntry.content, 'rb') as contentFile:
+        with openCompressedReader(contentFile, contentEntry.content) as member:
+            yield member
+
+def reflinkFile(sourcePath, destPath):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform')
+    with open(sourcePath, 'rb') as sourceFile:
+        with open(destPath, 'wb') as destFile:
+            try:
+                fcntl.ioctl(destFile.fileno(), FICLONE, sourceFile.fileno())
+            except OSError:
+                destFile.close()
+                os.remove(destPath)
+                raise
+    shutil.copystat(sourcePath, destPath)
+
+def placeFile(sourcePath, destPath, strategy='copy'):
+    # Place a file in destiny path without copying its data when file system allows it
+    # Returns used strategy: it is 'copy' when requested one is not possible (for example crossing file systems)
+    # A move crossing file systems is still a move: source file does not exist after it
+    if os.path.lexists(destPath):
+        os.remove(destPath)
+    if strategy == 'hardlink':
+        try:
+            os.link(sourcePath, destPath)
+            return 'hardlink'
+        except OSError:
+            pass
+    elif strategy == 'reflink':
+        try:
+            reflinkFile(sourcePath, destPath)
+            return 'reflink'
+        except OSError:
+            pass
+    elif strategy == 'move':
+        try:
+            os.rename(sourcePath, destPath)
+            return 'move'
+        except OSError:
+            shutil.move(sourcePath, destPath)
+            return 'move'
+    shutil.copy(sourcePath, destPath)
+    return 'copy'
+
+def getFilesQuantityInRemoteDir(session, dir, fileDateStr):
     counter = 0
-    with SSHClient.open_sftp() as sftp:
-        files = sftp.listdir(dir)
-        for i, file in enumerate(files):
-            if file and fileDateStr in file:
-                counter = counter + 1                    
+    files = session.sftp().listdir(dir)
+    for i, file in enumerate(files):
+        if file and fileDateStr in file:
+            counter = counter + 1                    
     return counter
 
+class SSHSession:
+    """
+    One SSH connection with keepalive and its SFTP subsystem opened once and reused.
+    Use it through SSHSessionPool.session()
+    """
+    def __init__(self, host, port, username, password, keepalive_interval=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.keepalive_interval = int(keepalive_interval)
+        self.client = None
+        self._sftp = None
+
+    def connect(self):
+        self.close()
+        self.client = paramiko.SSHClient()
+        self.client.load_system_host_keys()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect(self.host, self.port, self.username, self.password)
+        if self.keepalive_interval > 0:
+            self.client.get_transport().set_keepalive(self.keepalive_interval)
+        logging.info(f'SSH session opened to {self.host}:{self.port}')
+
+    def isActive(self):
+        return self.client is not None and self.client.get_transport() is not None and self.client.get_transport().is_active()
+
+    def transport(self):
+        return self.client.get_transport()
+
+    def sftp(self):
+        if self._sftp is None or self._sftp.get_channel() is None or self._sftp.get_channel().closed:
+            self._sftp = self.client.open_sftp()
+        return self._sftp
+
+    def close(self):
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception:
+                pass
+            self._sftp = None
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+# Errors of a dropped SSH connection, operations run by SSHSessionPool.run are done again on a new connection
+SSH_DROPPED_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+class SSHSessionPool:
+    """
+    Pool of SSH sessions to one server shared by all ETL stages during a run.
+    Handshake and authentication are done once per session; a broken session is reconnected on next use.
+    run(operation) reconnects transparently: when the connection drops, operation(session) is done again once on a new connection.
+
+    Example:
+        >>> pool = getSSHSessionPool(host, port, user, password, max_sessions=4)
+        >>> with pool.session() as session:
+        ...     session.sftp().listdir('/auditlogs')
+        >>> pool.run(lambda session: session.sftp().listdir('/auditlogs'))
+    """
+    def __init__(self, host, port, username, password, max_sessions=1, keepalive_interval=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_sessions = int(max_sessions)
+        self.keepalive_interval = int(keepalive_interval)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def resize(self, max_sessions):
+        with self._lock:
+            self.max_sessions = max(self.max_sessions, int(max_sessions))
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle.empty() and self._created < self.max_sessions:
+                self._created = self._created + 1
+                return SSHSession(self.host, self.port, self.username, self.password, self.keepalive_interval)
+        return self._idle.get()
+
+    @contextmanager
+    def session(self):
+        sshSession = self._acquire()
+        try:
+            if not sshSession.isActive():
+                sshSession.connect()
+            yield sshSession
+        except SSH_DROPPED_ERRORS:
+            # Connection is dropped, it will be opened again by the next user of this session
+            sshSession.close()
+            raise
+        finally:
+            self._idle.put(sshSession)
+
+    def run(self, operation, retries=1):
+        # Returns operation(session). A dropped connection (an SSH error, or any error that leaves the session inactive)
+        # is opened again and operation is done again up to retries times, other errors are raised at once
+        attempt = 0
+        while True:
+            with self.session() as sshSession:
+                try:
+                    return operation(sshSession)
+                except Exception as e:
+                    if attempt >= int(retries) or not (isinstance(e, SSH_DROPPED_ERRORS) or not sshSession.isActive()):
+                        raise
+                    attempt = attempt + 1
+                    logging.warning(f'SSH session to {self.host}:{self.port} dropped ({e}), operation retried on a new connection ({attempt}/{retries})')
+                    sshSession.close()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().close()
+        self._created = 0
+
+_sshSessionPools = {}
+_sshSessionPoolsLock = threading.Lock()
+
+def getSSHSessionPool(host, port, username, password, max_sessions=1, keepalive_interval=30):
+    # Same pool is returned for same server and user during the whole run
+    key = (host, str(port), username)
+    with _sshSessionPoolsLock:
+        pool = _sshSessionPools.get(key)
+        if pool is None:
+            pool = SSHSessionPool(host, port, username, password, max_sessions, keepalive_interval)
+            _sshSessionPools[key] = pool
+        else:
+            pool.resize(max_sessions)
+    return pool
+
+def closeSSHSessionPools():
+    with _sshSessionPoolsLock:
+        for pool in _sshSessionPools.values():
+            pool.close()
+        _sshSessionPools.clear()
+
+# Pipeline stages: worker threads take items from a bounded queue and put their results in the next stage queue,
+# so a slow stage makes previous stages wait instead of using memory without limit
+PIPELINE_END = None
+
+def runPipelineStage(inQueue, outQueue, function, errors):
+    while True:
+        item = inQueue.get()
+        if item is PIPELINE_END:
+            break
+        try:
+            outItem = function(item)
+            if outQueue is not None and outItem is not None:
+                outQueue.put(outItem)
+        except Exception as e:
+            # Stage keeps draining its queue, so previous stages are not blocked
+            errors.append((item, f'{e}', traceback.format_exc()))
+
+def startPipelineStage(inQueue, outQueue, function, workers, errors):
+    threads = [threading.Thread(target=runPipelineStage, args=(inQueue, outQueue, function, errors), daemon=True) for _ in range(max(1, int(workers)))]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def stopPipelineStage(inQueue, threads):
+    # Waits until all items already in queue are processed
+    for _ in threads:
+        inQueue.put(PIPELINE_END)
+    for thread in threads:
+        thread.join()
+
 def getFilesQuantityInDir(dir, fileDateStr, exceptfiles):
     counter = 0
-    for filename in glob.glob('**', recursive=True, root_dir=dir):
-        if  re.search(f'.*{fileDateStr}.*\\.aud', filename) and not re.search(f'.*{exceptfiles}.*', filename):
+    isFileToCount = getDateFileMatcher(fileDateStr, 'aud', exceptfiles)
+    for entry in getFileCatalog(dir, fileDateStr):
+        filename = entry.path
+        if  isFileToCount(filename):
             counter = counter +1
     return counter
-"""
-def getFilesQuantityInRemoteDir(host, port, username, password, dir, fileDateStr):
-    counter = 0
-    with paramiko.SSHClient() as client:
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(host, port, username, password)  
-        with client.open_sftp() as sftp:
-            files = sftp.listdir(dir)
-            for i, file in enumerate(files):
-                if file and fileDateStr in file:
-                    counter = counter + 1                    
-    return counter
-"""    
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Util module contains filename matchers used to select AUD, log and compressed files.
+
+Matchers are built once per pattern and cached, so walks over many files do not build and search a new regular expression for each file.
+They return the same result as the original expressions:
+    re.search(f'.*{fileDateStr}.*\\.{extension_file}', name)    ->  getDateFileMatcher(fileDateStr, extension_file)(name)
+    re.search(f'.*{pattern}.*', name)                          ->  getContainsMatcher(pattern)(name)
+When the pattern is a plain text (for example a date or an escaped extension like \\.tar\\.gz) plain substring tests are used
+instead of the regular expression engine.
+
+Imports:
+    - re
+    - functools.lru_cache
+
+Functions:
+    1. getLiteralPattern(pattern)
+    2. getContainsMatcher(pattern)
+    3. getDateFileMatcher(fileDateStr, extension_file='aud', exceptfiles=None)
+
+Usage Examples:
+    >>> isAudFile = getDateFileMatcher('20240503', 'aud', '\\.tar\\.gz')
+    >>> isAudFile('billdb-1-1-m-0/zengine_20240503134936581.aud')
+    True
+    >>> isAudFile('202405_aud_files.tar.gz')
+    False
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240512
+"""
+
+import re
+from functools import lru_cache
+
+REGEX_SPECIAL_CHARS = '.^$*+?{}[]|()'
+
+def getLiteralPattern(pattern):
+    """
+    Returns the plain text matched by a regular expression without special characters, or None if the pattern needs the regex engine.
+
+    Examples:
+        >>> getLiteralPattern('\\.tar\\.gz')
+        '.tar.gz'
+        >>> getLiteralPattern('20240503')
+        '20240503'
+        >>> getLiteralPattern('2024050[1-3]') is None
+        True
+    """
+    literal = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum():
+                # \d, \w, \n, ... are classes or special sequences
+                return None
+            literal.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            literal.append(char)
+    if escaped:
+        return None
+    return ''.join(literal)
+
+@lru_cache(maxsize=256)
+def getContainsMatcher(pattern):
+    """
+    Returns a function equivalent to re.search(f'.*{pattern}.*', name) is not None
+    """
+    pattern = str(pattern)
+    literal = getLiteralPattern(pattern)
+    if literal is not None:
+        return lambda name: literal in name
+    compiledPattern = re.compile(pattern)
+    return lambda name: compiledPattern.search(name) is not None
+
+@lru_cache(maxsize=256)
+def getDateFileMatcher(fileDateStr, extension_file='aud', exceptfiles=None):
+    """
+    Returns a function equivalent to
+        re.search(f'.*{fileDateStr}.*\\.{extension_file}', name) and not re.search(f'.*{exceptfiles}.*', name)
+    When exceptfiles is None there is no exception test
+    """
+    fileDateStr = str(fileDateStr)
+    dateLiteral = getLiteralPattern(fileDateStr)
+    extensionLiteral = getLiteralPattern(str(extension_file))
+    if dateLiteral is not None and extensionLiteral is not None:
+        extensionLiteral = '.' + extensionLiteral
+        def dateMatcher(name):
+            position = name.find(dateLiteral)
+            return position >= 0 and name.find(extensionLiteral, position + len(dateLiteral)) >= 0
+    else:
+        compiledPattern = re.compile(f'{fileDateStr}.*\\.{extension_file}')
+        dateMatcher = lambda name: compiledPattern.search(name) is not None
+    if exceptfiles is None:
+        return dateMatcher
+    exceptMatcher = getContainsMatcher(exceptfiles)
+    return lambda name: dateMatcher(name) and not exceptMatcher(name)
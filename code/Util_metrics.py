@@ -0,0 +1,215 @@
+"""
+Util module contains the stage metrics of the ETL: wall time, CPU time, files, bytes, throughput and memory growth of each stage and node.
+
+Stages are measured with measureStage (context manager) or measuredStage (decorator), and stage functions add the files and bytes they process
+with addStageCounters. At the end of a run metrics are written as JSON and as a Prometheus textfile (node_exporter textfile collector),
+and a text summary is added to the mail body ([METRICS] section of config.properties).
+
+CPU time is the CPU time of the thread running the stage (time.thread_time) plus child processes finished during the stage (report workers):
+stages running at the same time in other threads are not added, and worker threads started by a stage are measured by their own (node) stages.
+RSS growth is how much the stage raised the process peak RSS (ru_maxrss), 0 when memory used by the stage was not bigger than the previous peak.
+
+Imports:
+    - os
+    - json
+    - time
+    - threading
+    - datetime
+    - functools
+    - contextlib.contextmanager
+    - resource (optional, not available on Windows)
+
+Functions:
+    1. StageMetric(stage, node='')
+    2. measureStage(stage, node='')
+    3. measuredStage(stage)
+    4. addStageCounters(stage, files=0, bytes=0, node='')
+    5. getStageMetrics()
+    6. resetStageMetrics()
+    7. getAggregatedStageMetrics()
+    8. getMetricsSummary()
+    9. writeMetricsJson(filename)
+    10. writeMetricsPrometheus(filename, job)
+    11. writeMetrics(metrics_dir, job)
+
+Usage Examples:
+    >>> with measureStage('checksumFiles') as metric:
+    ...     metric.add(files=10, bytes=1048576)
+    >>> @measuredStage('createTarfile')
+    ... def createTarfile(...):
+    ...     addStageCounters('createTarfile', files=1, bytes=1024)
+    >>> print(getMetricsSummary())
+    >>> writeMetrics('/root/Scripts/logs', 'extract_and_load')
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240512
+"""
+
+import os
+import json
+import time
+import threading
+import datetime
+import functools
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Windows: RSS growth and child processes CPU time are not measured
+    resource = None
+
+_stageMetrics = []
+_openStageMetrics = {}
+_stageMetricsLock = threading.Lock()
+
+def getPeakRssMb():
+    # Process high-water mark, not the memory of one stage
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return maxrss / 1024 / 1024 if os.uname().sysname == 'Darwin' else maxrss / 1024
+
+def getCpuSeconds():
+    # Current thread only, other threads running at the same time are not added
+    cpuSeconds = time.thread_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpuSeconds = cpuSeconds + children.ru_utime + children.ru_stime
+    return cpuSeconds
+
+class StageMetric:
+    def __init__(self, stage, node=''):
+        self.stage = stage
+        self.node = node
+        self.files = 0
+        self.bytes = 0
+        self.result = ''
+        self.started = datetime.datetime.now().isoformat(timespec='milliseconds')
+        self.wallStart = time.perf_counter()
+        self.cpuStart = getCpuSeconds()
+        self.peakRssStart = getPeakRssMb()
+        self.wallSeconds = 0.0
+        self.cpuSeconds = 0.0
+        self.rssGrowthMb = None
+
+    def add(self, files=0, bytes=0):
+        with _stageMetricsLock:
+            self.files = self.files + files
+            self.bytes = self.bytes + bytes
+
+    def stop(self):
+        self.wallSeconds = time.perf_counter() - self.wallStart
+        self.cpuSeconds = getCpuSeconds() - self.cpuStart
+        if self.peakRssStart is not None:
+            self.rssGrowthMb = getPeakRssMb() - self.peakRssStart
+
+    def toDict(self):
+        return {'stage': self.stage, 'node': self.node, 'started': self.started, 'result': self.result,
+                'wall_seconds': round(self.wallSeconds, 6), 'cpu_seconds': round(self.cpuSeconds, 6),
+                'files': self.files, 'bytes': self.bytes,
+                'mb_per_s': round((self.bytes / 1024 / 1024) / self.wallSeconds, 3) if self.wallSeconds > 0 else 0.0,
+                'rss_growth_mb': round(self.rssGrowthMb, 1) if self.rssGrowthMb is not None else None}
+
+@contextmanager
+def measureStage(stage, node=''):
+    metric = StageMetric(stage, node)
+    with _stageMetricsLock:
+        _openStageMetrics.setdefault((stage, node), []).append(metric)
+    try:
+        yield metric
+    finally:
+        metric.stop()
+        with _stageMetricsLock:
+            _openStageMetrics[(stage, node)].remove(metric)
+            _stageMetrics.append(metric)
+
+def measuredStage(stage):
+    # Decorator: wall and CPU time of each call, result is saved when function returns 'OK'/'ERROR' or (result, ...)
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with measureStage(stage) as metric:
+                result = function(*args, **kwargs)
+                stageResult = result[0] if isinstance(result, tuple) and len(result) > 0 else result
+                metric.result = stageResult if isinstance(stageResult, str) else ''
+            return result
+        return wrapper
+    return decorator
+
+def addStageCounters(stage, files=0, bytes=0, node=''):
+    # Counters are added to the stage that is running (last one when it is nested), they are ignored when stage is not measured
+    with _stageMetricsLock:
+        openMetrics = _openStageMetrics.get((stage, node))
+        metric = openMetrics[-1] if openMetrics else None
+    if metric is not None:
+        metric.add(files, bytes)
+
+def getStageMetrics():
+    with _stageMetricsLock:
+        return [metric.toDict() for metric in _stageMetrics]
+
+def resetStageMetrics():
+    with _stageMetricsLock:
+        _stageMetrics.clear()
+
+def getAggregatedStageMetrics():
+    # Stages called several times in a run (createTarfile of each month) are added by stage and node
+    aggregated = {}
+    for metric in getStageMetrics():
+        key = (metric['stage'], metric['node'])
+        if key not in aggregated:
+            aggregated[key] = dict(metric, calls=0)
+        else:
+            total = aggregated[key]
+            for value in ['wall_seconds', 'cpu_seconds', 'files', 'bytes']:
+                total[value] = round(total[value] + metric[value], 6)
+            if metric['rss_growth_mb'] is not None:
+                total['rss_growth_mb'] = round((total['rss_growth_mb'] or 0) + metric['rss_growth_mb'], 1)
+            total['result'] = 'ERROR' if 'ERROR' in [total['result'], metric['result']] else metric['result']
+        aggregated[key]['calls'] = aggregated[key]['calls'] + 1
+    for total in aggregated.values():
+        total['mb_per_s'] = round((total['bytes'] / 1024 / 1024) / total['wall_seconds'], 3) if total['wall_seconds'] > 0 else 0.0
+    return list(aggregated.values())
+
+def getMetricsSummary():
+    lines = ['Stage metrics:', '']
+    lines.append('\t' + '\t'.join(['Stage', 'Node', 'Result', 'Wall s', 'CPU s', 'Files', 'MB', 'MB/s', 'RSS growth MB']))
+    for metric in getStageMetrics():
+        lines.append('\t' + '\t'.join([metric['stage'], metric['node'], metric['result'], f"{metric['wall_seconds']:.3f}", f"{metric['cpu_seconds']:.3f}",
+                                         str(metric['files']), f"{metric['bytes'] / 1024 / 1024:.2f}", f"{metric['mb_per_s']:.2f}",
+                                         f"{metric['rss_growth_mb']:.1f}" if metric['rss_growth_mb'] is not None else '']))
+    return '\n'.join(lines) + '\n'
+
+def writeMetricsJson(filename):
+    with open(filename, 'w') as metricsFile:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'stages': getStageMetrics()}, metricsFile, indent=2)
+    return filename
+
+def writeMetricsPrometheus(filename, job):
+    # Textfile collector reads whole files: file is written with another name and renamed
+    values = {'calls': 'Calls of stage in run', 'wall_seconds': 'Wall time of stage in seconds', 'cpu_seconds': 'CPU time of stage thread and finished child processes in seconds', 'files': 'Files processed by stage',
+              'bytes': 'Bytes processed by stage', 'mb_per_s': 'Throughput of stage in MB/s', 'rss_growth_mb': 'Growth of process peak resident memory during stage in MB'}
+    stageMetrics = getAggregatedStageMetrics()
+    lines = []
+    for value, description in values.items():
+        name = f'audit_etl_stage_{value}'
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        for metric in stageMetrics:
+            if metric[value] is not None:
+                lines.append(f'{name}{{job="{job}",stage="{metric["stage"]}",node="{metric["node"]}"}} {metric[value]}')
+    tmpFilename = f'{filename}.tmp'
+    with open(tmpFilename, 'w') as metricsFile:
+        metricsFile.write('\n'.join(lines) + '\n')
+    os.replace(tmpFilename, filename)
+    return filename
+
+def writeMetrics(metrics_dir, job):
+    # {metrics_dir}/{job}_metrics_{datetime}.json and {metrics_dir}/audit_etl_{job}.prom (last run)
+    os.makedirs(metrics_dir, exist_ok=True)
+    logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    jsonFilename = writeMetricsJson(f'{metrics_dir}/{job}_metrics_{logFileDateStr}.json')
+    promFilename = writeMetricsPrometheus(f'{metrics_dir}/audit_etl_{job}.prom', job)
+    return jsonFilename, promFilename
@@ -0,0 +1,185 @@
+"""
+Util module contains the persistent parse cache of the activity report.
+
+Report rows found in each AUD file are saved in a SQLite database (see parse_cache parameters in [ACTIVITY_REPORT] section of config.properties).
+A cached file is not parsed again while its size, mtime, checksum (when it is known from manifest) and the parser version are the same,
+so a daily monthly report only parses the files loaded since last execution.
+Least recently used files are evicted when cache size is bigger than parse_cache_max_mb.
+A file that only grew since it was parsed (zengine appends to the current AUD file) is not parsed again from line 1: the checkpoint saved with its rows
+(byte offset and line number after last complete line, rows found before it and pending multi-line statement of text scanner) is used to parse only appended bytes.
+A checkpoint is valid while the bytes before its offset are the same (first and last CHECKPOINT_HASH_BYTES bytes are compared).
+
+Imports:
+    - os
+    - json
+    - sqlite3
+    - time
+    - hashlib
+    - Util_files.getChecksumFile
+
+Functions:
+    1. getParserVersion()
+    2. openParseCache(cachePath)
+    3. getCachedParse(connection, path, size, mtime, checksum='', scanner='text')
+    4. getCheckpointHash(path, offset)
+    5. getParseCheckpoint(connection, path, scanner='text')
+    6. putCachedParse(connection, path, size, mtime, checksum, scanner, rows, lines, checkpoint=None)
+    7. evictParseCache(connection, max_mb)
+
+Usage Examples:
+    >>> connection = openParseCache('/root/Scripts/reports/activity_parse_cache.sqlite')
+    >>> putCachedParse(connection, '/data/billdb/zengine_20240503.aud', 1024, 1714712400, '', 'text', ['row1'], 50)
+    >>> getCachedParse(connection, '/data/billdb/zengine_20240503.aud', 1024, 1714712400)
+    (['row1'], 50)
+    >>> putCachedParse(connection, '/data/billdb/zengine_20240503.aud', 1024, 1714712400, '', 'text', ['row1'], 50, (1024, 50, 1, None))
+    >>> getParseCheckpoint(connection, '/data/billdb/zengine_20240503.aud')
+    (['row1'], (1024, 50, 1, None))
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240512
+"""
+
+import os
+import json
+import sqlite3
+import time
+import hashlib
+from Util_files import getChecksumFile
+
+_parserVersion = None
+# Bytes at the beginning and before the offset of a checkpoint used to know that file was not replaced
+CHECKPOINT_HASH_BYTES = 4096
+# Columns added after first version of parsed_files table
+CHECKPOINT_COLUMNS = [('checkpoint_offset', 'INTEGER'), ('checkpoint_lines', 'INTEGER'), ('checkpoint_rows', 'INTEGER'), ('checkpoint_state', 'TEXT'), ('checkpoint_hash', 'TEXT')]
+
+def getParserVersion():
+    # Cached rows are valid only for the parser code that created them
+    global _parserVersion
+    if _parserVersion is None:
+        scriptsDir = os.path.dirname(os.path.abspath(__file__))
+        _parserVersion = '-'.join(getChecksumFile(os.path.join(scriptsDir, script)) for script in ['Activity_report_generator.py', 'Util_string.py'])
+    return _parserVersion
+
+def openParseCache(cachePath):
+    connection = sqlite3.connect(cachePath)
+    connection.execute('''CREATE TABLE IF NOT EXISTS parsed_files (
+                            path TEXT PRIMARY KEY,
+                            size INTEGER,
+                            mtime INTEGER,
+                            checksum TEXT,
+                            scanner TEXT,
+                            parser_version TEXT,
+                            lines INTEGER,
+                            rows TEXT,
+                            stored_bytes INTEGER,
+                            last_used REAL)''')
+    connection.execute('CREATE INDEX IF NOT EXISTS parsed_files_last_used ON parsed_files (last_used)')
+    # Caches created before checkpoints were saved are migrated
+    columns = [column[1] for column in connection.execute('PRAGMA table_info(parsed_files)')]
+    for column, columnType in CHECKPOINT_COLUMNS:
+        if column not in columns:
+            connection.execute(f'ALTER TABLE parsed_files ADD COLUMN {column} {columnType}')
+    connection.commit()
+    return connection
+
+def getCachedParse(connection, path, size, mtime, checksum='', scanner='text'):
+    """
+    Returns (rows, lines) saved for the file, or None when file is not cached or it changed
+
+    Examples:
+        >>> connection = openParseCache(':memory:')
+        >>> putCachedParse(connection, '/data/billdb/zengine_20240503.aud', 1024, 1714712400, 'a1', 'text', ['row1'], 50)
+        >>> getCachedParse(connection, '/data/billdb/zengine_20240503.aud', 1024, 1714712400, 'a1')
+        (['row1'], 50)
+
+        Other size, mtime, checksum or scanner invalidate the saved rows:
+        >>> [getCachedParse(connection, '/data/billdb/zengine_20240503.aud', *changed) for changed in [(2048, 1714712400, 'a1'), (1024, 1714712460, 'a1'), (1024, 1714712400, 'b2'), (1024, 1714712400, 'a1', 'mmap')]]
+        [None, None, None, None]
+
+        Rows saved by another version of the parser code are not used:
+        >>> import Util_parse_cache
+        >>> parserVersion, Util_parse_cache._parserVersion = getParserVersion(), 'other-parser-version'
+        >>> getCachedParse(connection, '/data/billdb/zengine_20240503.aud', 1024, 1714712400, 'a1') is None
+        True
+        >>> Util_parse_cache._parserVersion = parserVersion
+    """
+    cached = connection.execute('SELECT size, mtime, checksum, scanner, parser_version, lines, rows FROM parsed_files WHERE path = ?', (path,)).fetchone()
+    if cached is None:
+        return None
+    cachedSize, cachedMtime, cachedChecksum, cachedScanner, cachedParserVersion, lines, rows = cached
+    if cachedSize != size or cachedMtime != int(mtime) or cachedScanner != scanner or cachedParserVersion != getParserVersion():
+        return None
+    if checksum != '' and cachedChecksum != '' and checksum != cachedChecksum:
+        return None
+    connection.execute('UPDATE parsed_files SET last_used = ? WHERE path = ?', (time.time(), path))
+    return json.loads(rows), lines
+
+def getCheckpointHash(path, offset):
+    # md5 of the first and the last CHECKPOINT_HASH_BYTES bytes before offset
+    hasher = hashlib.md5()
+    with open(path, 'rb') as myfile:
+        hasher.update(myfile.read(min(offset, CHECKPOINT_HASH_BYTES)))
+        myfile.seek(max(0, offset - CHECKPOINT_HASH_BYTES))
+        hasher.update(myfile.read(offset - myfile.tell()))
+    return hasher.hexdigest()
+
+def getParseCheckpoint(connection, path, scanner='text'):
+    """
+    Returns (rows, checkpoint) saved for a file that changed since it was parsed, or None when file has no valid checkpoint.
+    rows are all rows saved for the file, the first checkpoint[2] ones were found before checkpoint offset.
+    checkpoint is (offset, lines, rowCount, state), see Activity_report_generator.parseAudFileTail
+
+    Examples:
+        A file that grew keeps its checkpoint, a file whose bytes before the checkpoint changed does not:
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'zengine_20240503.aud')
+        >>> with open(path, 'wb') as audFile:
+        ...     _ = audFile.write(b'UTC-4:00 2024-05-03 00:00:00.001\\n')
+        >>> connection = openParseCache(':memory:')
+        >>> putCachedParse(connection, path, 33, 1714712400, '', 'text', ['row1'], 1, (33, 1, 1, None))
+        >>> with open(path, 'ab') as audFile:
+        ...     _ = audFile.write(b'LENGTH: "228"\\n')
+        >>> getParseCheckpoint(connection, path)
+        (['row1'], (33, 1, 1, None))
+        >>> with open(path, 'r+b') as audFile:
+        ...     _ = audFile.write(b'UTC-4:00 2024-05-04')
+        >>> getParseCheckpoint(connection, path) is None
+        True
+        >>> os.remove(path)
+    """
+    cached = connection.execute('SELECT scanner, parser_version, rows, checkpoint_offset, checkpoint_lines, checkpoint_rows, checkpoint_state, checkpoint_hash FROM parsed_files WHERE path = ?', (path,)).fetchone()
+    if cached is None:
+        return None
+    cachedScanner, cachedParserVersion, rows, offset, lines, rowCount, state, checkpointHash = cached
+    if offset is None or cachedScanner != scanner or cachedParserVersion != getParserVersion():
+        return None
+    if not os.path.exists(path) or os.path.getsize(path) < offset or getCheckpointHash(path, offset) != checkpointHash:
+        return None
+    connection.execute('UPDATE parsed_files SET last_used = ? WHERE path = ?', (time.time(), path))
+    return json.loads(rows), (offset, lines, rowCount, json.loads(state))
+
+def putCachedParse(connection, path, size, mtime, checksum, scanner, rows, lines, checkpoint=None):
+    # checkpoint: (offset, lines, rowCount, state) to resume parsing when file grows. None: file is parsed again from line 1
+    rowsJson = json.dumps(rows)
+    checkpointValues = (None, None, None, None, None)
+    if checkpoint is not None:
+        offset, checkpointLines, rowCount, state = checkpoint
+        checkpointValues = (offset, checkpointLines, rowCount, json.dumps(state), getCheckpointHash(path, offset))
+    connection.execute('INSERT OR REPLACE INTO parsed_files (path, size, mtime, checksum, scanner, parser_version, lines, rows, stored_bytes, last_used, checkpoint_offset, checkpoint_lines, checkpoint_rows, checkpoint_state, checkpoint_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (path, size, int(mtime), checksum, scanner, getParserVersion(), lines, rowsJson, len(rowsJson), time.time()) + checkpointValues)
+
+def evictParseCache(connection, max_mb):
+    # Least recently used files are deleted until cached rows size is lower than max_mb
+    evicted = 0
+    maxBytes = float(max_mb) * 1024 * 1024
+    totalBytes = connection.execute('SELECT COALESCE(SUM(stored_bytes), 0) FROM parsed_files').fetchone()[0]
+    if totalBytes > maxBytes:
+        for path, storedBytes in connection.execute('SELECT path, stored_bytes FROM parsed_files ORDER BY last_used').fetchall():
+            if totalBytes <= maxBytes:
+                break
+            connection.execute('DELETE FROM parsed_files WHERE path = ?', (path,))
+            totalBytes = totalBytes - storedBytes
+            evicted = evicted + 1
+    connection.commit()
+    return evicted
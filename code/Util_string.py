@@ -8,6 +8,86 @@ Last update: 20240510
 """
 
 import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Fields of one AUD record statement line. sqltext_complete is False when SQLTEXT continues in next lines
+AudRecord = namedtuple('AudRecord', ['sessionid', 'stmtid', 'user', 'host', 'action', 'returncode', 'sqltext', 'sqltext_length', 'sqltext_complete'])
+
+@lru_cache(maxsize=256)
+def getSplitPattern(separator):
+    return re.compile(separator, flags=re.IGNORECASE)
+
+
+def tokenizeAudRecord(line):
+    """
+    Reads all fields of an AUD statement line walking it once and using the KEY:[len] "value" length prefixes, without regular expressions.
+
+    Args:
+        line (str): The statement line of the record.
+
+    Returns:
+        AudRecord: Fields SESSIONID, STMTID, USER, HOST, ACTION, RETURNCODE and SQLTEXT.
+            When SQLTEXT continues in next lines, sqltext has the text found in this line and sqltext_complete is False.
+            Missing fields are empty strings.
+
+    Examples:
+        >>> record = tokenizeAudRecord('SESSIONID:[2] "75" STMTID:[1] "0" USER:[15] "LONG_USER_NAME1" HOST:[9] "127.0.0.1" ACTION:[7] "EXECUTE" RETURNCODE:[8] "GS-00000" SQLTEXT:[24] "TRUNCATE TABLE SCHEM1.T1"')
+        >>> record.user, record.host, record.action, record.sqltext
+        ('LONG_USER_NAME1', '127.0.0.1', 'EXECUTE', 'TRUNCATE TABLE SCHEM1.T1')
+        >>> tokenizeAudRecord('SESSIONID:[3] "977" USER:[4] "USR1" SQLTEXT:[79] " \\n').sqltext_complete
+        False
+
+        Values are read by their declared length, so quotes, spaces and KEY:[ inside them do not split fields:
+        >>> record = tokenizeAudRecord('SESSIONID:[2] "75" USER:[4] "U:[1" HOST:[0] "" ACTION:[6] "SELECT" SQLTEXT:[20] "SELECT "A B" FROM T1"\\n')
+        >>> record.user, record.host, record.action, record.sqltext, record.sqltext_complete
+        ('U:[1', '', 'SELECT', 'SELECT "A B" FROM T1', True)
+
+        Declared length counts bytes: with multibyte characters the closing quote at end of line ends the text:
+        >>> record = tokenizeAudRecord('SESSIONID:[2] "75" SQLTEXT:[20] "SELECT ÑAME FROM T1"\\r\\n')
+        >>> record.sqltext, record.sqltext_length, record.sqltext_complete
+        ('SELECT ÑAME FROM T1', 20, True)
+
+        Missing fields are empty, a record without SQLTEXT is not complete:
+        >>> tokenizeAudRecord('SESSIONID:[2] "75" ACTION:[6] "SELECT"\\n')
+        AudRecord(sessionid='75', stmtid='', user='', host='', action='SELECT', returncode='', sqltext='', sqltext_length=0, sqltext_complete=False)
+    """
+    fields = {}
+    sqltextLength = 0
+    sqltextComplete = False
+    position = 0
+    lineLength = len(line)
+    while True:
+        bracket = line.find(':[', position)
+        if bracket < 0:
+            break
+        key = line[line.rfind(' ', 0, bracket) + 1:bracket]
+        close = line.find(']', bracket + 2)
+        valueStart = line.find('"', close) + 1
+        if close < 0 or valueStart == 0:
+            break
+        length = int(line[bracket + 2:close])
+        valueEnd = valueStart + length
+        if key == 'SQLTEXT':
+            # SQLTEXT is the last field of the line, it could continue in next lines
+            sqltextLength = length
+            if valueEnd < lineLength and line[valueEnd] == '"':
+                sqltextComplete = True
+            else:
+                lastQuote = line.rstrip('\r\n').rfind('"')
+                if lastQuote >= valueStart and lastQuote == len(line.rstrip('\r\n')) - 1:
+                    # Declared length does not match decoded text (multibyte characters): closing quote ends the text
+                    valueEnd = lastQuote
+                    sqltextComplete = True
+                else:
+                    valueEnd = lineLength
+            fields[key] = line[valueStart:valueEnd]
+            break
+        fields[key] = line[valueStart:valueEnd]
+        position = valueEnd + 1
+    return AudRecord(fields.get('SESSIONID', ''), fields.get('STMTID', ''), fields.get('USER', ''), fields.get('HOST', ''), fields.get('ACTION', ''),
+                     fields.get('RETURNCODE', ''), fields.get('SQLTEXT', ''), sqltextLength, sqltextComplete)
+
 
 
 def getAuditedActivity(line):
@@ -70,7 +150,7 @@ def getNextData(line, toGetNextWordFrom):
         'over'
     """    
     try:
-        result = re.split(toGetNextWordFrom, line, flags=re.IGNORECASE)[1].split(" ")[0]
+        result = getSplitPattern(toGetNextWordFrom).split(line, maxsplit=2)[1].split(" ")[0]
     except Exception as e:
         result=''    
     return result
@@ -97,8 +177,8 @@ def getDataBetween(line, initialStr, endStr, toGetNextWordFrom=""):
         'jumps'
     """   
     try: 
-        result1 = re.split(initialStr, line, flags=re.IGNORECASE)[1]
-        result = re.split(endStr,result1, flags=re.IGNORECASE)[0]
+        result1 = getSplitPattern(initialStr).split(line, maxsplit=2)[1]
+        result = getSplitPattern(endStr).split(result1, maxsplit=1)[0]
         if result == result1:
             # it means there is no endStr
             result = ''
@@ -7,10 +7,18 @@ Last update: 20240511
 """
 
 modules = ['os', 'logging', 'configparser', 're', 'datetime', 'traceback', 'glob', 'sys', 'shutil', 'hashlib','smtplib', 'paramiko','tarfile','base64'
-           ,'from Util_string import getAuditedActivity, getDataBetween, getObjectNameFromQuery'
+           ,'from Util_string import getAuditedActivity, getDataBetween, getObjectNameFromQuery, tokenizeAudRecord'
+           ,'from Util_matcher import getDateFileMatcher, getContainsMatcher'
+           ,'from Util_parse_cache import openParseCache, getCachedParse, putCachedParse, evictParseCache'
+           ,'from Util_files import getArchiveFilename, createIndexedArchive, readArchiveIndex, openIndexedArchiveMember, checkArchiveIndex, createContentArchive, readContentArchive, openContentArchiveMember'
+           ,'from Util_files import startPipelineStage, stopPipelineStage'
+           ,'from Util_compression import openCompressedWriter, openCompressedReader, ParallelGzipWriter'
+           ,'from Util_metrics import measureStage, measuredStage, addStageCounters, getMetricsSummary, writeMetrics'
+           ,'from Util_activity_store import storeActivityRows, readActivityRows, closeActivityStores, queryActivityStore, joinActivityRow'
            ,'from scp import SCPClient'
-           ,'from Util_files import deleteDirContent, createSSHClient, read_config, createAudFilesInLocalDir, writeScriptsChecksumInLog, getFilesQuantityInRemoteDir, getParamikoSSHCLient, getFilesQuantityInDir, compressFiles'
+           ,'from Util_files import deleteDirContent, read_config, createAudFilesInLocalDir, writeScriptsChecksumInLog, getFilesQuantityInRemoteDir, getFilesQuantityInDir, compressFiles, getSSHSessionPool, closeSSHSessionPools, getChecksumFiles'
            ,'from Extractor import extractor'
+           ,'from Watch_and_load import watch_and_load'
            ,'from Loader_by_db import loader_by_db'
            ,'from Compress_aud_files import compress_aud_files'
            ,'from os.path import basename'
@@ -0,0 +1,322 @@
+"""
+Module: Watch_and_load
+
+A module that runs as a daemon loading AUD files a few minutes after they are written in CBS server, instead of the
+batch of Extract_and_load that extracts files old_files_in_days_to_be_extracted days later.
+
+Algorithm:
+    Each watch_interval_seconds, node directories of CBS server (cbs_sub_dir_list_audit_files) are listed using one SFTP session
+    A file of last watch_days days is complete when:
+        - its size and modification time did not change during stable_polls polls, or
+        - a newer file exists in its node directory (zengine appends only to the last file)
+    Each complete file is:
+        - copied to local_dir_audit_files/{YYYYMMDD}/{node} by incremental sync (only new bytes are transferred) and its checksum saved in day manifest
+        - placed by database in local_dir_audit_files_by_db (organizeAuditFile) and its checksum saved in db manifest.
+          With placement_strategy = move files are placed as hardlinks (copy when it is not possible): local copy is kept,
+          so a file that grows is synced from its last byte instead of being transferred again
+        - parsed searching for audited activities: activities are appended to {local_dir_reports}/activity_watch_{YYYYMMDD}.txt
+          and saved in activity store when activity_store = 1 ([ACTIVITY_REPORT])
+    A file already copied is loaded again only when it grows, and only activities in its new lines are reported:
+    it is parsed from the checkpoint saved in {local_dir_reports}/activity_parse_cache.sqlite (see Activity_report_generator.parseAudFileTail),
+    so only appended bytes are read, also after daemon is restarted. Least recently used files are evicted from cache after each poll (parse_cache_max_mb)
+    An error loading one file is logged and next files are loaded, the file is loaded again in next poll (from its local copy when it is complete)
+
+Configuration ([WATCH] section of config.properties):
+    watch_interval_seconds, watch_days, stable_polls
+
+Extract_and_load can still run each day with extraction_mode = sync: files loaded by this daemon are not transferred again.
+
+Imports:
+    - os
+    - re
+    - sys
+    - time
+    - logging
+    - datetime
+    - traceback
+    - Extractor.syncAudFileFromNode
+    - Loader_by_db.organizeAuditFile
+    - Activity_report_generator.parseAudFileTail
+    - Activity_report_generator.getSqlTextLimits
+    - Activity_report_generator.getParseCacheScanner
+    - Util_parse_cache.openParseCache
+    - Util_parse_cache.getParseCheckpoint
+    - Util_parse_cache.putCachedParse
+    - Util_parse_cache.evictParseCache
+    - Util_files.read_config
+    - Util_files.writeScriptsChecksumInLog
+    - Util_files.getSSHSessionPool
+    - Util_files.closeSSHSessionPools
+    - Util_files.getChecksumManifestPath
+    - Util_files.updateChecksumManifest
+    - Util_files.getChecksumManifestEntry
+    - Util_files.invalidateFileCatalog
+    - Util_files.clearFileCatalog
+    - Util_files.getChecksumFile
+    - Util_activity_store.storeActivityRows
+    - Util_activity_store.closeActivityStores
+    - Util_metrics.measureStage
+    - Util_metrics.addStageCounters
+    - Util_metrics.writeMetricsPrometheus
+    - Util_metrics.resetStageMetrics
+
+Functions:
+    1. getAudFileDate(filename)
+    2. getWatchedDays(watch_days)
+    3. getFilesReadyToLoad(attrs, subdir, observed, stable_polls=1)
+    4. loadAudFile(sftp, sourceDir, subdir, attr, settings, storeConnections, cacheConnection, reload=False)
+    5. watchPoll(sessionPool, settings, observed, storeConnections, cacheConnection, failedKeys)
+    6. watch_and_load(polls=0)
+    7. main()
+
+Usage Examples:
+    1. Daemon, runs until it is stopped:
+    $ python.exe Watch_and_load.py
+
+    2. Only 3 polls:
+    $ python.exe Watch_and_load.py "3"
+
+Author: Victor Hugo Gonzales Alvarez
+email: gonzalesv@tigo.net.bo, vicogo@gmail.com
+Last update: 20240513
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import datetime
+import traceback
+from Extractor import syncAudFileFromNode
+from Loader_by_db import organizeAuditFile
+from Activity_report_generator import parseAudFileTail, getSqlTextLimits, getParseCacheScanner
+from Util_parse_cache import openParseCache, getParseCheckpoint, putCachedParse, evictParseCache
+from Util_files import read_config, writeScriptsChecksumInLog, getSSHSessionPool, closeSSHSessionPools, getChecksumManifestPath, updateChecksumManifest, getChecksumManifestEntry, invalidateFileCatalog, clearFileCatalog, getChecksumFile
+from Util_activity_store import storeActivityRows, closeActivityStores
+from Util_metrics import measureStage, addStageCounters, writeMetricsPrometheus, resetStageMetrics
+
+# zengine_20240503134936581.aud -> 20240503
+AUD_FILE_DATE = re.compile(r'_(\d{8})\d*\.aud$')
+
+def getAudFileDate(filename):
+    """
+    Examples:
+        >>> getAudFileDate('zengine_20240503134936581.aud')
+        '20240503'
+        >>> getAudFileDate('zengine.log')
+        ''
+    """
+    match = AUD_FILE_DATE.search(filename)
+    return match.group(1) if match else ''
+
+def getWatchedDays(watch_days):
+    # Today and previous days (YYYYMMDD)
+    today = datetime.datetime.now()
+    return set((today - datetime.timedelta(days=day)).strftime('%Y%m%d') for day in range(max(1, int(watch_days))))
+
+def getFilesReadyToLoad(attrs, subdir, observed, stable_polls=1):
+    # observed: {subdir/filename: (size, mtime, unchanged polls)} updated by each poll
+    ready = []
+    newestFilename = max(attr.filename for attr in attrs) if attrs else ''
+    for attr in sorted(attrs, key=lambda attr: attr.filename):
+        key = f'{subdir}/{attr.filename}'
+        previous = observed.get(key)
+        unchangedPolls = previous[2] + 1 if previous is not None and previous[:2] == (attr.st_size, attr.st_mtime) else 0
+        observed[key] = (attr.st_size, attr.st_mtime, unchangedPolls)
+        if attr.filename != newestFilename or unchangedPolls >= int(stable_polls):
+            ready.append(attr)
+    return ready
+
+def loadAudFile(sftp, sourceDir, subdir, attr, settings, storeConnections, cacheConnection, reload=False):
+    # Returns True when file was transferred (it is new or it grew) or reloaded
+    # reload: load of file failed in a previous poll, it is loaded again also when its local copy is up to date
+    fileDateStr = getAudFileDate(attr.filename)
+    dayDir = f'{settings["destinyDir"]}/{fileDateStr}'
+    relPath = f'{subdir}/{attr.filename}'
+    localPath = f'{dayDir}/{relPath}'
+    os.makedirs(os.path.dirname(localPath), exist_ok=True)
+    checksum, offset, transferredBytes = syncAudFileFromNode(sftp, f'{sourceDir}/{relPath}', localPath, attr, settings['checksum_algorithm'])
+    if checksum is None:
+        if not reload:
+            return False
+        checksum = getChecksumFile(localPath, settings['checksum_algorithm'])
+    updateChecksumManifest(getChecksumManifestPath(dayDir), {relPath: getChecksumManifestEntry(localPath, checksum, settings['checksum_algorithm'])})
+    destFilename, destPath, usedStrategy = organizeAuditFile(dayDir, settings['localDirOrganizedByDB'], relPath, settings['placement_strategy'])
+    updateChecksumManifest(getChecksumManifestPath(f'{settings["localDirOrganizedByDB"]}/{fileDateStr}'), {destFilename: getChecksumManifestEntry(destPath, checksum, settings['checksum_algorithm'])})
+    invalidateFileCatalog(dayDir)
+    addStageCounters('watch_poll', files=1, bytes=transferredBytes)
+    logging.info(f'Loaded {relPath} -> {destFilename} ({transferredBytes} bytes{f", resumed from byte {offset}" if offset > 0 else ""})')
+    # Activity detection: file is parsed from last checkpoint and only activities not reported before are reported
+    cacheScanner = getParseCacheScanner('text', settings['sqltext_limits'])
+    checkpointed = getParseCheckpoint(cacheConnection, destPath, cacheScanner)
+    reportedRows, checkpoint = ([], None) if checkpointed is None else checkpointed
+    rows, lines, error, newCheckpoint = parseAudFileTail(destPath, checkpoint, settings['sqltext_limits'])
+    if checkpoint is not None:
+        rows = reportedRows[:checkpoint[2]] + rows
+        if newCheckpoint is not None:
+            newCheckpoint = (newCheckpoint[0], newCheckpoint[1], checkpoint[2] + newCheckpoint[2], newCheckpoint[3])
+    if error is not None:
+        logging.error('Exception occurred:' )
+        logging.error(f'{error[0]}')
+        logging.error(f'Traceback: {error[1]}')
+        logging.error(f'Error ocurred when processing file {destPath} in line {lines}:')
+        logging.error(f'{error[2]}')
+    else:
+        fileStats = os.stat(destPath)
+        putCachedParse(cacheConnection, destPath, fileStats.st_size, fileStats.st_mtime, checksum, cacheScanner, rows, lines, newCheckpoint)
+        cacheConnection.commit()
+    fileRows = rows
+    rows = rows[len(reportedRows):]
+    if len(rows) > 0:
+        reportFilename = f'{settings["local_dir_reports"]}/activity_watch_{fileDateStr}.txt'
+        newReport = not os.path.exists(reportFilename)
+        with open(reportFilename, 'a') as reportFile:
+            if newReport:
+                reportFile.write("Fecha y Hora        " + "\tUsuario de BD" + "\tHostname" + "\tLinea" + "\tActividad" + "\tSchema" + "\tTable" + "\tQuery" + "\tArchivo\n")
+            for row in rows:
+                reportFile.write(f'{row}\n')
+        if settings['activity_store_dir'] != '':
+            # All rows of the file replace the stored ones: a file loaded again (i.e. after a restart) is not stored twice
+            if error is None:
+                storeActivityRows(storeConnections, settings['activity_store_dir'], subdir.split('-')[0], fileRows, [destPath])
+            else:
+                storeActivityRows(storeConnections, settings['activity_store_dir'], subdir.split('-')[0], rows)
+            for connection in storeConnections.values():
+                connection.commit()
+        logging.info(f'Audited activities found in {destFilename}: {len(rows)}')
+    return True
+
+def watchPoll(sessionPool, settings, observed, storeConnections, cacheConnection, failedKeys):
+    # failedKeys: subdir/filename of files whose load failed, they are loaded again in next polls
+    result = 'OK'
+    fileCounter = 0
+    # Local directories may have been changed by Extract_and_load or other processes since last poll
+    clearFileCatalog()
+    try:
+        watchedDays = getWatchedDays(settings['watch_days'])
+        with sessionPool.session() as session:
+            sftp = session.sftp()
+            listedKeys = set()
+            for subdir in settings['subdirList']:
+                attrs = [attr for attr in sftp.listdir_attr(f'{settings["sourceDir"]}/{subdir}') if getAudFileDate(attr.filename) in watchedDays]
+                listedKeys.update(f'{subdir}/{attr.filename}' for attr in attrs)
+                for attr in getFilesReadyToLoad(attrs, subdir, observed, settings['stable_polls']):
+                    key = f'{subdir}/{attr.filename}'
+                    try:
+                        if loadAudFile(sftp, settings['sourceDir'], subdir, attr, settings, storeConnections, cacheConnection, key in failedKeys):
+                            fileCounter = fileCounter + 1
+                        failedKeys.discard(key)
+                    except Exception as e:
+                        failedKeys.add(key)
+                        logging.error('Exception occurred:' )
+                        logging.error(f'Error loading {subdir}/{attr.filename}')
+                        logging.error(f'{e}')
+                        logging.error(f'Traceback: {traceback.format_exc()}')
+                        result = 'ERROR'
+                        # Without connection next files can not be loaded: session is opened again in next poll
+                        if not session.isActive():
+                            raise
+            # Files deleted in server or out of watched days are forgotten
+            for key in set(observed) - listedKeys:
+                del observed[key]
+            failedKeys.intersection_update(listedKeys)
+        if fileCounter > 0:
+            logging.info(f'Files loaded in poll: {fileCounter}')
+            evicted = evictParseCache(cacheConnection, settings['parse_cache_max_mb'])
+            if evicted > 0:
+                logging.info(f'Files evicted from parse cache: {evicted}')
+    except Exception as e:
+        logging.error('Exception occurred:' )
+        logging.error(f'server={sessionPool.host}, port={sessionPool.port}')
+        logging.error(f'{e}')
+        logging.error(f'Traceback: {traceback.format_exc()}')
+        result = 'ERROR'
+    return result
+
+def watch_and_load(polls=0):
+    # polls: number of polls before stopping. 0: daemon runs until it is stopped
+    config = read_config(f'{os.path.dirname(os.path.abspath(__file__))}\\config.properties')
+    #
+    cbs_config = config['CBS_SERVER']
+    local_server = config['LOCAL_SERVER']
+    extractionConfig = config['EXTRACTION']
+    activity_report_config = config['ACTIVITY_REPORT']
+    settings = {'sourceDir': cbs_config['cbs_base_dir_audit_files'],
+                'subdirList': [subdir for subdir in cbs_config['cbs_sub_dir_list_audit_files'].split('\n') if subdir != ''],
+                'destinyDir': local_server['local_dir_audit_files'],
+                'localDirOrganizedByDB': local_server['local_dir_audit_files_by_db'],
+                'local_dir_reports': local_server['local_dir_reports'],
+                'checksum_algorithm': extractionConfig.get('checksum_algorithm', 'md5'),
+                'placement_strategy': config.get('LOAD', 'placement_strategy', fallback='copy'),
+                'parse_cache_max_mb': int (activity_report_config.get('parse_cache_max_mb', '512')),
+                'activity_store_dir': f'{local_server["local_dir_reports"]}/activity_store' if activity_report_config.get('activity_store', '0') == '1' else '',
+                'sqltext_limits': getSqlTextLimits(config, local_server['local_dir_reports']),
+                'watch_days': int(config.get('WATCH', 'watch_days', fallback='2')),
+                'stable_polls': int(config.get('WATCH', 'stable_polls', fallback='1'))}
+    watch_interval_seconds = float(config.get('WATCH', 'watch_interval_seconds', fallback='60'))
+    keepalive_interval = int (cbs_config.get('keepalive_interval', '30'))
+    local_dir_scripts = local_server['local_dir_scripts']
+    metrics = config.get('METRICS', 'metrics', fallback='0')
+    metrics_dir = config.get('METRICS', 'metrics_dir', fallback='') or local_server['local_dir_logs']
+    #
+    logFileDateStr = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    log_filename = f'{local_server["local_dir_logs"]}/watch_and_load_{logFileDateStr}.log'
+    logging_defined_before = logging.getLogger().hasHandlers()
+    if not logging_defined_before:
+        logging.basicConfig(filename= f'{log_filename}', level=logging.INFO, format='%(asctime)s\t%(message)s', datefmt='%Y-%m-%d %I:%M:%S %p')
+    #
+    logging.info(f'Script running: {os.path.basename(__file__)}')
+    logging.info(f'Poll interval: {watch_interval_seconds} s. Watched days: {settings["watch_days"]}. Stable polls: {settings["stable_polls"]}')
+    if settings['placement_strategy'] == 'move':
+        # A moved file would be transferred again from byte 0 each time it grows
+        settings['placement_strategy'] = 'hardlink'
+        logging.info('Placement strategy move is replaced by hardlink: local copies are kept to sync only new bytes')
+    result = 'OK'
+    if not logging_defined_before:
+        logging.info('======================Chesksum script files==========================')
+        result = writeScriptsChecksumInLog(local_dir_scripts)
+    if result != 'OK':
+        return result
+    os.makedirs(settings['local_dir_reports'], exist_ok=True)
+    if metrics == '1':
+        os.makedirs(metrics_dir, exist_ok=True)
+    sessionPool = getSSHSessionPool(cbs_config['host'], cbs_config['port'], cbs_config['user'], cbs_config['password'], 1, keepalive_interval)
+    observed = {}
+    failedKeys = set()
+    cacheConnection = openParseCache(f'{settings["local_dir_reports"]}/activity_parse_cache.sqlite')
+    storeConnections = {}
+    poll = 0
+    try:
+        while polls == 0 or poll < polls:
+            poll = poll + 1
+            startTime = time.monotonic()
+            with measureStage('watch_poll') as metric:
+                metric.result = watchPoll(sessionPool, settings, observed, storeConnections, cacheConnection, failedKeys)
+            result = metric.result
+            if metrics == '1':
+                # Daemon metrics are the ones of last poll
+                writeMetricsPrometheus(f'{metrics_dir}/audit_etl_watch_and_load.prom', 'watch_and_load')
+            resetStageMetrics()
+            if polls == 0 or poll < polls:
+                time.sleep(max(0, watch_interval_seconds - (time.monotonic() - startTime)))
+    except KeyboardInterrupt:
+        logging.info('Watch stopped')
+    finally:
+        closeActivityStores(storeConnections)
+        cacheConnection.close()
+        closeSSHSessionPools()
+    return result
+
+def main():
+    #Call example: python.exe Watch_and_load.py
+    polls = 0
+    for i, arg in enumerate(sys.argv[1:], start=1):
+        #  3
+        if i==1:
+            polls = int(arg)
+    result = watch_and_load(polls)
+    print (result)
+
+if __name__ == '__main__':
+    main()